@@ -0,0 +1,126 @@
+'''
+Jitter of the ping sweeps with `PetAi` running in the same process, compared with `PetAi` isolated in a worker
+process by the supervisor.
+
+A temporary database is filled with pets and an hour of traffic and availability history, so each `PetAi` update
+does a realistic amount of pandas work. `PetAi` runs back to back, while the `Pinger` sweeps the pets on a short
+period and records how late each sweep starts and how long it takes.
+
+Run with `python -m benchmarks.service_jitter --num-pets 200 --duration-sec 20`
+'''
+import argparse
+import asyncio
+import contextlib
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pet_monitor.async_service import AsyncServiceRunner
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.pet_ai import PetAi
+from pet_monitor.ping import Pinger
+from pet_monitor.settings import (PetAISettings, PingerSettings,
+                                  SchedulerSettings, SupervisorSettings)
+from pet_monitor.supervisor import ServiceSupervisor
+
+
+# Defined at module level so they can be sent to the worker process.
+class BenchmarkPetAISettings(PetAISettings):
+    update_period_sec = 0.1
+
+
+class BenchmarkPingerSettings(PingerSettings):
+    update_period_sec = 0.25
+
+
+class BenchmarkSchedulerSettings(SchedulerSettings):
+    startup_spacing_sec = 0.0
+    jitter_sec = 0.0
+
+
+class RecordingPinger(Pinger):
+    def __init__(self, settings: PingerSettings) -> None:
+        super().__init__(settings)
+        self.delays: list[float] = []
+        self.durations: list[float] = []
+
+    async def update(self) -> None:
+        self.delays.append(self.last_delay_sec)
+        start = time.perf_counter()
+        await super().update()
+        self.durations.append(time.perf_counter() - start)
+
+
+def _fill_db(num_pets: int, history_samples: int):
+    now = int(time.time())
+    with DBInterface() as db_interface:
+        for i in range(num_pets):
+            db_interface.add_pet_info(PetInfo(f'pet{i}', IdentifierType.IP, f'127.0.{i // 250}.{i % 250 + 1}',
+                                              DeviceType.PC))
+        # One transaction for the history, instead of committing each row.
+        db_interface.conn.execute('BEGIN')
+        for i in range(num_pets):
+            for j in range(history_samples):
+                timestamp = now - (history_samples - j) * 30
+                db_interface.add_traffic_for_pet(f'pet{i}', j * 1000 * (i + 1), j * 100 * (i + 1), timestamp)
+                db_interface.add_pet_availability(f'pet{i}', j % 3 != 0, timestamp)
+        db_interface.conn.execute('COMMIT')
+
+
+def _run_for(runner: AsyncServiceRunner, duration_sec: float):
+    async def main():
+        task = asyncio.create_task(runner.run())
+        await asyncio.sleep(duration_sec)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    asyncio.run(main())
+
+
+def _print_stats(name: str, pinger: RecordingPinger):
+    # Skip the first sweep, which starts with the services.
+    delays = np.array(pinger.delays[1:]) * 1000.0
+    durations = np.array(pinger.durations[1:]) * 1000.0
+    print(f'{name}: {len(delays)} sweeps')
+    for label, values in (('start delay', delays), ('sweep time', durations)):
+        print(f'  {label:<12} p50 {np.percentile(values, 50):8.2f} ms  p95 {np.percentile(values, 95):8.2f} ms  '
+              f'max {values.max():8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-pets', type=int, default=200)
+    parser.add_argument('--history-samples', type=int, default=120)
+    parser.add_argument('--duration-sec', type=float, default=20.0)
+    args = parser.parse_args()
+
+    # PetAi logs every change in relationships.
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('pet_monitor').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        DBInterface.set_default_db_path(Path(tmp_dir) / 'benchmark.sqlite3')
+        _fill_db(args.num_pets, args.history_samples)
+
+        pinger = RecordingPinger(BenchmarkPingerSettings())
+        _run_for(AsyncServiceRunner([pinger], BenchmarkSchedulerSettings()), args.duration_sec)
+        _print_stats('Pinger alone', pinger)
+
+        pinger = RecordingPinger(BenchmarkPingerSettings())
+        pet_ai = PetAi(BenchmarkPetAISettings())
+        _run_for(AsyncServiceRunner([pinger, pet_ai], BenchmarkSchedulerSettings()), args.duration_sec)
+        _print_stats('PetAi in process', pinger)
+
+        pinger = RecordingPinger(BenchmarkPingerSettings())
+        with ServiceSupervisor(SupervisorSettings(), BenchmarkSchedulerSettings()) as supervisor:
+            supervisor.add(PetAi, BenchmarkPetAISettings())
+            _run_for(AsyncServiceRunner([pinger], BenchmarkSchedulerSettings()), args.duration_sec)
+        _print_stats('PetAi isolated', pinger)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+Microbenchmark of the per request SNMP encode and decode cost.
+
+Compares building the pysnmp message objects for every request against the cached templates, and decoding responses
+with pyasn1 against the fast path decoder.
+
+Run with `python -m benchmarks.snmp_codec`
+'''
+import timeit
+
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+from pet_monitor.snmp.codec import (PDUType, _decode_response_fast,
+                                    _decode_response_pyasn1,
+                                    get_request_template, next_request_id)
+
+# The GET issued by a device query plan. 4 CPUs, RAM, and 4 interfaces.
+QUERY_PLAN_OIDS = [f'1.3.6.1.2.1.25.3.3.1.2.{196608 + i}' for i in range(4)] + [
+    '1.3.6.1.2.1.25.2.3.1.5.1', '1.3.6.1.2.1.25.2.3.1.6.1'] + [
+    f'1.3.6.1.2.1.2.2.1.{col}.{i}' for i in range(1, 5) for col in (10, 16)]
+
+NUM_ITERATIONS = 2000
+
+
+def _encode_uncached(version: str, community: str, oids: list[str]) -> bytes:
+    # Equivalent to the original per request message construction.
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C if version == '2c' else api.SNMP_VERSION_1]
+    reqPDU = pMod.GetRequestPDU()
+    pMod.apiPDU.set_defaults(reqPDU)
+    pMod.apiPDU.set_varbinds(reqPDU, tuple((oid, pMod.Null('')) for oid in oids))
+    reqMsg = pMod.Message()
+    pMod.apiMessage.set_defaults(reqMsg)
+    pMod.apiMessage.set_community(reqMsg, community)
+    pMod.apiMessage.set_pdu(reqMsg, reqPDU)
+    return encoder.encode(reqMsg)
+
+
+def _encode_cached(version: str, community: str, oids: list[str]) -> bytes:
+    return get_request_template(version, community, PDUType.GET, tuple(oids)).encode(next_request_id())
+
+
+def _build_query_plan_response() -> bytes:
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    pdu = pMod.GetResponsePDU()
+    pMod.apiPDU.set_defaults(pdu)
+    varbinds = []
+    for oid in QUERY_PLAN_OIDS:
+        if oid.startswith('1.3.6.1.2.1.2.2.1'):
+            varbinds.append((oid, pMod.Counter32(3000000000)))
+        else:
+            varbinds.append((oid, pMod.Integer(123456)))
+    pMod.apiPDU.set_varbinds(pdu, varbinds)
+    msg = pMod.Message()
+    pMod.apiMessage.set_defaults(msg)
+    pMod.apiMessage.set_community(msg, 'public')
+    pMod.apiMessage.set_pdu(msg, pdu)
+    return encoder.encode(msg)
+
+
+def _build_arp_bulk_response(num_rows=25) -> bytes:
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    pdu = pMod.GetResponsePDU()
+    pMod.apiPDU.set_defaults(pdu)
+    pMod.apiPDU.set_varbinds(pdu, [
+        (f'1.3.6.1.2.1.4.22.1.2.1.192.168.1.{i}', pMod.OctetString(bytes([0xA4, 0x77, 0x33, 0x75, 0xBC, i])))
+        for i in range(num_rows)])
+    msg = pMod.Message()
+    pMod.apiMessage.set_defaults(msg)
+    pMod.apiMessage.set_community(msg, 'public')
+    pMod.apiMessage.set_pdu(msg, pdu)
+    return encoder.encode(msg)
+
+
+def _print_result(name: str, seconds: float):
+    print(f'{name:<40}{seconds / NUM_ITERATIONS * 1e6:10.1f} us/request')
+
+
+def main():
+    print(f'Encoding GET with {len(QUERY_PLAN_OIDS)} varbinds:')
+    _print_result('  pysnmp objects', timeit.timeit(
+        lambda: _encode_uncached('2c', 'public', QUERY_PLAN_OIDS), number=NUM_ITERATIONS))
+    _print_result('  cached template', timeit.timeit(
+        lambda: _encode_cached('2c', 'public', QUERY_PLAN_OIDS), number=NUM_ITERATIONS))
+
+    for name, data in (('query plan GET response', _build_query_plan_response()),
+                       ('25 row ARP GETBULK response', _build_arp_bulk_response())):
+        print(f'Decoding {name} ({len(data)} bytes):')
+        _print_result('  pyasn1', timeit.timeit(lambda: _decode_response_pyasn1(data, '2c'), number=NUM_ITERATIONS))
+        _print_result('  fast path', timeit.timeit(lambda: _decode_response_fast(data), number=NUM_ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
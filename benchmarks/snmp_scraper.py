@@ -0,0 +1,107 @@
+'''
+Benchmark of `SNMPScraper.update` and the `get_device_stats` helpers against the local SNMP agent simulator.
+
+The simulator runs in a separate process, and the scraper writes to a temporary database.
+
+Run with `python -m benchmarks.snmp_scraper --num-hosts 100 --non-snmp-fraction 0.5`
+'''
+import argparse
+import asyncio
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.settings import SNMPSettings
+from pet_monitor.snmp.agent_simulator import (SimulatorSettings,
+                                              get_simulated_hosts,
+                                              run_simulator)
+from pet_monitor.snmp.get_device_stats import (discover_query_plan,
+                                               get_attached_ips,
+                                               get_max_if_in_out_bytes,
+                                               get_ram_used_percent,
+                                               get_total_cpu_usage,
+                                               query_device_stats,
+                                               set_agent_port)
+from pet_monitor.snmp.snmp_scraper import SNMPScraper
+
+
+def _time_call(name: str, func, num_iterations: int):
+    start = time.perf_counter()
+    for _ in range(num_iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'  {name:<36}{elapsed / num_iterations * 1000.0:10.2f} ms/call')
+
+
+def _benchmark_helpers(router_ip: str, host: str, version: str, num_iterations: int):
+    print(f'get_device_stats helpers (SNMP v{version}, {host}):')
+    _time_call('get_attached_ips', lambda: get_attached_ips(router_ip, 'public', version), num_iterations)
+    _time_call('get_total_cpu_usage', lambda: get_total_cpu_usage(host, 'public', version), num_iterations)
+    _time_call('get_ram_used_percent', lambda: get_ram_used_percent(host, 'public', version), num_iterations)
+    _time_call('get_max_if_in_out_bytes', lambda: get_max_if_in_out_bytes(host, 'public', version), num_iterations)
+    plan = discover_query_plan(host, 'public', True, version)
+    _time_call('discover_query_plan', lambda: discover_query_plan(host, 'public', True, version), num_iterations)
+    _time_call('query_device_stats', lambda: query_device_stats(host, 'public', plan, version), num_iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-hosts', type=int, default=50)
+    parser.add_argument('--latency-sec', type=float, default=0.001)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--non-snmp-fraction', type=float, default=0.0)
+    parser.add_argument('--v1-only-fraction', type=float, default=0.0)
+    parser.add_argument('--version', default='2c', choices=['1', '2c'])
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--helper-iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    simulator_settings = SimulatorSettings(
+        num_hosts=args.num_hosts,
+        latency_sec=args.latency_sec,
+        drop_rate=args.drop_rate,
+        non_snmp_fraction=args.non_snmp_fraction,
+        v1_only_fraction=args.v1_only_fraction,
+    )
+    hosts = get_simulated_hosts(simulator_settings)
+    router_ip = hosts[0].ip
+
+    class BenchmarkSNMPSettings(SNMPSettings):
+        router_ip = hosts[0].ip
+        agent_port = simulator_settings.port
+        version = args.version
+        collect_traffic_data = True
+
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    simulator = multiprocessing.Process(target=run_simulator, args=(simulator_settings, ready, stop))
+    simulator.start()
+    try:
+        ready.wait()
+        set_agent_port(simulator_settings.port)
+        _benchmark_helpers(router_ip, hosts[1].ip, args.version, args.helper_iterations)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            DBInterface.set_default_db_path(Path(tmp_dir) / 'benchmark.sqlite3')
+            with DBInterface() as db_interface:
+                for i, host in enumerate(hosts[1:]):
+                    db_interface.add_pet_info(PetInfo(f'pet{i}', IdentifierType.IP, host.ip, DeviceType.PC))
+
+            scraper = SNMPScraper(BenchmarkSNMPSettings())
+            print(f'SNMPScraper.update ({args.num_hosts} hosts, {args.latency_sec * 1000:.1f} ms latency, '
+                  f'{args.drop_rate:.0%} drop rate, {args.non_snmp_fraction:.0%} without SNMP):')
+            for cycle in range(args.cycles):
+                start = time.perf_counter()
+                asyncio.run(scraper.update())
+                elapsed = time.perf_counter() - start
+                print(f'  cycle {cycle}: {elapsed:8.3f} s, {args.num_hosts / elapsed:8.1f} hosts/s')
+    finally:
+        stop.set()
+        simulator.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Benchmark of `TPLinkScraper.update` and its DB writes against the local TP-Link router emulator.
+
+The emulator runs in a separate process, and the scraper writes to a temporary database. Every cycle polls all the
+endpoints, the first one including the login.
+
+Run with `python -m benchmarks.tplink_scraper --num-clients 2000 --latency-sec 0.05`
+'''
+import argparse
+import asyncio
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+from pet_monitor.settings import TPLinkSettings
+from pet_monitor.tplink_scraper.router_emulator import (EmulatorSettings,
+                                                        get_emulated_clients,
+                                                        run_emulator)
+from pet_monitor.tplink_scraper.scraper import TPLinkScraper
+
+
+def _time_call(name: str, func, num_iterations: int):
+    start = time.perf_counter()
+    for _ in range(num_iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'  {name:<36}{elapsed / num_iterations * 1000.0:10.2f} ms/call')
+
+
+def _run_cycle(scraper: TPLinkScraper) -> float:
+    # Make every endpoint due, as on the first update.
+    for limiter in scraper.endpoint_limiters.values():
+        limiter.last_update = float('-inf')
+    scraper.last_update = time.monotonic()
+    start = time.perf_counter()
+    num_errors = scraper.stats.num_errors
+    asyncio.run(scraper.update())
+    if scraper.stats.num_errors > num_errors:
+        raise RuntimeError(f'Scrape failed: {scraper.stats.last_error}')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-clients', type=int, default=1000)
+    parser.add_argument('--num-pets', type=int, default=100)
+    parser.add_argument('--latency-sec', type=float, default=0.01)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--write-iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    emulator_settings = EmulatorSettings(num_clients=args.num_clients, latency_sec=args.latency_sec)
+    clients = get_emulated_clients(emulator_settings)
+
+    class BenchmarkTPLinkSettings(TPLinkSettings):
+        collect_traffic_data = True
+
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    emulator = multiprocessing.Process(target=run_emulator, args=(emulator_settings, ready, stop))
+    emulator.start()
+    try:
+        ready.wait()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            DBInterface.set_default_db_path(Path(tmp_dir) / 'benchmark.sqlite3')
+            with DBInterface() as db_interface:
+                for i, client in enumerate(clients[:args.num_pets]):
+                    db_interface.add_pet_info(PetInfo(f'pet{i}', IdentifierType.MAC, client.mac, DeviceType.PC))
+
+            scraper = TPLinkScraper(BenchmarkTPLinkSettings(
+                f'{emulator_settings.host}:{emulator_settings.port}',
+                emulator_settings.username,
+                emulator_settings.password))
+            print(f'TPLinkScraper.update ({args.num_clients} clients, {args.num_pets} pets, '
+                  f'{args.latency_sec * 1000:.1f} ms latency):')
+            for cycle in range(args.cycles):
+                elapsed = _run_cycle(scraper)
+                print(f'  cycle {cycle}: {elapsed:8.3f} s, {args.num_clients / elapsed:10.1f} clients/s')
+            print(f'  logins: {scraper.tplink.num_auths}')
+            for endpoint, timing in scraper.tplink.endpoint_timing.items():
+                print(f'  {endpoint:<36}{timing.get_mean_sec() * 1000.0:10.2f} ms/request')
+
+            traffic = scraper.tplink.get_traffic_stats()
+            print('DB writes:')
+            with DBInterface() as db_interface:
+                timestamp = int(time.time())
+                _time_call('_write_devices', lambda: scraper._write_devices(db_interface, timestamp),
+                           args.write_iterations)
+
+                def write_all_devices():
+                    # A new differ rewrites every device rather than skipping them as unchanged.
+                    scraper.network_info = NetworkInfoDiffer()
+                    scraper._write_devices(db_interface, timestamp)
+                # Much slower than the cached case, so only timed once.
+                _time_call('_write_devices (uncached)', write_all_devices, 1)
+                _time_call('_write_traffic', lambda: scraper._write_traffic(db_interface, traffic, timestamp),
+                           args.write_iterations)
+    finally:
+        stop.set()
+        emulator.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ManagePetsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "manage_pets"
+
+    def ready(self):
+        from pet_monitor.network_db import DBInterface
+        from pet_monitor.query_stats import (QUERY_STATS_DIR, QueryStats,
+                                             get_process_name,
+                                             remove_exited_process_stats)
+        from pet_monitor.settings import get_settings
+
+        settings = get_settings()
+        if settings.query_stats_settings is not None:
+            # Each gunicorn worker saves its own stats, instead of overwriting the other workers' file.
+            remove_exited_process_stats('web', QUERY_STATS_DIR)
+            DBInterface.set_query_stats(QueryStats(get_process_name('web'), settings.query_stats_settings,
+                                                   QUERY_STATS_DIR))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from pet_monitor.profiling import PROFILES_DIR, summarize_profiles
+
+
+class Command(BaseCommand):
+    help = 'Summarize the hotspots in the profiles saved by the monitor services and views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help='Service or view name to summarize. Defaults to all of them.')
+        parser.add_argument('--sort', default='tottime', help='pstats sort key, like tottime or cumulative.')
+        parser.add_argument('--limit', type=int, default=25, help='Number of functions to list.')
+        parser.add_argument('--dir', default=str(PROFILES_DIR), help='Directory with the .pstats files.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(summarize_profiles(options['dir'], options['target'], options['sort'], options['limit']))
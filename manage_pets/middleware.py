@@ -0,0 +1,32 @@
+from django.urls import Resolver404, resolve
+
+from pet_monitor.profiling import Profiler
+from pet_monitor.settings import get_settings
+
+
+class ProfilingMiddleware:
+    '''
+    Samples requests to the views enabled in the profiling settings, by view function name. The profile covers the
+    middleware after this one as well as the view.
+    '''
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        self.profilers: dict[str, Profiler] = {}
+        Profiler.set_settings(get_settings().profiling_settings)
+
+    def __call__(self, request):
+        # Skip resolving the URL when nothing is being profiled.
+        if len(Profiler.get_targets()) == 0:
+            return self.get_response(request)
+        try:
+            # `request.resolver_match` is only set once the request reaches the handler, so resolve the URL the same
+            # way here.
+            resolver_match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return self.get_response(request)
+
+        name = resolver_match.func.__name__
+        if name not in self.profilers:
+            self.profilers[name] = Profiler(name)
+        return self.profilers[name].call(self.get_response, request)
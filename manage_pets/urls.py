@@ -13,6 +13,8 @@ urlpatterns = [
     path("view_history/<name>", views.view_history, name="view_history"),
     path("view_history", views.view_history, name="view_history"),
     path("view_data_usage", views.view_data_usage, name="view_data_usage"),
+    path("db_status", views.db_status, name="db_status"),
+    path("metrics", views.metrics, name="metrics"),
 ]
 
 urlpatterns += staticfiles_urlpatterns()
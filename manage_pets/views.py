@@ -8,11 +8,13 @@ from random import randrange
 from typing import Optional
 from zoneinfo import ZoneInfo
 
-from django.http import HttpResponseNotFound, HttpResponseServerError
+from django.http import (HttpResponse, HttpResponseNotFound,
+                         HttpResponseServerError)
 from django.shortcuts import redirect, render
 from django.views.decorators.csrf import csrf_exempt
 
 from avatar_gen.generate_avatar import get_pet_avatar
+from pet_monitor import db_stats, query_stats
 from pet_monitor.common import (CONSOLE_LOG_FILE, DeviceType,
                                 ExtraNetworkInfoType, IdentifierType, PetInfo,
                                 Relationship, TrafficStats,
@@ -20,6 +22,7 @@ from pet_monitor.common import (CONSOLE_LOG_FILE, DeviceType,
                                 get_device_summary, get_timestamp_age_str,
                                 map_pets_to_devices, sizeof_fmt)
 from pet_monitor.network_db import DBInterface
+from pet_monitor.service_metrics import format_prometheus, load_stats
 from pet_monitor.settings import get_settings
 
 logger = logging.getLogger(__name__)
@@ -194,6 +197,9 @@ def view_pet(request, name):
                 pet.name,
                 since_timestamp=history_start_time))
 
+            host = device_data.get_host()
+            snmp_capabilities = None if host is None else db_interface.get_snmp_capabilities([host]).get(host)
+
             extra_info = db_interface.get_extra_network_info(device_data)
             if ExtraNetworkInfoType.MDNS_SERVICES in extra_info:
                 services = extra_info[ExtraNetworkInfoType.MDNS_SERVICES].split(',')
@@ -215,6 +221,7 @@ def view_pet(request, name):
                                                                  'services': services,
                                                                  'mean_cpu_stats': mean_cpu_stats,
                                                                  'cpu_stats_webp': cpu_stats_webp,
+                                                                 'snmp_capabilities': snmp_capabilities,
                                                                  'relationships': relationships,
                                                                  'traffic_info': traffic_info,
                                                                  'traffic_data_webp': traffic_data_webp,
@@ -270,3 +277,22 @@ def edit_pet(request, name):
                 return render(request, "manage_pets/edit_pet.html", {'pet_data': pet})
         else:
             return HttpResponseNotFound(f'<h1>Pet "{name}" Not Found</h1>')
+
+
+def db_status(request):
+    with DBInterface() as db_interface:
+        report = db_interface.get_storage_report()
+    context = {
+        'summary': db_stats.get_summary(report),
+        'table_columns': db_stats.TABLE_COLUMNS,
+        'table_rows': db_stats.get_table_rows(report, db_stats.get_history_lens(_MONITOR_SETTINGS)),
+        'pet_columns': db_stats.PET_COLUMNS,
+        'pet_rows': db_stats.get_pet_rows(report),
+    }
+    return render(request, "manage_pets/db_status.html", context)
+
+
+def metrics(request):
+    # Saved by the monitor services after each update, and by the processes timing their DB access.
+    text = format_prometheus(load_stats()) + query_stats.format_prometheus(query_stats.load_query_stats())
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,178 @@
+'''
+Runtime for services written as coroutines.
+
+All the services share one event loop. Services built on `ServiceBase` run through `ThreadedService`, which calls
+their blocking updates with `asyncio.to_thread`.
+'''
+import asyncio
+import logging
+import random
+from pathlib import Path
+from typing import Optional, Union
+
+from pet_monitor.service_base import ServiceBase, UpdateTiming
+from pet_monitor.service_metrics import registry
+from pet_monitor.settings import SchedulerSettings
+
+_logger = logging.getLogger(__name__)
+
+
+class AsyncServiceBase(UpdateTiming):
+    '''
+    A service whose `update` coroutine runs periodically on the `AsyncServiceRunner` event loop.
+    '''
+
+    def __init__(self, update_period_sec: float, timeout_sec: Optional[float] = None) -> None:
+        super().__init__(update_period_sec)
+        # Updates still running after this long are cancelled, or None for no limit. Blocking calls made with
+        # `asyncio.to_thread` keep running in their thread after the update is cancelled.
+        self.timeout_sec = timeout_sec
+        # Number of updates cancelled for running longer than `timeout_sec`.
+        self.num_timeouts = 0
+
+    async def start(self) -> None:
+        '''
+        Called on the event loop before the first update.
+        '''
+
+    async def update(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        '''
+        Called on the event loop after the last update.
+        '''
+
+
+class ThreadedService(AsyncServiceBase):
+    '''
+    Runs a `ServiceBase` on the event loop. Its `_update` and posted callbacks are called with `asyncio.to_thread`,
+    one at a time as they would be on the service's own thread.
+    '''
+
+    def __init__(self, service: ServiceBase) -> None:
+        self.service = service
+        # A thread can't be cancelled, so there's no timeout.
+        super().__init__(service.update_period_sec)
+        # Share the stats, so they're the same however the service is run. The profiles of the update include its
+        # thread.
+        self.stats = service.stats
+        self.profiler = service.profiler
+        self.lock: Optional[asyncio.Lock] = None
+        self.callback_tasks: set[asyncio.Task] = set()
+
+    def get_name(self) -> str:
+        return self.service.get_name()
+
+    async def start(self) -> None:
+        self.lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        self.service.on_post = lambda: loop.call_soon_threadsafe(self._schedule_callbacks)
+
+    def _schedule_callbacks(self):
+        task = asyncio.create_task(self._run_callbacks())
+        # Keep a reference until the task is done.
+        self.callback_tasks.add(task)
+        task.add_done_callback(self._on_callbacks_done)
+
+    def _on_callbacks_done(self, task: asyncio.Task):
+        self.callback_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            _logger.error(f'{self.get_name()} callback failed:', exc_info=task.exception())
+
+    async def _run_callbacks(self):
+        assert self.lock is not None
+        async with self.lock:
+            await asyncio.to_thread(self.service._run_callbacks)
+
+    async def update(self) -> None:
+        assert self.lock is not None
+        async with self.lock:
+            self.service.last_update = self.last_update
+            await asyncio.to_thread(self.service._update)
+
+    async def stop(self) -> None:
+        self.service.on_post = None
+        for task in list(self.callback_tasks):
+            task.cancel()
+        await asyncio.to_thread(self.service.stop)
+
+
+class AsyncServiceRunner:
+    '''
+    Runs services as tasks on one event loop.
+
+    Like `Scheduler`, updates are on a fixed grid of deadlines starting at each service's phase offset, and deadlines
+    that pass while an update is running are coalesced into a single update.
+    '''
+
+    def __init__(self, services: list[Union[AsyncServiceBase, ServiceBase]],
+                 settings: SchedulerSettings = SchedulerSettings(), metrics_dir: Optional[Path] = None) -> None:
+        self.services = [s if isinstance(s, AsyncServiceBase) else ThreadedService(s) for s in services]
+        self.settings = settings
+        # If `metrics_dir` is set, each service's stats are also saved there after every update.
+        for service in self.services:
+            registry.register(service.stats, metrics_dir)
+
+    async def _run_update(self, service: AsyncServiceBase) -> bool:
+        timeout = asyncio.timeout(service.timeout_sec)
+        try:
+            async with timeout:
+                await service.profiler.call_async(service.update)
+        except TimeoutError:
+            # Only handle the timeout from the runner, not ones raised by the update.
+            if not timeout.expired():
+                raise
+            service.num_timeouts += 1
+            _logger.warning(f'{service.get_name()} update cancelled after {service.timeout_sec:.1f}s.')
+            return False
+        return True
+
+    async def _run_service(self, service: AsyncServiceBase, phase_offset_sec: float):
+        loop = asyncio.get_running_loop()
+        period = service.update_period_sec
+        deadline = loop.time() + phase_offset_sec
+        while True:
+            jitter = random.uniform(0, min(self.settings.jitter_sec, period / 2))
+            await asyncio.sleep(max(0.0, deadline + jitter - loop.time()))
+
+            start = loop.time()
+            num_coalesced = service._start_update(deadline, start)
+            try:
+                completed = await self._run_update(service)
+            except Exception as e:
+                service.stats.record_error(e)
+                raise
+            elapsed = loop.time() - start
+            deadline, _ = service._skip_missed_deadlines(deadline, loop.time())
+            service._finish_update(elapsed, num_coalesced, timed_out=not completed)
+
+    async def run(self):
+        '''
+        Run the services until one of them fails or this is cancelled.
+        '''
+        started = []
+        try:
+            for service in self.services:
+                await service.start()
+                started.append(service)
+            async with asyncio.TaskGroup() as group:
+                for i, service in enumerate(self.services):
+                    # Offset the first update of each service so they don't all start at once.
+                    group.create_task(self._run_service(service, i * self.settings.startup_spacing_sec),
+                                      name=service.get_name())
+        finally:
+            _logger.info('Stopping services.')
+            for service in started:
+                try:
+                    await service.stop()
+                except Exception:
+                    _logger.error(f'Failed to stop {service.get_name()}:', exc_info=True)
+
+    def run_services(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            _logger.error('Unhandled Exception:', exc_info=True)
@@ -1,7 +1,5 @@
 
 import logging
-import re
-import subprocess
 import time
 from enum import IntEnum
 from pathlib import Path
@@ -98,6 +96,8 @@ class ExtraNetworkInfoType(IntEnum):
     MDNS_NAME = 3
     MDNS_SERVICES = 4
     NMAP_SERVICES = 5
+    # Unix time the NMAP_SERVICES were last scanned.
+    NMAP_SCAN_TIMESTAMP = 6
 
 
 class Relationship(IntEnum):
@@ -234,6 +234,84 @@ class CPUStats(NamedTuple):
     timestamp: int = 0
 
 
+class SNMPCapabilities(NamedTuple):
+    '''
+    What a host supports when queried with SNMP.
+    '''
+    # IP or hostname that was queried.
+    host: str
+    # Did the host return any of the queried MIBs the last time it was checked.
+    responded: bool = False
+    # Comma separated names of the MIBs the host returned data for.
+    supported_mibs: str = ''
+    # Unix time of the last successful query.
+    last_success: int = 0
+    # Number of failed queries since the last success.
+    consecutive_failures: int = 0
+    # Unix time to wait for before querying the host again.
+    next_attempt: int = 0
+
+    def get_last_success_age_str(self) -> str:
+        return get_timestamp_age_str(self.last_success)
+
+
+class NMAPScanProgress(NamedTuple):
+    '''
+    Position of a rolling NMAP scan through its address space.
+    '''
+    # The target specification being scanned.
+    ip_ranges: str
+    # Index of the next slice to scan.
+    next_slice: int = 0
+    # Number of slices the address space is divided into.
+    num_slices: int = 1
+    # Unix time the current pass started.
+    pass_start: int = 0
+    # Number of completed passes over the address space.
+    completed_passes: int = 0
+    # Unix time the last slice completed.
+    last_slice_timestamp: int = 0
+    # Number of hosts found in the last slice.
+    last_slice_hosts: int = 0
+
+    def get_pass_percent(self) -> float:
+        return 100.0 * self.next_slice / max(1, self.num_slices)
+
+
+class TableStorage(NamedTuple):
+    '''
+    Rows and space used by a DB table.
+    '''
+    name: str
+    num_rows: int = 0
+    # Bytes used by the table and its indices, or None if SQLite was built without the dbstat table.
+    num_bytes: Optional[int] = None
+    # For tables of samples, Unix time of the oldest sample, and the number of samples in the recent window.
+    oldest_timestamp: Optional[int] = None
+    num_recent_rows: Optional[int] = None
+
+
+class StorageReport(NamedTuple):
+    '''
+    Size and contents of the DB.
+    '''
+    tables: list[TableStorage]
+    # Number of samples of each pet, by table.
+    rows_per_pet: dict[str, dict[str, int]]
+    # Length of the window `TableStorage.num_recent_rows` counts samples in.
+    recent_window_sec: float = 0.0
+    page_size: int = 0
+    num_pages: int = 0
+    # Unused pages that stay in the file until it's vacuumed.
+    num_freelist_pages: int = 0
+    journal_mode: str = ''
+    # Size of the write-ahead log file. 0 if it doesn't exist.
+    wal_bytes: int = 0
+
+    def get_db_bytes(self) -> int:
+        return self.page_size * self.num_pages
+
+
 class RelationshipMap:
     def __init__(self) -> None:
         self.relationships: set[tuple[str, str, Relationship]] = set()
@@ -278,17 +356,6 @@ def standardize_mac_address(mac: str) -> str:
     return standardized_mac
 
 
-def get_mac_for_ip_address(ip_address) -> Optional[str]:
-    try:
-        arp_result = subprocess.check_output(["arp", "-a", str(ip_address)])
-        mac_address_search = re.search(r"([0-9a-fA-F]{2}[:-]){5}([0-9a-fA-F]{2})", arp_result.decode())
-        if mac_address_search:
-            return standardize_mac_address(mac_address_search.group(0))
-    except Exception:
-        pass
-    return None
-
-
 def get_device_name(device: NetworkInterfaceInfo, extra_info: dict[ExtraNetworkInfoType, str]) -> Optional[str]:
     if ExtraNetworkInfoType.DHCP_NAME in extra_info:
         return extra_info[ExtraNetworkInfoType.DHCP_NAME]
@@ -0,0 +1,104 @@
+'''
+Reports the size of each DB table, the samples kept for each pet, and how the age of the oldest samples compares to
+the configured `history_len`, for capacity planning.
+
+Run with `python -m pet_monitor.db_stats`.
+'''
+import time
+from collections import defaultdict
+from typing import Optional
+
+from pet_monitor.common import StorageReport, sizeof_fmt
+from pet_monitor.network_db import SAMPLE_TABLES, DBInterface
+from pet_monitor.settings import Settings, get_settings
+
+TABLE_COLUMNS = ('Table', 'Rows', 'Size', 'Recent Rows', 'Oldest Sample', 'History Length', 'Retention')
+PET_COLUMNS = ('Pet',) + SAMPLE_TABLES
+
+
+def get_history_lens(settings: Settings) -> dict[str, float]:
+    '''
+    The configured `history_len` of each table of samples. Tables cleaned up by several services keep the shortest.
+    '''
+    history_lens = defaultdict(list)
+    if settings.pinger_settings is not None:
+        history_lens['device_availability'].append(settings.pinger_settings.history_len)
+    if settings.tplink_settings is not None and settings.tplink_settings.collect_traffic_data:
+        history_lens['traffic_stats'].append(settings.tplink_settings.history_len)
+    if settings.snmp_settings is not None:
+        history_lens['cpu_stats'].append(settings.snmp_settings.history_len)
+        if settings.snmp_settings.collect_traffic_data:
+            history_lens['traffic_stats'].append(settings.snmp_settings.history_len)
+    return {table: min(lens) for table, lens in history_lens.items()}
+
+
+def _format_days(seconds: float) -> str:
+    return f'{seconds / (60.0 * 60.0 * 24.0):.2f} days'
+
+
+def get_table_rows(report: StorageReport, history_lens: dict[str, float],
+                   now: Optional[float] = None) -> list[tuple[str, ...]]:
+    '''
+    Format each table's stats as strings for `TABLE_COLUMNS`.
+    '''
+    now = time.time() if now is None else now
+    rows = []
+    for table in report.tables:
+        size = 'unknown' if table.num_bytes is None else sizeof_fmt(table.num_bytes)
+        recent_rows = oldest = history_len = retention = ''
+        if table.num_recent_rows is not None:
+            recent_rows = str(table.num_recent_rows)
+        if table.oldest_timestamp is not None:
+            age = now - table.oldest_timestamp
+            oldest = _format_days(age)
+            if table.name in history_lens:
+                history_len = _format_days(history_lens[table.name])
+                # Old samples are deleted on the cleaning service's update period, so they can be a bit over.
+                behind = age - history_lens[table.name]
+                retention = 'ok' if behind <= 0 else f'{_format_days(behind)} behind'
+        rows.append((table.name, str(table.num_rows), size, recent_rows, oldest, history_len, retention))
+    return rows
+
+
+def get_pet_rows(report: StorageReport) -> list[tuple[str, ...]]:
+    '''
+    Format the samples of each pet as strings for `PET_COLUMNS`, most samples first.
+    '''
+    pets = sorted(report.rows_per_pet.items(), key=lambda item: -sum(item[1].values()))
+    return [(name,) + tuple(str(counts.get(t, 0)) for t in SAMPLE_TABLES) for name, counts in pets]
+
+
+def get_summary(report: StorageReport) -> str:
+    return (f'DB size {sizeof_fmt(report.get_db_bytes())} ({report.num_pages} pages of '
+            f'{sizeof_fmt(report.page_size)}, {report.num_freelist_pages} free). '
+            f'Journal mode {report.journal_mode}, WAL size {sizeof_fmt(report.wal_bytes)}. '
+            f'Recent rows are from the last {_format_days(report.recent_window_sec)}.')
+
+
+def _format_columns(header: tuple[str, ...], rows: list[tuple[str, ...]]) -> str:
+    widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+    return '\n'.join('  '.join(v.ljust(w) for v, w in zip(r, widths)).rstrip() for r in [header] + rows)
+
+
+def format_report(report: StorageReport, history_lens: dict[str, float], now: Optional[float] = None) -> str:
+    return '\n\n'.join([
+        get_summary(report),
+        _format_columns(TABLE_COLUMNS, get_table_rows(report, history_lens, now)),
+        _format_columns(PET_COLUMNS, get_pet_rows(report)),
+    ])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-path', default=None, help='DB to report on, instead of the monitor DB.')
+    args = parser.parse_args()
+
+    with DBInterface(args.db_path) as db_interface:
+        report = db_interface.get_storage_report()
+    print(format_report(report, get_history_lens(get_settings())))
+
+
+if __name__ == '__main__':
+    main()
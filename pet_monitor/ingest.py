@@ -0,0 +1,255 @@
+'''
+Writes the services' observations to the DB from a single thread.
+
+Instead of each service committing its own small transactions, which wait on each other for the DB lock, the services
+put typed observations on an `IngestQueue`. Its writer thread drains the queue in batches, writing each batch in one
+transaction. The queue has the same write methods as `DBInterface`, so services write with whichever `get_writer`
+returns.
+
+The queue is bounded. Services block while it's full, and observations that can't be queued within
+`IngestSettings.put_timeout_sec` are dropped.
+'''
+import logging
+import queue
+import time
+from collections.abc import Callable
+from functools import partial
+from threading import Lock, Thread
+from typing import NamedTuple, Optional, Union
+
+from pet_monitor.common import (CPUStats, ExtraNetworkInfoType, Mood,
+                                NetworkInterfaceInfo)
+from pet_monitor.network_db import DBInterface
+from pet_monitor.service_metrics import ServiceStats, registry
+from pet_monitor.settings import IngestSettings
+
+_logger = logging.getLogger(__name__)
+
+
+class NetworkInfoObservation(NamedTuple):
+    interface: NetworkInterfaceInfo
+    extra_info: Optional[dict[ExtraNetworkInfoType, str]] = None
+
+
+class NetworkTouchObservation(NamedTuple):
+    interfaces: list[NetworkInterfaceInfo]
+    # Called from the writer thread with the interfaces that weren't found, once the touch is committed.
+    on_missing: Optional[Callable[[list[NetworkInterfaceInfo]], None]] = None
+
+
+class AvailabilityObservation(NamedTuple):
+    name: str
+    is_available: bool
+    timestamp: int
+
+
+class TrafficObservation(NamedTuple):
+    name: str
+    rx_bytes: int
+    tx_bytes: int
+    timestamp: int
+
+
+class CPUObservation(NamedTuple):
+    name: str
+    cpu_stats: CPUStats
+
+
+class MoodObservation(NamedTuple):
+    name: str
+    mood: Mood
+
+
+Observation = Union[NetworkInfoObservation, NetworkTouchObservation, AvailabilityObservation, TrafficObservation,
+                    CPUObservation, MoodObservation]
+
+# Queued by `stop` to end the writer thread.
+_STOP = object()
+
+
+def _write_observation(db_interface: DBInterface, observation: Observation) -> Optional[Callable[[], None]]:
+    '''
+    Write `observation` in the current transaction. Returns a callback to run once the write is committed, if any.
+    '''
+    if isinstance(observation, NetworkInfoObservation):
+        db_interface.add_network_info(observation.interface, extra_info=observation.extra_info)
+    elif isinstance(observation, NetworkTouchObservation):
+        missing = db_interface._touch_network_info(db_interface.conn.cursor(), observation.interfaces)
+        if observation.on_missing is not None:
+            return partial(observation.on_missing, missing)
+    elif isinstance(observation, AvailabilityObservation):
+        db_interface.add_pet_availability(observation.name, observation.is_available, observation.timestamp)
+    elif isinstance(observation, TrafficObservation):
+        db_interface.add_traffic_for_pet(observation.name, observation.rx_bytes, observation.tx_bytes,
+                                         observation.timestamp)
+    elif isinstance(observation, CPUObservation):
+        db_interface.add_cpu_stats_for_pet(observation.name, observation.cpu_stats)
+    elif isinstance(observation, MoodObservation):
+        db_interface.update_pet_mood(observation.name, observation.mood)
+    else:
+        raise TypeError(f'Unknown observation {observation!r}')
+    return None
+
+
+class IngestQueue:
+    def __init__(self, settings: IngestSettings = IngestSettings(), name='IngestWriter') -> None:
+        self.settings = settings
+        self.queue: queue.Queue = queue.Queue(settings.max_queue_size)
+        self.thread: Optional[Thread] = None
+        self.stats = ServiceStats(name, settings.max_batch_delay_sec)
+        self.lock = Lock()
+        self.max_depth = 0
+        self.num_dropped = 0
+        self.num_batches = 0
+
+    def start(self, metrics_dir=None):
+        if self.thread is None:
+            registry.register(self.stats, metrics_dir)
+            self.thread = Thread(target=self._run_loop, name='ingest_writer')
+            self.thread.start()
+
+    def stop(self):
+        '''
+        Write the queued observations and stop the writer thread.
+        '''
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+
+    def flush(self):
+        '''
+        Wait until the observations queued so far are written. Returns immediately if the writer thread isn't running.
+        '''
+        if self.thread is None:
+            return
+        self.queue.join()
+
+    def get_depth(self) -> int:
+        return self.queue.qsize()
+
+    def put(self, observation: Observation):
+        try:
+            self.queue.put(observation, timeout=self.settings.put_timeout_sec)
+        except queue.Full:
+            with self.lock:
+                self.num_dropped += 1
+            _logger.warning(f'Ingest queue full, dropped {type(observation).__name__}.')
+            return
+        depth = self.queue.qsize()
+        with self.lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    # These match the DBInterface methods, so either can be used to write.
+    def add_network_info(self, new_interface: NetworkInterfaceInfo,
+                         extra_info: Optional[dict[ExtraNetworkInfoType, str]] = None):
+        self.put(NetworkInfoObservation(new_interface, extra_info))
+
+    def add_pet_availability(self, pet_name: str, is_available: bool, timestamp: Optional[int] = None):
+        self.put(AvailabilityObservation(pet_name, is_available, int(time.time()) if timestamp is None else timestamp))
+
+    def add_traffic_for_pet(self, pet_name: str, rx_bytes: int, tx_bytes: int, timestamp: Optional[int] = None):
+        self.put(TrafficObservation(pet_name, rx_bytes, tx_bytes, int(time.time()) if timestamp is None else timestamp))
+
+    def add_cpu_stats_for_pet(self, pet_name: str, cpu_stats: CPUStats):
+        self.put(CPUObservation(pet_name, cpu_stats))
+
+    def update_pet_mood(self, name: str, mood: Mood):
+        self.put(MoodObservation(name, mood))
+
+    def _get_batch(self) -> tuple[list[Observation], bool]:
+        '''
+        Wait for observations, and return them along with whether to stop.
+        '''
+        first = self.queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.settings.max_batch_delay_sec
+        while len(batch) < self.settings.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                observation = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if observation is _STOP:
+                return batch, True
+            batch.append(observation)
+        return batch, False
+
+    def _write_batch(self, db_interface: DBInterface, batch: list[Observation]):
+        start = time.monotonic()
+        cur = db_interface.conn.cursor()
+        # Run after the writes are committed, so they aren't repeated if the batch is retried.
+        callbacks = []
+        try:
+            cur.execute('BEGIN')
+            for observation in batch:
+                callbacks.append(_write_observation(db_interface, observation))
+            cur.execute('COMMIT')
+        except Exception as e:
+            _logger.error(f'Failed to write a batch of {len(batch)} observations, retrying them one at a time: {e}')
+            self.stats.record_error(e)
+            if db_interface.conn.in_transaction:
+                try:
+                    cur.execute('ROLLBACK')
+                except Exception as error:
+                    _logger.error(f'Failed to roll back the batch: {error}')
+            # Write the rest of the batch without the bad observation. The connection autocommits each write.
+            callbacks = []
+            for observation in batch:
+                try:
+                    callbacks.append(_write_observation(db_interface, observation))
+                except Exception as error:
+                    _logger.error(f'Failed to write {observation}: {error}')
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                _logger.error('Observation callback failed:', exc_info=True)
+                self.stats.record_error(e)
+        elapsed = time.monotonic() - start
+        self.stats.add_items(len(batch))
+        with self.lock:
+            self.num_batches += 1
+            self.stats.set_gauges(queue_depth=self.queue.qsize(), max_queue_depth=self.max_depth,
+                                  dropped=self.num_dropped, batches=self.num_batches, last_batch_size=len(batch))
+        self.stats.record_update(elapsed, elapsed > self.settings.max_batch_delay_sec)
+
+    def _run_loop(self):
+        with DBInterface() as db_interface:
+            is_stopping = False
+            while not is_stopping:
+                batch, is_stopping = self._get_batch()
+                try:
+                    if len(batch) > 0:
+                        self._write_batch(db_interface, batch)
+                except Exception as e:
+                    # Keep the writer running, so later observations are still written and `flush` returns.
+                    _logger.error(f'Failed to write a batch of {len(batch)} observations:', exc_info=True)
+                    self.stats.record_error(e)
+                finally:
+                    # Count the stop marker too, so `flush` doesn't wait on it.
+                    for _ in range(len(batch) + int(is_stopping)):
+                        self.queue.task_done()
+
+
+_default_queue: Optional[IngestQueue] = None
+
+
+def set_default_queue(ingest_queue: Optional[IngestQueue]):
+    global _default_queue
+    _default_queue = ingest_queue
+
+
+def get_writer(db_interface: DBInterface) -> Union[IngestQueue, DBInterface]:
+    '''
+    Returns the running ingest queue of this process, or `db_interface` to write directly.
+    '''
+    if _default_queue is not None and _default_queue.thread is not None:
+        return _default_queue
+    return db_interface
@@ -1,15 +1,19 @@
+import asyncio
 import logging
 import threading
 from typing import NamedTuple, Optional
 
-from zeroconf import (IPVersion, ServiceBrowser, ServiceListener, Zeroconf,
-                      ZeroconfServiceTypes)
+from zeroconf import IPVersion, ServiceListener, Zeroconf
+from zeroconf.asyncio import (AsyncServiceBrowser, AsyncServiceInfo,
+                              AsyncZeroconf, AsyncZeroconfServiceTypes)
 
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
 from pet_monitor.common import (TRACE, ExtraNetworkInfoType,
-                                NetworkInterfaceInfo, get_mac_for_ip_address,
-                                standardize_mac_address)
+                                NetworkInterfaceInfo, standardize_mac_address)
+from pet_monitor.ingest import get_writer
+from pet_monitor.neighbor_table import neighbor_table
 from pet_monitor.network_db import DBInterface
-from pet_monitor.service_base import ServiceBase
+from pet_monitor.network_info_differ import NetworkInfoDiffer
 from pet_monitor.settings import MDNSSettings, get_settings
 
 _logger = logging.getLogger(__name__)
@@ -24,13 +28,21 @@ class MDNSDevice(NamedTuple):
 
 
 class MyListener(ServiceListener):
-    def __init__(self) -> None:
+    '''
+    Resolves services as tasks on the zeroconf event loop, so a slow responder doesn't hold up the other callbacks.
+    Only one resolution runs at a time for each service name.
+    '''
+
+    def __init__(self, resolve_timeout_sec: float) -> None:
         self.data_lock = threading.Lock()
         self.entries: dict[str, MDNSDevice] = {}
+        self.resolve_timeout_ms = int(resolve_timeout_sec * 1000)
+        # Resolutions in progress by service name. Only accessed from the event loop.
+        self.pending: dict[str, asyncio.Task] = {}
 
-    def _handle_service(self, zc: Zeroconf, type_: str, name: str):
-        info = zc.get_service_info(type_, name)
-        if info is None:
+    async def _resolve_service(self, zc: Zeroconf, type_: str, name: str):
+        info = AsyncServiceInfo(type_, name)
+        if not await info.async_request(zc, self.resolve_timeout_ms):
             return
         if info.server is None:
             return
@@ -49,11 +61,10 @@ class MyListener(ServiceListener):
         if mac is None:
             # Some devices report mac addresses, but this is more reliable on same LAN.
             if b'mac' in info.properties and info.properties[b'mac']:
-                mac = standardize_mac_address(info.properties[b'mac'].decode())
+                mac = standardize_mac_address(info.properties[b'mac'].decode())  # type: ignore
             else:
-                mac = get_mac_for_ip_address(ip)
-                if mac:
-                    mac = standardize_mac_address(mac)
+                # The neighbor table may be refreshed from the host, so keep it off the event loop.
+                mac = await asyncio.to_thread(neighbor_table.get_mac, str(ip))
 
         with self.data_lock:
             if mdns_host in self.entries:
@@ -73,7 +84,17 @@ class MyListener(ServiceListener):
                 services=services
             )
 
-            # _logger.info(self.entries[mdns_host])
+    def _on_resolved(self, name: str, task: asyncio.Task):
+        del self.pending[name]
+        if not task.cancelled() and task.exception() is not None:
+            _logger.error(f'Failed to resolve {name}: {task.exception()}')
+
+    def _handle_service(self, zc: Zeroconf, type_: str, name: str):
+        if name in self.pending:
+            return
+        task = zc.loop.create_task(self._resolve_service(zc, type_, name))
+        self.pending[name] = task
+        task.add_done_callback(lambda t: self._on_resolved(name, t))
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         self._handle_service(zc, type_, name)
@@ -85,34 +106,74 @@ class MyListener(ServiceListener):
         self._handle_service(zc, type_, name)
 
 
-class MDNSScraper(ServiceBase):
+class MDNSScraper(AsyncServiceBase):
     def __init__(self, settings: MDNSSettings) -> None:
-        super().__init__(settings.time_between_updates)
+        super().__init__(settings.time_between_updates, timeout_sec=settings.time_between_updates)
         self.settings = settings
-        zeroconf = Zeroconf()
-        services = list(ZeroconfServiceTypes.find(zc=zeroconf))
-        self.listener = MyListener()
-        self.browser = ServiceBrowser(zeroconf, services, self.listener)
+        self.aiozc: Optional[AsyncZeroconf] = None
+        self.listener = MyListener(settings.resolve_timeout_sec)
+        self.browsers: dict[str, AsyncServiceBrowser] = {}
+        self.last_service_type_refresh = float('-inf')
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.network_info = NetworkInfoDiffer()
+
+    async def start(self) -> None:
+        # Created on the running loop, so zeroconf shares it instead of starting a thread for its own loop.
+        self.aiozc = AsyncZeroconf()
+
+    async def _refresh_service_types(self):
+        assert self.aiozc is not None
+        try:
+            service_types = await AsyncZeroconfServiceTypes.async_find(aiozc=self.aiozc)
+        except Exception as e:
+            _logger.error(f'Failed to find mDNS service types: {e}')
+            return
+        new_types = [t for t in service_types if t not in self.browsers]
+        for service_type in new_types:
+            self.browsers[service_type] = AsyncServiceBrowser(self.aiozc.zeroconf, service_type, listener=self.listener)
+        if len(new_types) > 0:
+            _logger.debug(f'Browsing {len(new_types)} new mDNS service types: {new_types}')
+
+    def _write_entries(self, entries: dict[str, MDNSDevice]):
+        with DBInterface() as db_interface:
+            writer = get_writer(db_interface)
+            for entry in entries.values():
+                extra_info = {
+                    ExtraNetworkInfoType.MDNS_NAME: entry.name,
+                    ExtraNetworkInfoType.MDNS_SERVICES: ','.join(sorted(entry.services))
+                }
+                device = NetworkInterfaceInfo(
+                    mac=entry.mac,
+                    ip=entry.ip,
+                    mdns_hostname=entry.host
+                )
+                self.network_info.write(writer, device, extra_info=extra_info)
+                _logger.log(TRACE, entry)
+            self.network_info.flush_touches(writer)
+        self.stats.add_items(len(entries))
+
+    async def update(self) -> None:
+        # Keep looking for service types, since devices offering new ones can join after startup. The results are
+        # handled by the listener, so this doesn't wait for the search to finish. Refreshes due within half an update
+        # period are done now.
+        refresh_period = self.settings.service_type_refresh_sec - self.update_period_sec / 2
+        if self.last_update - self.last_service_type_refresh >= refresh_period:
+            self.last_service_type_refresh = self.last_update
+            self.refresh_task = asyncio.create_task(self._refresh_service_types())
 
-    def _update(self) -> None:
         with self.listener.data_lock:
-            with DBInterface() as db_interface:
-                for entry in self.listener.entries.values():
-                    extra_info = {
-                        ExtraNetworkInfoType.MDNS_NAME: entry.name,
-                        ExtraNetworkInfoType.MDNS_SERVICES: ','.join(entry.services)
-                    }
-                    device = NetworkInterfaceInfo(
-                        mac=entry.mac,
-                        ip=entry.ip,
-                        mdns_hostname=entry.host
-                    )
-                    db_interface.add_network_info(device, extra_info=extra_info)
-                    _logger.log(TRACE, entry)
-
-            _logger.debug(f'mDNS found {len(self.listener.entries)} clients.')
+            entries = self.listener.entries
             self.listener.entries = {}
 
+        await asyncio.to_thread(self._write_entries, entries)
+        _logger.debug(f'mDNS found {len(entries)} clients.')
+
+    async def stop(self) -> None:
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+        if self.aiozc is not None:
+            await self.aiozc.async_close()
+
 
 def main():
     logging.basicConfig(level=TRACE, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -124,7 +185,7 @@ def main():
 
     DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
     mdns = MDNSScraper(settings.mdns_settings)
-    ServiceBase.run_services([mdns])
+    AsyncServiceRunner([mdns]).run_services()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+'''
+Finds memory growth in the long running monitor with tracemalloc.
+
+While the control file from `MemoryTrackerSettings` exists, allocations are traced. The first snapshot is the
+baseline, and each report logs the growth since then for each service in the process, along with the peak traced
+memory since the last report. Allocations are attributed to a service when its module is in their stack, so memory
+allocated by libraries on behalf of the service is included.
+'''
+import asyncio
+import inspect
+import logging
+import tracemalloc
+from typing import Optional, Union
+
+from pet_monitor.async_service import AsyncServiceBase, ThreadedService
+from pet_monitor.common import sizeof_fmt
+from pet_monitor.service_base import ServiceBase
+from pet_monitor.settings import MemoryTrackerSettings
+
+_logger = logging.getLogger(__name__)
+
+# Allocations made by tracemalloc itself and the import system.
+_IGNORE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+]
+
+
+def _get_module_path(service: Union[AsyncServiceBase, ServiceBase]) -> str:
+    if isinstance(service, ThreadedService):
+        service = service.service
+    return inspect.getfile(type(service))
+
+
+class MemoryTracker(AsyncServiceBase):
+    def __init__(self, settings: MemoryTrackerSettings, services: list[Union[AsyncServiceBase, ServiceBase]]) -> None:
+        super().__init__(settings.update_period_sec)
+        self.settings = settings
+        self.service_paths = {s.get_name(): _get_module_path(s) for s in services}
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.last_report = float('-inf')
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORE_FILTERS)
+
+    def _start(self):
+        tracemalloc.start(self.settings.num_frames)
+        self.baseline = self._take_snapshot()
+        self.last_report = self.last_update
+        _logger.info(f'Started tracing allocations, {len(self.baseline.traces)} in the baseline.')
+
+    def _stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+        _logger.info('Stopped tracing allocations.')
+
+    def get_growth(self, snapshot: tracemalloc.Snapshot) -> dict[str, list[tracemalloc.StatisticDiff]]:
+        '''
+        Compare `snapshot` to the baseline for each service, largest growth first.
+        '''
+        assert self.baseline is not None
+        results = {}
+        for name, path in self.service_paths.items():
+            service_filter = [tracemalloc.Filter(True, path, all_frames=True)]
+            results[name] = snapshot.filter_traces(service_filter).compare_to(
+                self.baseline.filter_traces(service_filter), 'lineno')
+        return results
+
+    def _report(self):
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        _logger.info(f'Traced memory {sizeof_fmt(current)}, peak since the last report {sizeof_fmt(peak)}.')
+        for name, diffs in self.get_growth(snapshot).items():
+            total = sum(d.size_diff for d in diffs)
+            lines = [f'{name} allocations grew {sizeof_fmt(total)} since the baseline. Top sites:']
+            for diff in [d for d in diffs if d.size_diff > 0][:self.settings.num_top_sites]:
+                frame = diff.traceback[0]
+                lines.append(f'  {frame.filename}:{frame.lineno} {sizeof_fmt(diff.size_diff)} '
+                             f'({diff.count_diff:+d} blocks, {sizeof_fmt(diff.size)} total)')
+            _logger.info('\n'.join(lines))
+
+    def _update(self):
+        requested = self.settings.control_file.exists()
+        # Reports due within half an update period are done now.
+        report_threshold_sec = self.settings.report_period_sec - self.update_period_sec / 2
+        is_report_due = self.last_update - self.last_report >= report_threshold_sec
+        if requested and self.baseline is None:
+            self._start()
+        elif not requested and self.baseline is not None:
+            self._stop()
+        elif self.baseline is not None and is_report_due:
+            self.last_report = self.last_update
+            self._report()
+
+    async def update(self) -> None:
+        await asyncio.to_thread(self._update)
+
+    async def stop(self) -> None:
+        if self.baseline is not None:
+            self._stop()
@@ -0,0 +1,139 @@
+'''
+Cache of the IP to MAC mappings known to this host.
+
+The kernel neighbor table is read at most once per refresh interval, and scrapers that learn MAC addresses another way
+(the router's SNMP ARP table, nmap) can add their results. Lookups are dict reads, except that a lookup of an unknown IP
+rereads the table if it wasn't reread for another miss within the last `miss_refresh_interval_sec`. Devices are often
+looked up right after they announce themselves, when their entry is too new to be cached.
+'''
+import logging
+import re
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from pet_monitor.common import standardize_mac_address
+
+_logger = logging.getLogger(__name__)
+
+_PROC_NET_ARP = Path('/proc/net/arp')
+
+_MAC_PATTERN = r'(?:[0-9a-fA-F]{1,2}[:-]){5}[0-9a-fA-F]{1,2}'
+_IP_PATTERN = r'\d{1,3}(?:\.\d{1,3}){3}'
+# 192.168.1.1 dev eth0 lladdr aa:bb:cc:dd:ee:ff REACHABLE
+_IP_NEIGH_LINE = re.compile(rf'^({_IP_PATTERN}) .*lladdr ({_MAC_PATTERN})')
+# ? (192.168.1.1) at aa:bb:cc:dd:ee:ff [ether] on eth0
+_ARP_LINE = re.compile(rf'\(({_IP_PATTERN})\) at ({_MAC_PATTERN})')
+
+_INCOMPLETE_MAC = '00-00-00-00-00-00'
+
+
+def _pad_mac(mac: str) -> str:
+    # BSD arp drops leading zeros from each octet.
+    return standardize_mac_address(''.join(octet.zfill(2) for octet in re.split('[:-]', mac)))
+
+
+def parse_proc_net_arp(text: str) -> dict[str, str]:
+    # IP address       HW type     Flags       HW address            Mask     Device
+    # 192.168.1.1      0x1         0x2         aa:bb:cc:dd:ee:ff     *        eth0
+    entries = {}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        # A flags value of 0x0 is an incomplete entry.
+        if len(fields) >= 4 and int(fields[2], 16) != 0:
+            entries[fields[0]] = standardize_mac_address(fields[3])
+    return entries
+
+
+def parse_neighbor_command(text: str) -> dict[str, str]:
+    '''
+    Parse the output of `ip neigh` or `arp -a`.
+    '''
+    entries = {}
+    for line in text.splitlines():
+        match = _IP_NEIGH_LINE.search(line) or _ARP_LINE.search(line)
+        if match:
+            entries[match[1]] = _pad_mac(match[2])
+    return entries
+
+
+def read_neighbor_table() -> dict[str, str]:
+    '''
+    Read the host's neighbor table from /proc/net/arp, falling back to `ip neigh` or `arp -a`.
+    '''
+    if _PROC_NET_ARP.exists():
+        return parse_proc_net_arp(_PROC_NET_ARP.read_text())
+
+    for command in (['ip', 'neigh', 'show'], ['arp', '-an']):
+        try:
+            return parse_neighbor_command(subprocess.check_output(command, stderr=subprocess.DEVNULL).decode())
+        except (OSError, subprocess.CalledProcessError):
+            continue
+
+    _logger.warning('Unable to read neighbor table.')
+    return {}
+
+
+class NeighborTable:
+    '''
+    Thread safe cache of IP to MAC mappings.
+    '''
+
+    def __init__(self, refresh_interval_sec=60.0, entry_ttl_sec=60.0 * 60.0, miss_refresh_interval_sec=1.0) -> None:
+        # Minimum time between reads of the host's neighbor table.
+        self.refresh_interval_sec = refresh_interval_sec
+        # Minimum time between the extra reads done when a lookup misses.
+        self.miss_refresh_interval_sec = miss_refresh_interval_sec
+        # Entries that haven't been seen by any source for this long are dropped.
+        self.entry_ttl_sec = entry_ttl_sec
+        self.lock = threading.Lock()
+        # MAC and monotonic time last seen by IP.
+        self.entries: dict[str, tuple[str, float]] = {}
+        self.last_refresh = float('-inf')
+        self.last_miss_refresh = float('-inf')
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_refresh < self.refresh_interval_sec:
+                return
+            self.last_refresh = now
+
+        neighbors = read_neighbor_table()
+        self.add_entries(neighbors.items())
+        with self.lock:
+            self.entries = {ip: entry for ip, entry in self.entries.items() if now - entry[1] < self.entry_ttl_sec}
+
+    def add_entries(self, entries: Iterable[tuple[str, str]]):
+        '''
+        Add (IP, MAC) pairs learned from another source.
+        '''
+        now = time.monotonic()
+        new_entries = {ip: (standardize_mac_address(mac), now) for ip, mac in entries}
+        with self.lock:
+            self.entries.update((ip, entry) for ip, entry in new_entries.items() if entry[0] != _INCOMPLETE_MAC)
+
+    def get_mac(self, ip: str) -> Optional[str]:
+        self.refresh()
+        entry = self.entries.get(ip)
+        if entry is None:
+            now = time.monotonic()
+            with self.lock:
+                is_miss_refresh_due = now - self.last_miss_refresh >= self.miss_refresh_interval_sec
+                if is_miss_refresh_due:
+                    self.last_miss_refresh = now
+            if is_miss_refresh_due:
+                self.refresh(force=True)
+                entry = self.entries.get(ip)
+        return None if entry is None else entry[0]
+
+    def get_entries(self) -> dict[str, str]:
+        self.refresh()
+        with self.lock:
+            return {ip: entry[0] for ip, entry in self.entries.items()}
+
+
+# Shared by all the scrapers in the process.
+neighbor_table = NeighborTable()
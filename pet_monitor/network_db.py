@@ -13,9 +13,13 @@ from plotly.subplots import make_subplots
 
 from pet_monitor.common import (DATA_DIR, CPUStats, DeviceType,
                                 ExtraNetworkInfoType, IdentifierType, Mood,
-                                NetworkInterfaceInfo, PetInfo, Relationship,
-                                RelationshipMap, TrafficStats,
-                                get_cutoff_timestamp, map_pets_to_devices)
+                                NetworkInterfaceInfo, NMAPScanProgress,
+                                PetInfo, Relationship, RelationshipMap,
+                                SNMPCapabilities, StorageReport, TableStorage,
+                                TrafficStats, get_cutoff_timestamp,
+                                map_pets_to_devices)
+from pet_monitor.query_stats import (QueryStats, TimedConnection,
+                                     time_public_methods)
 
 _DB_PATH = DATA_DIR / 'lan_pets_db.sqlite3'
 
@@ -99,12 +103,43 @@ CREATE TABLE IF NOT EXISTS pet_relationships (
     FOREIGN KEY(name2_id) REFERENCES pet_info(row_id) ON DELETE CASCADE
 );'''
 
+SNMP_CAPABILITIES_SCHEMA_SQL = '''\
+CREATE TABLE IF NOT EXISTS snmp_capabilities (
+    host VARCHAR(255) NOT NULL,             -- IP or hostname that was queried
+    responded BOOLEAN,                      -- Returned any of the queried MIBs
+    supported_mibs TEXT,                    -- Comma separated MIB names
+    last_success INTEGER DEFAULT 0,         -- Unix time of last successful query
+    consecutive_failures INTEGER DEFAULT 0, -- Failed queries since last success
+    next_attempt INTEGER DEFAULT 0,         -- Unix time to wait for before querying again
+    UNIQUE (host)
+);'''
+
+
+NMAP_SCAN_PROGRESS_SCHEMA_SQL = '''\
+CREATE TABLE IF NOT EXISTS nmap_scan_progress (
+    ip_ranges TEXT NOT NULL,                -- Target specification being scanned
+    next_slice INTEGER DEFAULT 0,           -- Index of the next slice to scan
+    num_slices INTEGER DEFAULT 1,           -- Number of slices in a pass
+    pass_start INTEGER DEFAULT 0,           -- Unix time the current pass started
+    completed_passes INTEGER DEFAULT 0,     -- Number of completed passes
+    last_slice_timestamp INTEGER DEFAULT 0, -- Unix time the last slice completed
+    last_slice_hosts INTEGER DEFAULT 0,     -- Hosts found in the last slice
+    UNIQUE (ip_ranges)
+);'''
+
+# Tables of samples for each pet, that are deleted once they're older than the services' `history_len`.
+SAMPLE_TABLES = ('device_availability', 'traffic_stats', 'cpu_stats')
 
+
+@time_public_methods
 class DBInterface:
     _hard_coded_pet_interfaces = {}
+    _default_db_path: StrOrBytesPath = _DB_PATH
+    # Times the methods and queries when set.
+    _query_stats: Optional[QueryStats] = None
 
-    def __init__(self, db_path: StrOrBytesPath = _DB_PATH) -> None:
-        self.conn = self._get_db_connection(db_path)
+    def __init__(self, db_path: Optional[StrOrBytesPath] = None) -> None:
+        self.conn = self._get_db_connection(self._default_db_path if db_path is None else db_path)
 
     def __enter__(self):
         return self
@@ -116,6 +151,17 @@ class DBInterface:
     def set_hard_coded_pet_interfaces(cls, info: dict[str, NetworkInterfaceInfo]):
         cls._hard_coded_pet_interfaces.update(info)
 
+    @classmethod
+    def set_default_db_path(cls, db_path: StrOrBytesPath):
+        cls._default_db_path = db_path
+
+    @classmethod
+    def set_query_stats(cls, query_stats: Optional[QueryStats]):
+        '''
+        Time the methods and queries of this process into `query_stats`, or stop timing them if it's None.
+        '''
+        cls._query_stats = query_stats
+
     @staticmethod
     def _replace_pet_enums(pet: PetInfo):
         return pet._replace(identifier_type=IdentifierType(pet.identifier_type),
@@ -123,7 +169,11 @@ class DBInterface:
 
     @classmethod
     def _get_db_connection(cls, db_path: StrOrBytesPath = _DB_PATH) -> sqlite3.Connection:
-        conn = sqlite3.connect(db_path, autocommit=True)
+        if cls._query_stats is None:
+            conn = sqlite3.connect(db_path, autocommit=True)
+        else:
+            conn = sqlite3.connect(db_path, autocommit=True, factory=TimedConnection)
+            conn.query_stats = cls._query_stats
         conn.execute("PRAGMA foreign_keys = 1")
         conn.execute(NETWORK_INFO_SCHEMA_SQL)
         conn.execute(EXTRA_NETWORK_INFO)
@@ -132,6 +182,8 @@ class DBInterface:
         conn.execute(AVAILABILITY_SCHEMA_SQL)
         conn.execute(PET_RELATIONSHIPS_SCHEMA_SQL)
         conn.execute(CPU_STATS_SCHEMA_SQL)
+        conn.execute(SNMP_CAPABILITIES_SCHEMA_SQL)
+        conn.execute(NMAP_SCAN_PROGRESS_SCHEMA_SQL)
         return conn
 
     def add_pet_info(self, pet: PetInfo):
@@ -211,6 +263,17 @@ class DBInterface:
             results[ExtraNetworkInfoType(row[0])] = row[1]
         return results
 
+    def get_extra_network_info_of_type(self, info_type: ExtraNetworkInfoType) -> dict[NetworkInterfaceInfo, str]:
+        cur = self.conn.cursor()
+        field_str = ','.join(NetworkInterfaceInfo._fields)
+        QUERY = f"""
+            SELECT {field_str}, extra.info
+            FROM network_info
+            INNER JOIN extra_network_info extra
+            WHERE extra.network_id=row_id AND extra.type=?;"""
+        cur.execute(QUERY, (info_type,))
+        return {NetworkInterfaceInfo(*r[:-1]): r[-1] for r in cur.fetchall()}
+
     def add_network_info(self, new_interface: NetworkInterfaceInfo,
                          extra_info: Optional[dict[ExtraNetworkInfoType, str]] = None):
         cur = self.conn.cursor()
@@ -263,6 +326,37 @@ class DBInterface:
             self._set_extra_network_info(cur, updated_row, extra_info)
         self.conn.commit()
 
+    def touch_network_info(self, interfaces: Iterable[NetworkInterfaceInfo]) -> list[NetworkInterfaceInfo]:
+        '''
+        Update the timestamps of existing network info in a single transaction. Returns the interfaces that weren't
+        found.
+        '''
+        cur = self.conn.cursor()
+        cur.execute('BEGIN')
+        try:
+            missing = self._touch_network_info(cur, interfaces)
+            cur.execute('COMMIT')
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+        return missing
+
+    @staticmethod
+    def _touch_network_info(cur: sqlite3.Cursor,
+                            interfaces: Iterable[NetworkInterfaceInfo]) -> list[NetworkInterfaceInfo]:
+        missing = []
+        for interface in interfaces:
+            # Match on the field that add_network_info gives the highest priority.
+            for param in ('mdns_hostname', 'dns_hostname', 'mac', 'ip'):
+                value = interface._asdict()[param]
+                if value:
+                    QUERY = f"UPDATE network_info SET timestamp=MAX(IFNULL(timestamp, 0), ?) WHERE {param}=?;"
+                    cur.execute(QUERY, (interface.timestamp, value))
+                    if cur.rowcount == 0:
+                        missing.append(interface)
+                    break
+        return missing
+
     def get_network_info(self) -> set[NetworkInterfaceInfo]:
         cur = self.conn.cursor()
         field_str = ','.join(NetworkInterfaceInfo._fields)
@@ -443,6 +537,50 @@ class DBInterface:
         fd.seek(0)
         return fd.read()
 
+    def set_snmp_capabilities(self, capabilities: Iterable[SNMPCapabilities]):
+        field_str = ','.join(SNMPCapabilities._fields)
+        place_holder_str = ','.join(['?'] * len(SNMPCapabilities._fields))
+        update_place_holder_str = ','.join(f'{f}=excluded.{f}' for f in SNMPCapabilities._fields[1:])
+        QUERY = f"""
+            INSERT INTO snmp_capabilities({field_str}) VALUES ({place_holder_str})
+                ON CONFLICT(host) DO UPDATE
+                SET {update_place_holder_str};
+            """
+        self.conn.executemany(QUERY, capabilities)
+        self.conn.commit()
+
+    def get_snmp_capabilities(self, hosts: Optional[Iterable[str]] = None) -> dict[str, SNMPCapabilities]:
+        cur = self.conn.cursor()
+        field_str = ','.join(SNMPCapabilities._fields)
+        cur.execute(f"SELECT {field_str} FROM snmp_capabilities;")
+        results = {}
+        for r in cur.fetchall():
+            capabilities = SNMPCapabilities(*r)
+            results[capabilities.host] = capabilities._replace(responded=bool(capabilities.responded))
+        if hosts is not None:
+            results = {h: results[h] for h in hosts if h in results}
+        return results
+
+    def set_nmap_scan_progress(self, progress: NMAPScanProgress):
+        field_str = ','.join(NMAPScanProgress._fields)
+        place_holder_str = ','.join(['?'] * len(NMAPScanProgress._fields))
+        update_place_holder_str = ','.join(f'{f}=excluded.{f}' for f in NMAPScanProgress._fields[1:])
+        QUERY = f"""
+            INSERT INTO nmap_scan_progress({field_str}) VALUES ({place_holder_str})
+                ON CONFLICT(ip_ranges) DO UPDATE
+                SET {update_place_holder_str};
+            """
+        self.conn.execute(QUERY, progress)
+        self.conn.commit()
+
+    def get_nmap_scan_progress(self, ip_ranges: str) -> Optional[NMAPScanProgress]:
+        cur = self.conn.cursor()
+        field_str = ','.join(NMAPScanProgress._fields)
+        cur.execute(f"SELECT {field_str} FROM nmap_scan_progress WHERE ip_ranges=?;", (ip_ranges,))
+        row = cur.fetchone()
+        if row is not None:
+            return NMAPScanProgress(*row)
+
     def add_traffic_for_pet(self, pet_name: str, rx_bytes: int,
                             tx_bytes: int, timestamp: Optional[int] = None):
         if timestamp is None:
@@ -599,6 +737,67 @@ class DBInterface:
     def _delete_old_entries(self, table: str, max_age_sec) -> None:
         self._delete_entries_before(table, get_cutoff_timestamp(max_age_sec))
 
+    def get_storage_report(self, recent_window_sec=60.0 * 60.0 * 24.0) -> StorageReport:
+        cur = self.conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")
+        table_names = [r[0] for r in cur.fetchall()]
+
+        try:
+            # Includes the pages of each table's indices.
+            cur.execute("""
+                SELECT m.tbl_name, SUM(s.pgsize)
+                FROM dbstat s
+                JOIN sqlite_master m ON s.name = m.name
+                GROUP BY m.tbl_name;""")
+            table_bytes: Optional[dict[str, int]] = dict(cur.fetchall())
+        except sqlite3.OperationalError:
+            # SQLite wasn't built with SQLITE_ENABLE_DBSTAT_VTAB.
+            table_bytes = None
+
+        recent_cutoff = get_cutoff_timestamp(recent_window_sec)
+        tables = []
+        for name in table_names:
+            num_bytes = None if table_bytes is None else table_bytes.get(name, 0)
+            if name in SAMPLE_TABLES:
+                cur.execute(f'SELECT COUNT(*), MIN(timestamp), SUM(timestamp >= ?) FROM {name};', (recent_cutoff,))
+                num_rows, oldest_timestamp, num_recent_rows = cur.fetchone()
+                tables.append(TableStorage(name, num_rows, num_bytes, oldest_timestamp, num_recent_rows or 0))
+            else:
+                cur.execute(f'SELECT COUNT(*) FROM "{name}";')
+                tables.append(TableStorage(name, cur.fetchone()[0], num_bytes))
+
+        rows_per_pet: dict[str, dict[str, int]] = defaultdict(dict)
+        for table in SAMPLE_TABLES:
+            cur.execute(f"""
+                SELECT n.name, COUNT(*)
+                FROM {table} r
+                JOIN pet_info n ON r.name_id = n.row_id
+                GROUP BY n.name;""")
+            for pet_name, count in cur.fetchall():
+                rows_per_pet[pet_name][table] = count
+
+        def get_pragma(name: str):
+            cur.execute(f'PRAGMA {name};')
+            return cur.fetchone()[0]
+
+        wal_bytes = 0
+        cur.execute('PRAGMA database_list;')
+        db_file = next((r[2] for r in cur.fetchall() if r[1] == 'main'), '')
+        # In memory DBs don't have a file.
+        if db_file and os.path.exists(db_file + '-wal'):
+            wal_bytes = os.path.getsize(db_file + '-wal')
+
+        return StorageReport(
+            tables=tables,
+            rows_per_pet=dict(rows_per_pet),
+            recent_window_sec=recent_window_sec,
+            page_size=get_pragma('page_size'),
+            num_pages=get_pragma('page_count'),
+            num_freelist_pages=get_pragma('freelist_count'),
+            journal_mode=get_pragma('journal_mode'),
+            wal_bytes=wal_bytes,
+        )
+
     def delete_old_traffic_stats(self, max_age_sec) -> None:
         self._delete_old_entries('traffic_stats', max_age_sec)
 
@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import deque
+from typing import Optional, Union
+
+from pet_monitor.common import ExtraNetworkInfoType, NetworkInterfaceInfo
+from pet_monitor.ingest import IngestQueue, NetworkTouchObservation
+from pet_monitor.network_db import DBInterface
+
+_logger = logging.getLogger(__name__)
+
+# How often to write the timestamps of devices that haven't otherwise changed.
+DEFAULT_TOUCH_INTERVAL_SEC = 60.0 * 5.0
+# How long to remember devices that haven't been seen. Longer than the slowest scrape, like a rolling nmap pass.
+DEFAULT_FORGET_AFTER_SEC = 60.0 * 60.0 * 24.0
+
+
+class NetworkInfoDiffer:
+    '''
+    Compares each scrape with the network info a scraper last wrote. New devices and changes to a device's identity
+    or extra info are written immediately, while devices where only the timestamp changed are batched into a single
+    timestamp update at most once every `touch_interval_sec`. Devices not seen for `forget_after_sec` are forgotten, so
+    churning networks don't grow the cache forever, and are written in full if they come back.
+
+    Writes go to a `DBInterface`, or an `IngestQueue` that writes them later from its own thread.
+    '''
+
+    def __init__(self, touch_interval_sec=DEFAULT_TOUCH_INTERVAL_SEC,
+                 forget_after_sec=DEFAULT_FORGET_AFTER_SEC) -> None:
+        self.touch_interval_sec = touch_interval_sec
+        self.forget_after_sec = forget_after_sec
+        # Extra info last written for each interface, keyed by the interface without its timestamp.
+        self.last_written: dict[NetworkInterfaceInfo, dict[ExtraNetworkInfoType, str]] = {}
+        # Monotonic time each interface was last seen, oldest first.
+        self.last_seen: dict[NetworkInterfaceInfo, float] = {}
+        # Latest timestamp of the unchanged interfaces seen since the last flush.
+        self.pending_touches: dict[NetworkInterfaceInfo, int] = {}
+        self.last_flush = time.monotonic()
+        self.num_writes = 0
+        self.num_touches = 0
+        # Touched interfaces that weren't found. Added to by the ingest queue's thread.
+        self.missing: deque[NetworkInterfaceInfo] = deque()
+
+    def _on_missing(self, interfaces: list[NetworkInterfaceInfo]):
+        self.missing.extend(interfaces)
+
+    def _forget_missing(self):
+        # Interfaces that were merged or removed by other writers are written in full on the next scrape.
+        while len(self.missing) > 0:
+            key = self.missing.popleft()._replace(timestamp=0)
+            self.last_written.pop(key, None)
+            self.last_seen.pop(key, None)
+
+    def _forget_stale(self, now: float):
+        # `last_seen` is in the order the interfaces were seen, so the stale ones are at the start.
+        while len(self.last_seen) > 0:
+            key, seen = next(iter(self.last_seen.items()))
+            if now - seen < self.forget_after_sec:
+                break
+            del self.last_seen[key]
+            self.last_written.pop(key, None)
+            self.pending_touches.pop(key, None)
+
+    def write(self, writer: Union[DBInterface, IngestQueue], interface: NetworkInterfaceInfo,
+              extra_info: Optional[dict[ExtraNetworkInfoType, str]] = None) -> bool:
+        '''
+        Write the interface if it changed since it was last written. Returns True if it was written.
+        '''
+        self._forget_missing()
+        key = interface._replace(timestamp=0)
+        now = time.monotonic()
+        self._forget_stale(now)
+        # Move the interface to the end of the order.
+        self.last_seen.pop(key, None)
+        self.last_seen[key] = now
+        extra_info = {} if extra_info is None else extra_info
+        last_extra_info = self.last_written.get(key)
+        # Extra info is only ever added or updated, so leaving out a type isn't a change.
+        if last_extra_info is not None and all(last_extra_info.get(k) == v for k, v in extra_info.items()):
+            if interface.timestamp > self.pending_touches.get(key, 0):
+                self.pending_touches[key] = interface.timestamp
+            return False
+
+        writer.add_network_info(interface, extra_info=extra_info)
+        self.last_written[key] = {**(last_extra_info or {}), **extra_info}
+        self.pending_touches.pop(key, None)
+        self.num_writes += 1
+        return True
+
+    def flush_touches(self, writer: Union[DBInterface, IngestQueue], force=False) -> int:
+        '''
+        Write the pending timestamp updates if the touch interval has passed. Returns the number of interfaces
+        touched.
+        '''
+        now = time.monotonic()
+        if len(self.pending_touches) == 0 or (not force and now - self.last_flush < self.touch_interval_sec):
+            return 0
+        self.last_flush = now
+
+        touches = [key._replace(timestamp=timestamp) for key, timestamp in self.pending_touches.items()]
+        self.pending_touches = {}
+        if isinstance(writer, IngestQueue):
+            writer.put(NetworkTouchObservation(touches, self._on_missing))
+        else:
+            self._on_missing(writer.touch_network_info(touches))
+        self._forget_missing()
+        self.num_touches += len(touches)
+        _logger.debug(f'Touched {len(touches)} network interfaces ({self.num_writes} total writes, '
+                      f'{self.num_touches} total touches).')
+        return len(touches)
@@ -1,57 +1,229 @@
-
+import ipaddress
 import logging
+import queue
+import re
+import shlex
+import subprocess
+import tempfile
 import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
-from typing import Any, Optional
-
-import nmap
+from typing import IO, Any, Callable, Generator, NamedTuple, Optional
 
 from pet_monitor.settings import NMAPSettings
 
 _logger = logging.getLogger(__name__)
 
 
+class NMAPHost(NamedTuple):
+    ip: str
+    mac: Optional[str] = None
+    host_names: tuple[str, ...] = ()
+    # (port, service name) for each open TCP port.
+    open_ports: tuple[tuple[int, str], ...] = ()
+
+
+def _parse_host(elem: ET.Element) -> Optional[NMAPHost]:
+    # <host><status state="up" reason="arp-response"/>
+    # <address addr="192.168.1.100" addrtype="ipv4"/>
+    # <address addr="A4:77:33:75:BC:C0" addrtype="mac" vendor="Google"/>
+    # <hostnames><hostname name="bee.internal" type="PTR"/></hostnames>
+    # <ports><port protocol="tcp" portid="22"><state state="open"/><service name="ssh"/></port></ports></host>
+    status = elem.find('status')
+    if status is not None and status.get('state') != 'up':
+        return None
+
+    ip = None
+    mac = None
+    for address in elem.iter('address'):
+        if address.get('addrtype') == 'ipv4':
+            ip = address.get('addr')
+        elif address.get('addrtype') == 'mac':
+            mac = address.get('addr')
+    if ip is None:
+        return None
+
+    host_names = tuple(n.get('name', '') for n in elem.iterfind('hostnames/hostname') if n.get('name'))
+
+    open_ports = []
+    for port in elem.iterfind('ports/port'):
+        state = port.find('state')
+        if port.get('protocol') == 'tcp' and state is not None and state.get('state') == 'open':
+            service = port.find('service')
+            open_ports.append((int(port.get('portid', 0)), '' if service is None else service.get('name', '')))
+
+    return NMAPHost(ip=ip, mac=mac, host_names=host_names, open_ports=tuple(open_ports))
+
+
+def iter_nmap_xml(stream: IO[bytes], summary: Optional[dict[str, Any]] = None) -> Generator[NMAPHost, None, None]:
+    '''
+    Incrementally parse nmap XML output, yielding each host as soon as its element is complete.
+
+    Parsed elements are discarded so memory use doesn't grow with the size of the scan. If `summary` is given, it's
+    filled with the command line and the run stats.
+    '''
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+                if summary is not None:
+                    summary['command_line'] = elem.get('args')
+            continue
+
+        if elem.tag == 'host':
+            host = _parse_host(elem)
+            if host is not None:
+                yield host
+            # Drop the parsed hosts from the tree.
+            if root is not None:
+                root.clear()
+        elif elem.tag == 'finished' and summary is not None:
+            summary['scanstats'] = dict(elem.attrib)
+        elif elem.tag == 'hosts' and summary is not None:
+            summary['hosts'] = dict(elem.attrib)
+
+
+# nmap range syntax for the last octet. For example "192.168.1.1-255".
+_LAST_OCTET_RANGE = re.compile(r'^(\d{1,3}\.\d{1,3}\.\d{1,3})\.(\d{1,3})-(\d{1,3})$')
+
+
+def split_ip_ranges(ip_ranges: str, shard_prefix_len: int) -> list[str]:
+    '''
+    Split a space separated nmap target specification into shards no larger than a /`shard_prefix_len` network.
+
+    IPv4 CIDR networks and last octet ranges are split along network boundaries. Other targets (host names, other
+    nmap range syntax) are kept as their own shard.
+    '''
+    block_size = 2 ** (32 - shard_prefix_len)
+    shards = []
+    for target in ip_ranges.split():
+        match = _LAST_OCTET_RANGE.match(target)
+        if match:
+            prefix, start, last = match[1], int(match[2]), int(match[3])
+            while start <= last:
+                end = min(last, (start // block_size + 1) * block_size - 1)
+                shards.append(f'{prefix}.{start}-{end}' if start != end else f'{prefix}.{start}')
+                start = end + 1
+            continue
+
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            shards.append(target)
+            continue
+
+        if network.version == 4 and network.prefixlen < shard_prefix_len:
+            shards.extend(str(n) for n in network.subnets(new_prefix=shard_prefix_len))
+        else:
+            shards.append(target)
+    return shards
+
+
+class ShardResult(NamedTuple):
+    target: str
+    elapsed_sec: float
+    num_hosts: int
+    # Command line and run stats reported by nmap.
+    summary: dict[str, Any]
+
+
 class NMAPRunner:
     '''
-    This class leverages the python-nmap library to interact with the nmap process. This is mostly to handle parsing the
-    XML output. It specifically does not use the PortScannerAsync class to call nmap asynchronously do to the way that
-    class spawns a seperate process for each host being scanned which is better handled by a single nmap process.
+    Runs nmap with XML output streamed to stdout. The targets are split into shards that are scanned by up to
+    `max_concurrent_scans` nmap processes at once. Each host is parsed as soon as nmap reports it, and queued in
+    `results` for the caller to consume while the scan is still running. `on_results` is called from the scan
+    threads when hosts are queued and when the scan completes.
     '''
 
     def __init__(self, settings: NMAPSettings) -> None:
         self.settings = settings
         self.in_progress = False
-        self.nm = nmap.PortScanner()
-        self.result: Optional[dict[str, Any]] = None
-
-    def _run_nmap_thread(self, hosts="127.0.0.1", ports=None, arguments="-sV"):
+        self.results: queue.SimpleQueue[NMAPHost] = queue.SimpleQueue()
+        # Timing for each shard of the last completed scan.
+        self.shard_results: Optional[list[ShardResult]] = None
+        self.on_results: Optional[Callable[[], None]] = None
+
+    def _notify(self):
+        if self.on_results is not None:
+            self.on_results()
+
+    def _get_command(self, hosts: str, arguments: str) -> list[str]:
+        command = ['sudo', 'nmap'] if self.settings.use_sudo else ['nmap']
+        return command + ['-oX', '-'] + shlex.split(arguments) + shlex.split(hosts)
+
+    def _run_shard(self, hosts: str, arguments: str) -> ShardResult:
+        summary: dict[str, Any] = {}
+        num_hosts = 0
+        start = time.monotonic()
         try:
-            self.result = self.nm.scan(hosts, ports, arguments, sudo=self.settings.use_sudo)  # type: ignore
+            # stderr goes to a file, since nmap would block on a full stderr pipe while stdout is being streamed.
+            with tempfile.TemporaryFile() as stderr_file:
+                with subprocess.Popen(self._get_command(hosts, arguments), stdout=subprocess.PIPE,
+                                      stderr=stderr_file) as proc:
+                    assert proc.stdout is not None
+                    for host in iter_nmap_xml(proc.stdout, summary):
+                        self.results.put(host)
+                        num_hosts += 1
+                        self._notify()
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode(errors='replace').strip()
+            if proc.returncode != 0:
+                _logger.error(f'nmap exited with {proc.returncode} scanning {hosts}: {stderr}')
+            elif len(stderr) > 0:
+                _logger.warning(stderr)
         except Exception as e:
             _logger.error(e)
-            self.result = None
 
+        return ShardResult(hosts, time.monotonic() - start, num_hosts, summary)
+
+    def _run_nmap_thread(self, shards: list[str], arguments: str):
+        with ThreadPoolExecutor(max_workers=max(1, self.settings.max_concurrent_scans)) as executor:
+            shard_results = list(executor.map(lambda shard: self._run_shard(shard, arguments), shards))
+
+        self.shard_results = shard_results
         self.in_progress = False
+        self._notify()
 
-    def _run_nmap(self, hosts="127.0.0.1", ports=None, arguments="-sV"):
+    def _run_nmap(self, shards: list[str], arguments="-sV"):
         self.in_progress = True
-        thread = Thread(target=NMAPRunner._run_nmap_thread, name='nmap_runner', args=(self, hosts, ports, arguments))
+        self.shard_results = None
+        thread = Thread(target=NMAPRunner._run_nmap_thread, name='nmap_runner', args=(self, shards, arguments))
         thread.start()
 
+    def get_results(self) -> list[NMAPHost]:
+        '''
+        Get the hosts reported since the last call.
+        '''
+        hosts = []
+        while True:
+            try:
+                hosts.append(self.results.get_nowait())
+            except queue.Empty:
+                return hosts
+
     def discover_ranges(self):
-        self._run_nmap(self.settings.ip_ranges, arguments="-sn")
+        self.scan_ranges(arguments="-sn")
 
     def scan_ranges(self, arguments=""):
-        self._run_nmap(self.settings.ip_ranges, arguments=arguments)
+        self._run_nmap(split_ip_ranges(self.settings.ip_ranges, self.settings.shard_prefix_len), arguments=arguments)
+
+    def scan_shards(self, shards: list[str], arguments=""):
+        '''
+        Scan a list of nmap target specifications, each with its own process.
+        '''
+        self._run_nmap(shards, arguments=arguments)
 
 
 def _main():
     runner = NMAPRunner(NMAPSettings())
     runner.scan_ranges()
-    while runner.in_progress:
+    while runner.in_progress or not runner.results.empty():
         time.sleep(0.1)
-        if not runner.in_progress:
-            print(runner.result)
+        for host in runner.get_results():
+            print(host)
+    print(runner.shard_results)
 
 
 if __name__ == "__main__":
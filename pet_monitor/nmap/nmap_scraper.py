@@ -1,97 +1,251 @@
 import logging
+import math
 import time
-
-from nmap import PortScannerHostDict
+from typing import Optional
 
 from pet_monitor.common import (TRACE, ExtraNetworkInfoType,
-                                NetworkInterfaceInfo)
+                                NetworkInterfaceInfo, NMAPScanProgress)
+from pet_monitor.ingest import get_writer
+from pet_monitor.neighbor_table import neighbor_table
 from pet_monitor.network_db import DBInterface
-from pet_monitor.nmap.nmap_interface import NMAPRunner
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+from pet_monitor.nmap.nmap_interface import (NMAPHost, NMAPRunner,
+                                             ShardResult, split_ip_ranges)
 from pet_monitor.service_base import ServiceBase
 from pet_monitor.settings import NMAPSettings, get_settings
 
 _logger = logging.getLogger(__name__)
 
+# Size of the blocks the address space is divided into for rolling scans.
+_ROLLING_BLOCK_PREFIX_LEN = 28
+# Maximum number of individual hosts to scan with each nmap process.
+_MAX_HOSTS_PER_SHARD = 256
+
+
+def get_rolling_slice(ip_ranges: str, num_slices: int, index: int) -> list[str]:
+    '''
+    Get the blocks of `ip_ranges` that make up slice `index` when the address space is divided into `num_slices`.
+    '''
+    blocks = split_ip_ranges(ip_ranges, _ROLLING_BLOCK_PREFIX_LEN)
+    return blocks[index * len(blocks) // num_slices:(index + 1) * len(blocks) // num_slices]
+
 
 class NMAPScraper(ServiceBase):
     def __init__(self, settings: NMAPSettings) -> None:
         super().__init__(settings.time_between_scans)
         self.settings = settings
         self.nmap_interface = NMAPRunner(settings)
+        # Handle the results on the service thread as soon as they're reported.
+        self.nmap_interface.on_results = lambda: self.post(self._handle_results)
+        self.network_info = NetworkInfoDiffer()
+        # Position in the address space for rolling scans. Loaded from the DB on the first scan.
+        self.progress: Optional[NMAPScanProgress] = None
+        # Number of shards in the rolling scan in progress that are part of the slice.
+        self.slice_shards: Optional[int] = None
+        # Last time each host was found, used to rescan live hosts in rolling mode.
+        self.live_hosts: dict[str, float] = {}
+        self.last_live_host_rescan = 0.0
+        # MAC and Unix time of the last port scan for each IP, for tiered scans. Loaded from the DB on the first scan.
+        self.port_scans: Optional[dict[str, tuple[Optional[str], int]]] = None
+        # Hosts found by discovery that need a port scan, mapped to their MAC.
+        self.pending_port_scans: dict[str, Optional[str]] = {}
+        # Hosts in the port scan in progress that haven't been reported yet.
+        self.port_scan_targets: Optional[dict[str, Optional[str]]] = None
+
+    def _needs_port_scan(self, ip: str, mac: Optional[str], timestamp: int) -> bool:
+        if self.port_scans is None or ip not in self.port_scans:
+            return True
+        scanned_mac, scanned_timestamp = self.port_scans[ip]
+        is_expired = timestamp - scanned_timestamp > self.settings.port_scan_ttl_sec
+        return is_expired or (mac is not None and mac != scanned_mac)
+
+    def _write_hosts(self, hosts: list[NMAPHost]):
+        neighbor_table.add_entries((host.ip, host.mac) for host in hosts if host.mac is not None)
+        timestamp = int(time.time())
+        is_port_scan = not self.settings.tiered_scan or self.port_scan_targets is not None
+        with DBInterface() as db_interface:
+            writer = get_writer(db_interface)
+            for host in hosts:
+                _logger.log(TRACE, host)
+                self.live_hosts[host.ip] = timestamp
+                mac = None if host.mac is None else host.mac.replace(':', '-')
+
+                host_name = None
+                if len(host.host_names) > 0:
+                    if len(host.host_names) > 1:
+                        _logger.warning(f'Mutiple host names found for {host.ip}: {list(host.host_names)}')
+                    host_name = host.host_names[0]
+
+                extra_info = {}
+                if is_port_scan:
+                    services = [f'{port}({name})' for port, name in host.open_ports]
+                    if len(services) > 0:
+                        extra_info[ExtraNetworkInfoType.NMAP_SERVICES] = ','.join(services)
+                    if self.port_scans is not None:
+                        extra_info[ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP] = str(timestamp)
+                        self.port_scans[host.ip] = (mac, timestamp)
+                    if self.port_scan_targets is not None:
+                        self.port_scan_targets.pop(host.ip, None)
+                elif self._needs_port_scan(host.ip, mac, timestamp):
+                    self.pending_port_scans[host.ip] = mac
+
+                self.network_info.write(writer, NetworkInterfaceInfo(
+                    timestamp=timestamp,
+                    ip=host.ip,
+                    mac=mac,
+                    dns_hostname=host_name
+                ), extra_info=extra_info)
+            self.network_info.flush_touches(writer)
+        self.stats.add_items(len(hosts))
+
+    def _handle_results(self):
+        # Get the results first, so all the hosts from a completed scan are included below.
+        shard_results = self.nmap_interface.shard_results
+
+        # Hosts are written in batches as the scan reports them, rather than after the whole range completes.
+        hosts = self.nmap_interface.get_results()
+        if len(hosts) > 0:
+            self._write_hosts(hosts)
+
+        if shard_results is not None:
+            for shard in shard_results:
+                _logger.debug(f'"{shard.summary.get("command_line")}": {shard.num_hosts} hosts in '
+                              f'{shard.elapsed_sec:.1f}s {shard.summary.get("scanstats", {})}')
+            elapsed = max((shard.elapsed_sec for shard in shard_results), default=0.0)
+            _logger.info(f'Scanned {len(shard_results)} shards in {elapsed:.1f}s, '
+                         f'{sum(shard.num_hosts for shard in shard_results)} hosts found.')
+            self.nmap_interface.shard_results = None
+            if self.port_scan_targets is not None:
+                self._finish_port_scan()
+                return
+            if self.slice_shards is not None:
+                self._finish_rolling_slice(shard_results[:self.slice_shards])
+                self.slice_shards = None
+            if len(self.pending_port_scans) > 0:
+                self._start_port_scan()
+
+    def _group_hosts(self, ips: list[str]) -> list[str]:
+        '''
+        Group individual hosts into shards spread over the available nmap processes.
+        '''
+        shard_size = min(_MAX_HOSTS_PER_SHARD, math.ceil(len(ips) / max(1, self.settings.max_concurrent_scans)))
+        return [' '.join(ips[i:i + shard_size]) for i in range(0, len(ips), max(1, shard_size))]
+
+    def _start_port_scan(self):
+        self.port_scan_targets = self.pending_port_scans
+        self.pending_port_scans = {}
+        _logger.info(f'Port scanning {len(self.port_scan_targets)} new or changed hosts.')
+        # The hosts were just discovered, so skip host discovery.
+        self.nmap_interface.scan_shards(self._group_hosts(sorted(self.port_scan_targets)),
+                                        f'-Pn {self.settings.nmap_flags}')
 
-    def _check(self):
-        #     {'nmap': {'command_line': 'nmap -oX - -sn 192.168.1.100-255',
-        #       'scaninfo': {},
-        #       'scanstats': {'timestr': 'Wed Jan  8 06:05:19 2025',
-        #                     'elapsed': '4.41',
-        #                     'uphosts': '23',
-        #                     'downhosts': '133',
-        #                     'totalhosts': '156'}},
-        # 'scan': {'192.168.1.100': {'hostnames': [{'name': '',
-        #                                           'type': ''}],
-        #                            'addresses': {'ipv4': '192.168.1.100',
-        #                                          'mac': 'A4:77:33:75:BC:C0'},
-        #                            'vendor': {'A4:77:33:75:BC:C0': 'Google'},
-        #                            'status': {'state': 'up',
-        #                                       'reason': 'arp-response'}},
-        #          '192.168.1.110': {'hostnames': [{'name': 'bee.internal',
-        #                                           'type': 'PTR'}],
-        #                            'addresses': {'ipv4': '192.168.1.110',
-        #                                          'mac': '7C:83:34:BE:62:5C'},
-        #                            'vendor': {},
-        #                            'status': {'state': 'up',
-        #                                       'reason': 'arp-response'}},
-        if self.nmap_interface.result is not None:
-            with DBInterface() as db_interface:
-                _logger.log(TRACE, self.nmap_interface.result)
-                if 'nmap' in self.nmap_interface.result:
-                    info = self.nmap_interface.result['nmap']
-                    if 'command_line' in info and 'scanstats' in info:
-                        _logger.debug(f'"{info["command_line"]}": {info["scanstats"]}')
-
-                if 'scan' in self.nmap_interface.result:
-                    scan: PortScannerHostDict = self.nmap_interface.result['scan']  # type: ignore
-                    timestamp = int(time.time())
-                    for ip, result in scan.items():
-                        mac = None
-                        host_name = None
-                        if 'addresses' in result and 'mac' in result['addresses'] and len(
-                                result['addresses']['mac']) > 0:
-                            mac = result['addresses']['mac'].replace(':', '-')
-
-                        if 'hostnames' in result:
-                            host_names = result['hostnames']
-                            if len(host_names) > 0:
-                                if len(host_names) > 1:
-                                    names = [n['name'] for n in host_names]
-                                    _logger.warning(f'Mutiple host names found for {ip}: {names}')
-                                name = host_names[0]['name']
-                                if len(name) > 0:
-                                    host_name = name
-
-                        services = []
-                        if 'tcp' in result:
-                            for port, status in result['tcp'].items():
-                                if status['state'] == 'open':
-                                    services.append(f'{port}({status['name']})')
-                        extra_info = {} if len(services) == 0 else {
-                            ExtraNetworkInfoType.NMAP_SERVICES: ','.join(services)}
-
-                        db_interface.add_network_info(NetworkInterfaceInfo(
-                            timestamp=timestamp,
-                            ip=ip,
-                            mac=mac,
-                            dns_hostname=host_name
-                        ), extra_info=extra_info)
-
-            self.nmap_interface.result = None
+    def _finish_port_scan(self):
+        assert self.port_scan_targets is not None and self.port_scans is not None
+        # Hosts without open ports may not be reported. Record that they were scanned so they aren't scanned again
+        # until the TTL expires.
+        timestamp = int(time.time())
+        with DBInterface() as db_interface:
+            writer = get_writer(db_interface)
+            for ip, mac in self.port_scan_targets.items():
+                self.port_scans[ip] = (mac, timestamp)
+                self.network_info.write(writer, NetworkInterfaceInfo(timestamp=timestamp, ip=ip, mac=mac),
+                                        extra_info={ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP: str(timestamp)})
+        self.port_scan_targets = None
+
+    def _load_port_scans(self) -> dict[str, tuple[Optional[str], int]]:
+        with DBInterface() as db_interface:
+            scan_times = db_interface.get_extra_network_info_of_type(ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP)
+        return {interface.ip: (interface.mac, int(timestamp))
+                for interface, timestamp in scan_times.items() if interface.ip is not None}
+
+    def _load_progress(self) -> NMAPScanProgress:
+        now = time.time()
+        num_slices = max(1, round(self.settings.rolling_pass_sec / self.settings.time_between_scans))
+        with DBInterface() as db_interface:
+            progress = db_interface.get_nmap_scan_progress(self.settings.ip_ranges)
+            interfaces = db_interface.get_network_info()
+
+        cutoff = now - self.settings.rolling_pass_sec
+        for interface in interfaces:
+            if interface.ip is not None and interface.timestamp > cutoff:
+                self.live_hosts[interface.ip] = interface.timestamp
+
+        if progress is None:
+            return NMAPScanProgress(self.settings.ip_ranges, num_slices=num_slices, pass_start=int(now))
+        elif progress.num_slices != num_slices:
+            # Keep the same fraction of the pass if the slice size changed.
+            next_slice = progress.next_slice * num_slices // progress.num_slices
+            return progress._replace(next_slice=next_slice, num_slices=num_slices)
+        return progress
+
+    def _get_live_host_shards(self) -> list[str]:
+        now = time.time()
+        if now - self.last_live_host_rescan < self.settings.live_host_rescan_sec:
+            return []
+        self.last_live_host_rescan = now
+
+        cutoff = now - self.settings.rolling_pass_sec
+        self.live_hosts = {ip: t for ip, t in self.live_hosts.items() if t > cutoff}
+        return self._group_hosts(sorted(self.live_hosts))
+
+    def _start_rolling_scan(self, arguments: str):
+        if self.progress is None:
+            self.progress = self._load_progress()
+            self._set_progress_gauges(self.progress)
+
+        blocks = get_rolling_slice(self.settings.ip_ranges, self.progress.num_slices, self.progress.next_slice)
+        # Group the blocks so each nmap process covers up to a /shard_prefix_len network.
+        blocks_per_shard = 2 ** max(0, _ROLLING_BLOCK_PREFIX_LEN - self.settings.shard_prefix_len)
+        shards = [' '.join(blocks[i:i + blocks_per_shard]) for i in range(0, len(blocks), blocks_per_shard)]
+        self.slice_shards = len(shards)
+        self.nmap_interface.scan_shards(shards + self._get_live_host_shards(), arguments)
+
+    def _set_progress_gauges(self, progress: NMAPScanProgress):
+        self.stats.set_gauges(rolling_pass_percent=progress.get_pass_percent(),
+                              rolling_completed_passes=progress.completed_passes,
+                              rolling_last_slice_timestamp=progress.last_slice_timestamp,
+                              rolling_last_slice_hosts=progress.last_slice_hosts)
+
+    def _finish_rolling_slice(self, shard_results: list[ShardResult]):
+        assert self.progress is not None
+        now = int(time.time())
+        progress = self.progress
+        _logger.info(f'Rolling scan of "{progress.ip_ranges}" slice {progress.next_slice + 1}/{progress.num_slices}: '
+                     f'{sum(shard.num_hosts for shard in shard_results)} hosts found.')
+        if progress.next_slice + 1 >= progress.num_slices:
+            _logger.info(f'Completed pass {progress.completed_passes + 1} of "{progress.ip_ranges}" in '
+                         f'{now - progress.pass_start}s.')
+            progress = progress._replace(next_slice=0, pass_start=now, completed_passes=progress.completed_passes + 1)
+        else:
+            progress = progress._replace(next_slice=progress.next_slice + 1)
+        self.progress = progress._replace(last_slice_timestamp=now,
+                                          last_slice_hosts=sum(shard.num_hosts for shard in shard_results))
+        self._set_progress_gauges(self.progress)
+        with DBInterface() as db_interface:
+            db_interface.set_nmap_scan_progress(self.progress)
 
     def _update(self):
-        if self.nmap_interface.in_progress:
+        if self.port_scan_targets is not None:
+            _logger.debug('Skipping discovery while port scan is in progress.')
+            return
+        elif self.nmap_interface.in_progress:
             _logger.error('Attempting new scan while previous run has not completed.')
             return
+        elif self.nmap_interface.shard_results is not None:
+            # The scan completed, but `_handle_results` hasn't run yet. A new scan would drop its results.
+            _logger.debug('Skipping scan until the previous results are handled.')
+            return
+
+        arguments = self.settings.nmap_flags
+        if self.settings.tiered_scan:
+            arguments = self.settings.discovery_flags
+            if self.port_scans is None:
+                self.port_scans = self._load_port_scans()
 
-        self.nmap_interface.scan_ranges(self.settings.nmap_flags)
+        if self.settings.rolling_scan:
+            self._start_rolling_scan(arguments)
+        else:
+            self.nmap_interface.scan_ranges(arguments)
 
 
 def main():
@@ -0,0 +1,156 @@
+'''
+Discovers devices without sending any traffic, from the host's neighbor table and the lease file of a DHCP server
+running on the same host.
+'''
+import ipaddress
+import logging
+import os
+import re
+import time
+from typing import NamedTuple, Optional
+
+from pet_monitor.common import (TRACE, ExtraNetworkInfoType,
+                                NetworkInterfaceInfo, standardize_mac_address)
+from pet_monitor.ingest import get_writer
+from pet_monitor.neighbor_table import neighbor_table, read_neighbor_table
+from pet_monitor.network_db import DBInterface
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+from pet_monitor.service_base import ServiceBase
+from pet_monitor.settings import PassiveDiscoverySettings, get_settings
+
+_logger = logging.getLogger(__name__)
+
+_ISC_LEASE = re.compile(r'lease\s+([\d.]+)\s*\{(.*?)\}', re.DOTALL)
+_ISC_MAC = re.compile(r'hardware\s+ethernet\s+([0-9a-fA-F:]+);')
+_ISC_HOSTNAME = re.compile(r'client-hostname\s+"([^"]*)";')
+_ISC_BINDING_STATE = re.compile(r'(?<!-)binding\s+state\s+(\w+);')
+
+
+class DHCPLease(NamedTuple):
+    ip: str
+    mac: str
+    hostname: Optional[str] = None
+
+
+def parse_dnsmasq_leases(text: str, now: Optional[float] = None) -> list[DHCPLease]:
+    # <expiry time> <MAC> <IP> <hostname or *> <client ID or *>
+    # 1736316315 a4:77:33:75:bc:c0 192.168.1.100 chromecast 01:a4:77:33:75:bc:c0
+    # DHCPv6 leases follow a `duid` line, with the IAID where the MAC would be.
+    now = time.time() if now is None else now
+    leases = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            expiry = int(fields[0])
+            ipaddress.IPv4Address(fields[2])
+        except ValueError:
+            # Skip DHCPv6 leases, and lines dnsmasq is still writing.
+            continue
+        # An expiry of 0 is an infinite lease.
+        if expiry != 0 and expiry < now:
+            continue
+        hostname = None if fields[3] == '*' else fields[3]
+        leases.append(DHCPLease(fields[2], standardize_mac_address(fields[1]), hostname))
+    return leases
+
+
+def parse_isc_leases(text: str) -> list[DHCPLease]:
+    # lease 192.168.1.100 {
+    #   starts 3 2025/01/08 06:05:19;
+    #   ends 3 2025/01/08 18:05:19;
+    #   binding state active;
+    #   hardware ethernet a4:77:33:75:bc:c0;
+    #   client-hostname "chromecast";
+    # }
+    leases: dict[str, DHCPLease] = {}
+    for match in _ISC_LEASE.finditer(text):
+        ip, body = match[1], match[2]
+        mac = _ISC_MAC.search(body)
+        state = _ISC_BINDING_STATE.search(body)
+        hostname = _ISC_HOSTNAME.search(body)
+        # The file is a log, so later entries for an IP replace earlier ones.
+        if mac is None or (state is not None and state[1] != 'active'):
+            leases.pop(ip, None)
+            continue
+        leases[ip] = DHCPLease(ip, standardize_mac_address(mac[1]), None if hostname is None else hostname[1])
+    return list(leases.values())
+
+
+def read_lease_file(path: str) -> list[DHCPLease]:
+    '''
+    Read a dnsmasq or ISC dhcpd lease file.
+    '''
+    with open(path) as fd:
+        text = fd.read()
+    if _ISC_LEASE.search(text):
+        return parse_isc_leases(text)
+    return parse_dnsmasq_leases(text)
+
+
+class PassiveDiscovery(ServiceBase):
+    def __init__(self, settings: PassiveDiscoverySettings) -> None:
+        super().__init__(settings.update_period_sec)
+        self.settings = settings
+        # Modification time of the lease file when it was last read.
+        self.lease_file_mtime: Optional[int] = None
+        self.leases: list[DHCPLease] = []
+        self.network_info = NetworkInfoDiffer()
+
+    def _update_leases(self) -> bool:
+        if self.settings.lease_file is None:
+            return False
+        try:
+            mtime = os.stat(self.settings.lease_file).st_mtime_ns
+            if mtime == self.lease_file_mtime:
+                return False
+            self.leases = read_lease_file(self.settings.lease_file)
+        except (OSError, ValueError) as e:
+            _logger.error(e)
+            return False
+        self.lease_file_mtime = mtime
+        _logger.debug(f'Read {len(self.leases)} leases from {self.settings.lease_file}.')
+        return True
+
+    def _update(self) -> None:
+        timestamp = int(time.time())
+        neighbors = {}
+        if self.settings.read_neighbor_table:
+            neighbors = read_neighbor_table()
+            neighbor_table.add_entries(neighbors.items())
+
+        devices: dict[str, tuple[NetworkInterfaceInfo, dict[ExtraNetworkInfoType, str]]] = {}
+        for ip, mac in neighbors.items():
+            devices[ip] = (NetworkInterfaceInfo(timestamp=timestamp, ip=ip, mac=mac), {})
+
+        # Leases are only written when the file changes, while the neighbor table is checked every update.
+        if self._update_leases():
+            for lease in self.leases:
+                extra_info = {} if lease.hostname is None else {ExtraNetworkInfoType.DHCP_NAME: lease.hostname}
+                devices[lease.ip] = (NetworkInterfaceInfo(timestamp=timestamp, ip=lease.ip, mac=lease.mac), extra_info)
+
+        with DBInterface() as db_interface:
+            writer = get_writer(db_interface)
+            for device, extra_info in devices.values():
+                self.network_info.write(writer, device, extra_info=extra_info)
+                _logger.log(TRACE, device)
+            self.network_info.flush_touches(writer)
+        self.stats.add_items(len(devices))
+
+
+def main():
+    logging.basicConfig(level=TRACE, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    settings = get_settings()
+    if settings.passive_discovery_settings is None:
+        print("Passive discovery settings not found.")
+        return
+
+    DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
+    passive_discovery = PassiveDiscovery(settings.passive_discovery_settings)
+    ServiceBase.run_services([passive_discovery])
+
+
+if __name__ == '__main__':
+    main()
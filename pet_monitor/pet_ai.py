@@ -6,6 +6,7 @@ import numpy as np
 
 from pet_monitor.common import (ExtraNetworkInfoType, Mood, Relationship,
                                 get_cutoff_timestamp)
+from pet_monitor.ingest import get_writer
 from pet_monitor.network_db import DBInterface
 from pet_monitor.service_base import ServiceBase
 from pet_monitor.settings import MoodAlgorithm, PetAISettings
@@ -100,13 +101,14 @@ class PetAi(ServiceBase):
             online_pets = [k for k, p in pet_attributes.items() if p.on_line]
             all_relationships = db_interface.get_relationship_map(online_pets)
             previous_moods = {p.name: p.mood for p in pet_info}
+            writer = get_writer(db_interface)
 
             for name, stats in pet_attributes.items():
                 # TODO: Update moods based on attributes.
                 mood = _get_mood(stats, median_pet_attributes, self.settings)
                 if mood is not previous_moods[name]:
                     _logger.info(f'{name} went from {previous_moods[name].name} to {mood.name}')
-                db_interface.update_pet_mood(name, mood)
+                writer.update_pet_mood(name, mood)
 
                 # TODO: Add other relationships
                 if stats.on_line:
@@ -157,3 +159,5 @@ class PetAi(ServiceBase):
                             _logger.info(f'New enmity between {name} and {enemy_name}')
                             db_interface.add_relationship(name, enemy_name, Relationship.ENEMY)
                             all_relationships.add(name, enemy_name, Relationship.ENEMY)
+
+        self.stats.add_items(len(pet_attributes))
@@ -2,16 +2,25 @@
 # TODO: Add concept of plugins for gathering different types of data. This can be enabled on a per device basis.
 
 import logging
+from typing import Union
 
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
 from pet_monitor.common import CONSOLE_LOG_FILE, LoggingTimeFilter
+from pet_monitor.ingest import IngestQueue, set_default_queue
 from pet_monitor.mdns_service import MDNSScraper
+from pet_monitor.memory_tracker import MemoryTracker
 from pet_monitor.network_db import DBInterface
 from pet_monitor.nmap.nmap_scraper import NMAPScraper
+from pet_monitor.passive_discovery import PassiveDiscovery
 from pet_monitor.pet_ai import PetAi
 from pet_monitor.ping import Pinger
+from pet_monitor.profiling import Profiler
+from pet_monitor.query_stats import QUERY_STATS_DIR, QueryStats
 from pet_monitor.service_base import ServiceBase
+from pet_monitor.service_metrics import METRICS_DIR, clear_stats
 from pet_monitor.settings import get_settings
 from pet_monitor.snmp.snmp_scraper import SNMPScraper
+from pet_monitor.supervisor import ServiceSupervisor, WorkerSpec
 from pet_monitor.tplink_scraper.scraper import TPLinkScraper
 
 _logger = logging.getLogger('pet_monitor.pet_monitor_service')
@@ -34,28 +43,62 @@ def main():
 
     settings = get_settings()
     DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
+    Profiler.set_settings(settings.profiling_settings)
+    if settings.query_stats_settings is not None:
+        DBInterface.set_query_stats(QueryStats('monitor', settings.query_stats_settings, QUERY_STATS_DIR))
+    # Start the service stats over, before any of this run's services save theirs.
+    clear_stats(METRICS_DIR)
 
-    services: list[ServiceBase] = []
+    service_specs: list[WorkerSpec] = []
 
     if settings.tplink_settings is not None:
-        services.append(TPLinkScraper(settings.tplink_settings))
+        service_specs.append(WorkerSpec(TPLinkScraper, settings.tplink_settings))
 
     if settings.nmap_settings is not None:
-        services.append(NMAPScraper(settings.nmap_settings))
+        service_specs.append(WorkerSpec(NMAPScraper, settings.nmap_settings))
 
     if settings.snmp_settings is not None:
-        services.append(SNMPScraper(settings.snmp_settings))
+        service_specs.append(WorkerSpec(SNMPScraper, settings.snmp_settings))
 
     if settings.pinger_settings is not None:
-        services.append(Pinger(settings.pinger_settings))
+        service_specs.append(WorkerSpec(Pinger, settings.pinger_settings))
 
     if settings.mdns_settings is not None:
-        services.append(MDNSScraper(settings.mdns_settings))
+        service_specs.append(WorkerSpec(MDNSScraper, settings.mdns_settings))
 
-    if settings.pet_ai_settings is not None:
-        services.append(PetAi(settings.pet_ai_settings))
+    if settings.passive_discovery_settings is not None:
+        service_specs.append(WorkerSpec(PassiveDiscovery, settings.passive_discovery_settings))
 
-    ServiceBase.run_services(services)
+    if settings.pet_ai_settings is not None:
+        service_specs.append(WorkerSpec(PetAi, settings.pet_ai_settings))
+
+    # I/O bound services run as coroutines on one event loop, and the rest run in threads from it. Services listed in
+    # the supervisor settings run in their own processes instead.
+    services: list[Union[AsyncServiceBase, ServiceBase]] = []
+    supervisor = ServiceSupervisor(settings.supervisor_settings, settings.scheduler_settings, METRICS_DIR,
+                                   settings.memory_tracker_settings, settings.ingest_settings)
+    for spec in service_specs:
+        if spec.service_class.__name__ in settings.supervisor_settings.isolated_services:
+            supervisor.add(spec.service_class, spec.settings)
+        else:
+            services.append(spec.service_class(spec.settings))
+    if settings.memory_tracker_settings is not None:
+        services.append(MemoryTracker(settings.memory_tracker_settings, list(services)))
+
+    # The services in this process write to the DB from one thread.
+    ingest_queue = None
+    if settings.ingest_settings is not None:
+        ingest_queue = IngestQueue(settings.ingest_settings)
+        ingest_queue.start(METRICS_DIR)
+        set_default_queue(ingest_queue)
+
+    try:
+        with supervisor:
+            AsyncServiceRunner(services, settings.scheduler_settings, METRICS_DIR).run_services()
+    finally:
+        # Write what's left in the queue before exiting.
+        if ingest_queue is not None:
+            ingest_queue.stop()
 
     _logger.debug('Monitor shutdown')
 
@@ -1,46 +1,36 @@
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import Generator, Iterable
 
-from icmplib import ping
+from icmplib import async_ping
 
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
 from pet_monitor.common import TRACE
+from pet_monitor.ingest import get_writer
 from pet_monitor.network_db import DBInterface
-from pet_monitor.service_base import ServiceBase
 from pet_monitor.settings import PingerSettings, get_settings
 
 _logger = logging.getLogger(__name__)
 
 
-def _check_host(address: str) -> bool:
-    try:
-        host = ping(address, count=1, timeout=1, privileged=False)
-        is_online = host.packets_sent == host.packets_received
-        _logger.log(TRACE, f'ping {address} {is_online}')
-        return is_online
-    except Exception as e:
-        _logger.log(TRACE, f'ping {address} {e}')
-        return False
-
-
-def _ping_in_parallel(hosts: Iterable[tuple[str, str]]) -> Generator[tuple[str, bool], None, None]:
-    with ThreadPoolExecutor() as executor:
+async def _check_host(address: str, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
         try:
-            names, addresses = zip(*hosts)
-        # No entries
-        except ValueError:
-            return
-
-        for name, is_online in zip(names, executor.map(_check_host, addresses)):
-            yield name, is_online
+            host = await async_ping(address, count=1, timeout=1, privileged=False)
+            is_online = host.packets_sent == host.packets_received
+            _logger.log(TRACE, f'ping {address} {is_online}')
+            return is_online
+        except Exception as e:
+            _logger.log(TRACE, f'ping {address} {e}')
+            return False
 
 
-class Pinger(ServiceBase):
+class Pinger(AsyncServiceBase):
     def __init__(self, settings: PingerSettings) -> None:
-        super().__init__(settings.update_period_sec)
+        # Each ping times out in a second, so an update that lasts a whole period is stuck.
+        super().__init__(settings.update_period_sec, timeout_sec=settings.update_period_sec)
         self.settings = settings
 
-    def _update(self) -> None:
+    def _get_hosts(self) -> dict[str, str]:
         with DBInterface() as db_interface:
             # Clear old data.
             db_interface.delete_old_availablity(int(self.settings.history_len))
@@ -48,16 +38,26 @@ class Pinger(ServiceBase):
             pet_info = db_interface.get_pet_info()
             pet_device_map = db_interface.get_network_info_for_pets(pet_info)
 
-        hosts = set()
+        hosts = {}
         for name, device in pet_device_map.items():
             host = device.get_host()
             if host:
-                hosts.add((name, device.ip))
+                hosts[name] = device.ip
+        return hosts
+
+    def _write_availability(self, availability: dict[str, bool]):
+        with DBInterface() as db_interface:
+            writer = get_writer(db_interface)
+            for name, is_online in availability.items():
+                writer.add_pet_availability(name, is_online)
+        self.stats.add_items(len(availability))
 
-        # Ideally, don't block on this. Leaving the scope waits for all threads to finish.
-        for name, is_online in _ping_in_parallel(hosts):
-            with DBInterface() as db_interface:
-                db_interface.add_pet_availability(name, is_online)
+    async def update(self) -> None:
+        hosts = await asyncio.to_thread(self._get_hosts)
+        # The pings are all in flight on the event loop at once, up to the concurrency limit.
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_pings)
+        results = await asyncio.gather(*(_check_host(address, semaphore) for address in hosts.values()))
+        await asyncio.to_thread(self._write_availability, dict(zip(hosts, results)))
 
 
 def main():
@@ -70,7 +70,7 @@ def main():
 
     DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
     pinger = Pinger(settings.pinger_settings)
-    ServiceBase.run_services([pinger])
+    AsyncServiceRunner([pinger]).run_services()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+'''
+Opt-in cProfile sampling of service updates and web views.
+
+A `Profiler` profiles every Nth call of its target and saves the results as `.pstats` files in `PROFILES_DIR`, keeping
+the newest few per target. Targets are enabled with `ProfilingSettings.targets` or the LAN_PETS_PROFILE environment
+variable, for example `LAN_PETS_PROFILE=PetAi,view_pet`.
+
+Since Python 3.12 cProfile records every thread, and only one profile can run at a time. A profile covers whatever
+else ran during the call, and calls sampled while another profile is running are skipped.
+'''
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from pet_monitor.common import DATA_DIR
+from pet_monitor.settings import ProfilingSettings
+
+_logger = logging.getLogger(__name__)
+
+PROFILES_DIR = DATA_DIR / 'profiles'
+PROFILE_ENV_VAR = 'LAN_PETS_PROFILE'
+
+T = TypeVar('T')
+
+
+class Profiler:
+    '''
+    Samples calls of one target with cProfile.
+    '''
+    _settings = ProfilingSettings()
+    _profile_dir = PROFILES_DIR
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.num_calls = 0
+        self.num_profiles = 0
+        self.lock = Lock()
+
+    @classmethod
+    def set_settings(cls, settings: ProfilingSettings, profile_dir: Optional[Path] = None):
+        cls._settings = settings
+        if profile_dir is not None:
+            cls._profile_dir = profile_dir
+
+    @classmethod
+    def get_targets(cls) -> set[str]:
+        env_targets = os.environ.get(PROFILE_ENV_VAR, '').split(',')
+        return {t.strip() for t in (*cls._settings.targets, *env_targets) if len(t.strip()) > 0}
+
+    def is_enabled(self) -> bool:
+        targets = self.get_targets()
+        return self.name in targets or '*' in targets
+
+    def _should_sample(self) -> bool:
+        if not self.is_enabled():
+            return False
+        with self.lock:
+            self.num_calls += 1
+            return self.num_calls % self._settings.sample_every == 0
+
+    def _start(self) -> Optional[cProfile.Profile]:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            _logger.debug(f'Skipped profiling {self.name}, another profile is running.')
+            return None
+        return profile
+
+    def _save(self, profile: cProfile.Profile):
+        profile.disable()
+        try:
+            self._profile_dir.mkdir(parents=True, exist_ok=True)
+            path = self._profile_dir / f'{self.name}-{time.time_ns()}.pstats'
+            profile.dump_stats(path)
+            self.num_profiles += 1
+            _logger.debug(f'Saved {path}')
+            # The file names sort by time.
+            old_paths = sorted(self._profile_dir.glob(f'{self.name}-*.pstats'))[:-self._settings.max_files_per_target]
+            for old_path in old_paths:
+                old_path.unlink(missing_ok=True)
+        except OSError as e:
+            _logger.warning(f'Failed to save {self.name} profile: {e}')
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        profile = self._start() if self._should_sample() else None
+        if profile is None:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._save(profile)
+
+    async def call_async(self, func: Callable[[], Awaitable[T]]) -> T:
+        '''
+        Like `call` for a coroutine function. The profile also covers the other tasks on the event loop.
+        '''
+        profile = self._start() if self._should_sample() else None
+        if profile is None:
+            return await func()
+        try:
+            return await func()
+        finally:
+            self._save(profile)
+
+
+def summarize_profiles(profile_dir: Path = PROFILES_DIR, target: Optional[str] = None, sort='tottime',
+                       limit=25) -> str:
+    '''
+    Combine the saved profiles of `target`, or of every target, and list the top functions.
+    '''
+    pattern = '*.pstats' if target is None else f'{target}-*.pstats'
+    paths = sorted(Path(profile_dir).glob(pattern))
+    if len(paths) == 0:
+        return f'No profiles matching {pattern} in {profile_dir}.\n'
+    output = io.StringIO()
+    targets = sorted({p.name.rsplit('-', 1)[0] for p in paths})
+    output.write(f'{len(paths)} profiles of {", ".join(targets)}\n')
+    stats = pstats.Stats(*(str(p) for p in paths), stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
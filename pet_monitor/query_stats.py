@@ -0,0 +1,355 @@
+'''
+Opt-in timing of the DB methods and the SQL statements they run.
+
+Once `DBInterface.set_query_stats` is given a `QueryStats`, each call of a public `DBInterface` method is timed, and
+new connections time each statement from when it's executed until its last row is fetched. Only the time spent in
+SQLite counts, not the time the caller spends between fetches. Statements are grouped after replacing their literals
+with `?`, so the same query with different values shares its stats. Statements slower than
+`QueryStatsSettings.slow_query_sec` are logged, with their query plan the first time.
+
+Each process saves its stats to a JSON file in `QUERY_STATS_DIR`, which the web app serves with the service metrics.
+Processes that run several copies at once, like the web workers, add their PID to the name with `get_process_name`.
+'''
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterable, Optional
+
+from pet_monitor.service_metrics import METRICS_DIR
+from pet_monitor.settings import QueryStatsSettings
+
+_logger = logging.getLogger(__name__)
+
+QUERY_STATS_DIR = METRICS_DIR / 'queries'
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_COMMENT_RE = re.compile(r'--[^\n]*')
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+# Lists of values, including the double quoted names some queries build for `IN`.
+_VALUE_LIST_RE = re.compile(r'\((?:\?|"[^"]*")(?:, ?(?:\?|"[^"]*"))*\)')
+# Statements that EXPLAIN QUERY PLAN can describe.
+_EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b', re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    '''
+    Replace the literals in `sql` with `?`, and collapse whitespace.
+    '''
+    sql = _COMMENT_RE.sub('', _STRING_RE.sub('?', sql))
+    sql = ' '.join(sql.split()).rstrip(';').strip()
+    sql = _NUMBER_RE.sub('?', sql)
+    # The lists built for `IN` vary in length.
+    return _VALUE_LIST_RE.sub('(?, ...)', sql)
+
+
+class TimingStats:
+    def __init__(self, max_samples: int) -> None:
+        self.count = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        # Calls slower than the slow query threshold. Only counted for statements.
+        self.num_slow = 0
+        self.samples: deque[float] = deque(maxlen=max_samples)
+
+    def record(self, duration_sec: float):
+        self.count += 1
+        self.total_sec += duration_sec
+        self.max_sec = max(self.max_sec, duration_sec)
+        self.samples.append(duration_sec)
+
+    def get_percentile(self, percent: float) -> float:
+        '''
+        Percentile of the recent samples.
+        '''
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(len(ordered) * percent / 100.0) - 1, 0)]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'count': self.count, 'total_sec': self.total_sec, 'max_sec': self.max_sec,
+                'p95_sec': self.get_percentile(95.0), 'num_slow': self.num_slow}
+
+
+class QueryStats:
+    '''
+    Timings of the DB methods and statements run in this process.
+    '''
+
+    def __init__(self, name: str, settings: QueryStatsSettings = QueryStatsSettings(),
+                 stats_dir: Optional[Path] = None) -> None:
+        self.name = name
+        self.settings = settings
+        # JSON file to periodically save the stats to, or None to only keep them in memory.
+        self.path = None if stats_dir is None else Path(stats_dir) / f'{name}.json'
+        self.lock = Lock()
+        self.methods: dict[str, TimingStats] = {}
+        self.statements: dict[str, TimingStats] = {}
+        # Statements whose query plan was logged.
+        self.explained: set[str] = set()
+        self.last_save = time.monotonic()
+
+    def _record(self, timings: dict[str, TimingStats], key: str, duration_sec: float) -> TimingStats:
+        with self.lock:
+            if key not in timings:
+                timings[key] = TimingStats(self.settings.max_samples)
+            timings[key].record(duration_sec)
+            return timings[key]
+
+    def record_method(self, name: str, duration_sec: float):
+        self._record(self.methods, name, duration_sec)
+        self._save_if_due()
+
+    def record_statement(self, sql: str, duration_sec: float) -> bool:
+        '''
+        Record a statement that was normalized with `normalize_sql`, and return whether it was slow.
+        '''
+        is_slow = duration_sec > self.settings.slow_query_sec
+        timing = self._record(self.statements, sql, duration_sec)
+        if is_slow:
+            with self.lock:
+                timing.num_slow += 1
+        self._save_if_due()
+        return is_slow
+
+    def should_explain(self, sql: str) -> bool:
+        with self.lock:
+            if sql in self.explained:
+                return False
+            self.explained.add(sql)
+            return True
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {'name': self.name,
+                    'methods': {k: v.to_dict() for k, v in self.methods.items()},
+                    'statements': {k: v.to_dict() for k, v in self.statements.items()}}
+
+    def _save_if_due(self):
+        if self.path is not None and time.monotonic() - self.last_save >= self.settings.save_period_sec:
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        self.last_save = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Replace the file in one step, so readers don't see a partial write.
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self.to_dict()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            _logger.warning(f'Failed to save {self.name} query stats: {e}')
+
+
+class TimedCursor(sqlite3.Cursor):
+    '''
+    Times each statement from when it's executed until its last row is fetched.
+    '''
+    # SQL, parameters, and time spent in SQLite so far for the statement that's being fetched.
+    _pending: Optional[list] = None
+
+    def execute(self, sql, parameters=(), /):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._pending = [sql, parameters, time.perf_counter() - start]
+        # Statements without results are done once they're executed.
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters, /):
+        self._finish()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._pending = [sql, None, time.perf_counter() - start]
+        self._finish()
+        return self
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed_fetch(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed_fetch(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Statements whose rows weren't all fetched.
+        self._finish()
+
+    def _finish(self):
+        if self._pending is None:
+            return
+        sql, parameters, duration_sec = self._pending
+        self._pending = None
+        query_stats: Optional[QueryStats] = getattr(self.connection, 'query_stats', None)
+        if query_stats is None:
+            return
+        key = normalize_sql(sql)
+        if query_stats.record_statement(key, duration_sec):
+            message = f'Slow query took {duration_sec * 1000.0:.1f} ms: {key}'
+            if parameters is not None and _EXPLAINABLE_RE.match(sql) and query_stats.should_explain(key):
+                message += self._explain(sql, parameters)
+            _logger.warning(message)
+
+    def _explain(self, sql: str, parameters) -> str:
+        try:
+            # A plain cursor, so the plan isn't timed.
+            rows = sqlite3.Cursor(self.connection).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            return f'\nFailed to get the query plan: {e}'
+        # Plain inserts don't have a plan.
+        return ''.join(f'\n  {row[3]}' for row in rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    '''
+    Connection whose cursors time their statements into `query_stats`.
+    '''
+    query_stats: Optional[QueryStats] = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The built in shortcuts make plain cursors.
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def time_public_methods(cls):
+    '''
+    Class decorator that times the public methods into the class's `_query_stats`, when it's set.
+    '''
+    def wrap(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            query_stats = self._query_stats
+            if query_stats is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                query_stats.record_method(method.__name__, time.perf_counter() - start)
+        return wrapper
+
+    for name, value in list(vars(cls).items()):
+        # Static and class methods are skipped, since they don't use a connection.
+        if not name.startswith('_') and inspect.isfunction(value):
+            setattr(cls, name, wrap(value))
+    return cls
+
+
+def get_process_name(prefix: str) -> str:
+    '''
+    Stats name for one of several processes that share `prefix`, so each saves to its own file.
+    '''
+    return f'{prefix}_{os.getpid()}'
+
+
+def _is_process_running(pid: int) -> bool:
+    # On Windows, os.kill stops the process instead of checking it.
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_exited_process_stats(prefix: str, stats_dir: Path = QUERY_STATS_DIR):
+    '''
+    Remove the stats saved under `get_process_name(prefix)` by processes that are no longer running.
+    '''
+    for path in Path(stats_dir).glob(f'{prefix}_*.json'):
+        pid = path.stem[len(prefix) + 1:]
+        if pid.isdigit() and not _is_process_running(int(pid)):
+            path.unlink(missing_ok=True)
+
+
+def load_query_stats(stats_dir: Path = QUERY_STATS_DIR) -> list[dict[str, Any]]:
+    '''
+    Load the stats saved by each process.
+    '''
+    results = []
+    for path in sorted(Path(stats_dir).glob('*.json')):
+        try:
+            results.append(json.loads(path.read_text()))
+        except (OSError, ValueError) as e:
+            _logger.warning(f'Failed to load {path}: {e}')
+    return results
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(stats: Iterable[dict[str, Any]]) -> str:
+    '''
+    Format loaded stats in the Prometheus text exposition format.
+    '''
+    stats = list(stats)
+    lines = []
+
+    def add_metric(kind: str, label: str, name: str, metric_type: str, help_text: str, key: str):
+        metric = f'lan_pets_db_{kind}_{name}'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for s in stats:
+            for target, values in sorted(s[f'{kind}s'].items()):
+                lines.append(f'{metric}{{process="{s["name"]}",{label}="{_escape_label(target)}"}} {values[key]}')
+
+    for kind, label in (('method', 'method'), ('statement', 'sql')):
+        add_metric(kind, label, 'calls_total', 'counter', f'Calls of each DB {kind}.', 'count')
+        add_metric(kind, label, 'seconds_total', 'counter', f'Time spent in each DB {kind}.', 'total_sec')
+        add_metric(kind, label, 'p95_seconds', 'gauge', f'95th percentile of recent {kind} durations.', 'p95_sec')
+        add_metric(kind, label, 'max_seconds', 'gauge', f'Longest {kind} duration.', 'max_sec')
+    add_metric('statement', 'sql', 'slow_total', 'counter', 'Statements slower than the slow query threshold.',
+               'num_slow')
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,15 @@
+import heapq
+import itertools
 import logging
+import math
 import random
 import time
 from threading import Condition, Thread
-from typing import Optional
+from typing import Callable, Optional
+
+from pet_monitor.profiling import Profiler
+from pet_monitor.service_metrics import ServiceStats, registry
+from pet_monitor.settings import SchedulerSettings
 
 _logger = logging.getLogger(__name__)
 
@@ -23,52 +30,236 @@ class RateLimiter:
         return time.monotonic() - self.last_update > self.update_period_sec
 
 
-class ServiceBase:
+def get_next_deadline(deadline: float, period: float, now: float) -> tuple[float, int]:
+    '''
+    The deadline to update at after `deadline`, and the number of deadlines skipped to reach it. Deadlines that have
+    already passed are coalesced into a single update for the most recent one.
+    '''
+    next_deadline = deadline + period
+    num_missed = 0
+    if next_deadline <= now:
+        num_missed = math.floor((now - next_deadline) / period)
+        next_deadline += num_missed * period
+    return next_deadline, num_missed
+
+
+class UpdateTiming:
+    '''
+    Deadline, overrun and coalescing accounting shared by `ServiceBase` and `AsyncServiceBase`, so services are measured
+    the same way whichever runtime runs them.
+    '''
+
+    def __init__(self, update_period_sec: float) -> None:
+        self.update_period_sec = update_period_sec
+        # Monotonic deadline the current or last update was scheduled for.
+        self.last_update = float('-inf')
+        # How late the last update started relative to its deadline.
+        self.last_delay_sec = 0.0
+        self.num_updates = 0
+        # Number of updates that took longer than the update period.
+        self.num_overruns = 0
+        # Number of deadlines merged into another update because the service or its runtime was busy.
+        self.num_coalesced = 0
+        self.stats = ServiceStats(self.get_name(), update_period_sec)
+        self.profiler = Profiler(self.get_name())
+
+    def get_name(self) -> str:
+        return type(self).__name__
+
+    def _start_update(self, deadline: float, now: float) -> int:
+        '''
+        Record the start of the update for `deadline`. Returns the number of deadlines since the last update that were
+        coalesced into this one.
+        '''
+        # Coalesced deadlines are only counted here, from the gap between the deadlines that did get an update, so each
+        # is counted once however it was skipped.
+        num_coalesced = 0
+        if self.last_update != float('-inf'):
+            num_coalesced = max(0, round((deadline - self.last_update) / self.update_period_sec) - 1)
+        self.num_coalesced += num_coalesced
+        self.last_update = deadline
+        self.last_delay_sec = now - deadline
+        return num_coalesced
+
+    def _finish_update(self, elapsed_sec: float, num_coalesced: int, timed_out=False):
+        self.num_updates += 1
+        # An update that was cancelled isn't counted as an overrun.
+        is_overrun = not timed_out and elapsed_sec > self.update_period_sec
+        if is_overrun:
+            self.num_overruns += 1
+            _logger.warning(f'{self.get_name()} update took {elapsed_sec:.1f}s, longer than its '
+                            f'{self.update_period_sec:.1f}s period.')
+        self.stats.record_update(elapsed_sec, is_overrun, num_coalesced, timed_out=timed_out)
+
+    def _skip_missed_deadlines(self, deadline: float, now: float) -> tuple[float, int]:
+        '''
+        The next deadline after `deadline`, skipping the ones that already passed.
+        '''
+        next_deadline, num_missed = get_next_deadline(deadline, self.update_period_sec, now)
+        if num_missed > 0:
+            _logger.warning(f'{self.get_name()} missed {num_missed} deadlines.')
+        return next_deadline, num_missed
+
+
+class Scheduler:
+    '''
+    Triggers each service's update at deadlines spaced by its update period, from a single thread that sleeps until
+    the earliest deadline.
+
+    Deadlines stay on a fixed grid from the service's first run, so an update that starts late doesn't shift the ones
+    after it. Deadlines that pass while the scheduler or the service is busy are coalesced into a single update.
+    '''
+
+    def __init__(self, jitter_sec=0.0) -> None:
+        # Random delay of up to this long added to each update, so services with the same period drift apart.
+        self.jitter_sec = jitter_sec
+        self.condition = Condition()
+        # (time to trigger, tie breaker, deadline, service)
+        self.heap: list[tuple[float, int, float, 'ServiceBase']] = []
+        self._sequence = itertools.count()
+        self.is_running = False
+        self.thread: Optional[Thread] = None
+
+    def _push(self, deadline: float, service: 'ServiceBase'):
+        jitter = random.uniform(0, min(self.jitter_sec, service.update_period_sec / 2))
+        heapq.heappush(self.heap, (deadline + jitter, next(self._sequence), deadline, service))
+
+    def add(self, service: 'ServiceBase', phase_offset_sec=0.0):
+        '''
+        Schedule the first update of `service` `phase_offset_sec` from now.
+        '''
+        with self.condition:
+            self._push(time.monotonic() + phase_offset_sec, service)
+            if not self.is_running:
+                self.is_running = True
+                self.thread = Thread(target=self._run_loop, name='scheduler')
+                self.thread.start()
+            self.condition.notify()
+
+    def remove(self, service: 'ServiceBase'):
+        with self.condition:
+            self.heap = [entry for entry in self.heap if entry[3] is not service]
+            heapq.heapify(self.heap)
+            self.condition.notify()
+
+    def _run_loop(self):
+        with self.condition:
+            # The thread exits once there's nothing left to schedule, and is restarted by `add`.
+            while len(self.heap) > 0:
+                trigger_time, _, deadline, service = self.heap[0]
+                now = time.monotonic()
+                if trigger_time > now:
+                    self.condition.wait(trigger_time - now)
+                    continue
+                heapq.heappop(self.heap)
+
+                service._request_update(deadline)
+                next_deadline, _ = service._skip_missed_deadlines(deadline, now)
+                self._push(next_deadline, service)
+            self.is_running = False
+
+
+class ServiceBase(UpdateTiming):
+    '''
+    A service whose `_update` runs periodically on its own thread, triggered by the shared `scheduler`.
+
+    Other threads can queue work for the service thread with `post`, for example to handle results as they arrive
+    instead of polling for them.
+    '''
     error_condition = Condition()
+    scheduler = Scheduler()
 
     def __init__(self, update_period_sec: float) -> None:
-        self._rate_limiter = RateLimiter(update_period_sec)
+        super().__init__(update_period_sec)
         self.is_running = False
         self.thread: Optional[Thread] = None
+        self._condition = Condition()
+        self._pending_deadline: Optional[float] = None
+        self._callbacks: list[Callable[[], None]] = []
+        # Called after a callback is posted, for runners that don't use the service thread.
+        self.on_post: Optional[Callable[[], None]] = None
 
-    def run(self) -> None:
+    def run(self, phase_offset_sec=0.0) -> None:
         if not self.is_running:
             self.is_running = True
-            self.thread = Thread(target=self._run_loop)
+            self.thread = Thread(target=self._run_loop, name=self.get_name())
             self.thread.start()
+            self.scheduler.add(self, phase_offset_sec)
+
+    def post(self, callback: Callable[[], None]):
+        '''
+        Run `callback` on the service thread. A callback that's already waiting to run isn't added again.
+        '''
+        with self._condition:
+            if callback in self._callbacks:
+                return
+            self._callbacks.append(callback)
+            self._condition.notify()
+        if self.on_post is not None:
+            self.on_post()
+
+    def _run_callbacks(self):
+        with self._condition:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _request_update(self, deadline: float):
+        with self._condition:
+            # A pending deadline that's replaced is counted as coalesced when the update runs.
+            self._pending_deadline = deadline
+            self._condition.notify()
+
+    def _run_update(self, deadline: float):
+        start = time.monotonic()
+        num_coalesced = self._start_update(deadline, start)
+        try:
+            self.profiler.call(self._update)
+        except Exception as e:
+            self.stats.record_error(e)
+            raise
+        self._finish_update(time.monotonic() - start, num_coalesced)
 
     def _run_loop(self) -> None:
         try:
-            while self.is_running:
-                self._check()
-                if not self._rate_limiter.get_ready():
-                    time.sleep(0.1)
-                    continue
-                self._update()
+            while True:
+                with self._condition:
+                    while self.is_running and self._pending_deadline is None and len(self._callbacks) == 0:
+                        self._condition.wait()
+                    if not self.is_running:
+                        break
+                    deadline, self._pending_deadline = self._pending_deadline, None
+
+                self._run_callbacks()
+                if deadline is not None:
+                    self._run_update(deadline)
         except Exception:
             _logger.error('Unhandled Exception:', exc_info=True)
         with self.error_condition:
             self.error_condition.notify()
 
-    def _check(self) -> None:
-        pass
-
     def _update(self) -> None:
         pass
 
     def stop(self):
         if self.is_running and self.thread:
-            self.is_running = False
+            self.scheduler.remove(self)
+            with self._condition:
+                self.is_running = False
+                self._condition.notify()
             self.thread.join()
 
     @classmethod
-    def run_services(cls, services: list['ServiceBase']):
+    def run_services(cls, services: list['ServiceBase'], settings: SchedulerSettings = SchedulerSettings(),
+                     metrics_dir=None):
+        cls.scheduler.jitter_sec = settings.jitter_sec
+        for service in services:
+            registry.register(service.stats, metrics_dir)
         try:
             with cls.error_condition:
-                for service in services:
-                    service.run()
-                    # Add random startup delay to offset services.
-                    time.sleep(random.uniform(1, 2))
+                for i, service in enumerate(services):
+                    # Offset the first update of each service so they don't all start at once.
+                    service.run(phase_offset_sec=i * settings.startup_spacing_sec)
                 cls.error_condition.wait()
         except KeyboardInterrupt:
             pass
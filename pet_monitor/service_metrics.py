@@ -0,0 +1,199 @@
+'''
+Timing and activity stats for each service.
+
+The runners record every update in the service's `ServiceStats`, and services count the items they write with
+`add_items`. Stats are kept in the in-process `registry`, and each service's stats can also be saved to a JSON file
+after every update. The web app reads those files to serve them in the Prometheus text format, since the services run
+in other processes.
+'''
+import bisect
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterable, Optional
+
+from pet_monitor.common import DATA_DIR
+
+_logger = logging.getLogger(__name__)
+
+METRICS_DIR = DATA_DIR / 'metrics'
+
+# Upper bounds of the update duration histogram buckets. Updates range from milliseconds for the pinger to minutes
+# for nmap scans.
+DURATION_BUCKETS_SEC = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class ServiceStats:
+    def __init__(self, name: str, update_period_sec: float) -> None:
+        self.name = name
+        self.update_period_sec = update_period_sec
+        # JSON file to save the stats to after each update, or None to only keep them in memory.
+        self.path: Optional[Path] = None
+        self.lock = Lock()
+        # Count of updates in each of DURATION_BUCKETS_SEC, with a last bucket for longer updates.
+        self.bucket_counts = [0] * (len(DURATION_BUCKETS_SEC) + 1)
+        self.duration_sum_sec = 0.0
+        self.num_updates = 0
+        self.num_overruns = 0
+        self.num_coalesced = 0
+        self.num_timeouts = 0
+        self.num_errors = 0
+        # Number of observations written by the service, like availability samples or devices.
+        self.num_items = 0
+        # Unix times of the last update that finished, and the last error.
+        self.last_success_time: Optional[float] = None
+        self.last_error_time: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # Other values reported by the service, like queue depths.
+        self.gauges: dict[str, float] = {}
+
+    def record_update(self, duration_sec: float, is_overrun: bool, num_coalesced: int = 0, timed_out=False):
+        with self.lock:
+            self.bucket_counts[bisect.bisect_left(DURATION_BUCKETS_SEC, duration_sec)] += 1
+            self.duration_sum_sec += duration_sec
+            self.num_updates += 1
+            self.num_overruns += int(is_overrun)
+            self.num_coalesced += num_coalesced
+            if timed_out:
+                self.num_timeouts += 1
+            else:
+                self.last_success_time = time.time()
+        self.save()
+
+    def record_error(self, error: Any):
+        '''
+        Record an update that failed, or an error the service handled itself.
+        '''
+        with self.lock:
+            self.num_errors += 1
+            self.last_error_time = time.time()
+            self.last_error = repr(error) if isinstance(error, BaseException) else str(error)
+        self.save()
+
+    def add_items(self, count: int):
+        with self.lock:
+            self.num_items += count
+
+    def set_gauges(self, **values: float):
+        with self.lock:
+            self.gauges.update(values)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            # Copy the containers, so they can't change while they're being saved.
+            return {key: value.copy() if isinstance(value, (list, dict)) else value
+                    for key, value in vars(self).items() if key not in ('path', 'lock')}
+
+    @classmethod
+    def from_dict(cls, values: dict[str, Any]) -> 'ServiceStats':
+        stats = cls(values['name'], values['update_period_sec'])
+        for key, value in values.items():
+            setattr(stats, key, value)
+        return stats
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Replace the file in one step, so readers don't see a partial write.
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self.to_dict()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            _logger.warning(f'Failed to save {self.name} stats: {e}')
+
+
+class MetricsRegistry:
+    '''
+    The stats of the services running in this process.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.stats: dict[str, ServiceStats] = {}
+
+    def register(self, stats: ServiceStats, metrics_dir: Optional[Path] = None):
+        if metrics_dir is not None:
+            stats.path = Path(metrics_dir) / f'{stats.name}.json'
+        with self.lock:
+            self.stats[stats.name] = stats
+
+    def get_stats(self) -> list[ServiceStats]:
+        with self.lock:
+            return list(self.stats.values())
+
+
+registry = MetricsRegistry()
+
+
+def clear_stats(metrics_dir: Path = METRICS_DIR):
+    '''
+    Remove the stats saved by earlier runs, so services that are no longer configured aren't reported.
+    '''
+    for path in (*Path(metrics_dir).glob('*.json'), *Path(metrics_dir).glob('*.tmp')):
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            _logger.warning(f'Failed to remove {path}: {e}')
+
+
+def load_stats(metrics_dir: Path = METRICS_DIR) -> list[ServiceStats]:
+    '''
+    Load the stats saved by the services.
+    '''
+    results = []
+    for path in sorted(Path(metrics_dir).glob('*.json')):
+        try:
+            results.append(ServiceStats.from_dict(json.loads(path.read_text())))
+        except (OSError, ValueError, KeyError) as e:
+            _logger.warning(f'Failed to load {path}: {e}')
+    return results
+
+
+def format_prometheus(stats: Iterable[ServiceStats]) -> str:
+    '''
+    Format stats in the Prometheus text exposition format.
+    '''
+    stats = list(stats)
+    lines = []
+
+    def add_metric(name: str, metric_type: str, help_text: str, attribute: str):
+        lines.append(f'# HELP lan_pets_service_{name} {help_text}')
+        lines.append(f'# TYPE lan_pets_service_{name} {metric_type}')
+        for s in stats:
+            value = getattr(s, attribute)
+            if value is not None:
+                lines.append(f'lan_pets_service_{name}{{service="{s.name}"}} {value}')
+
+    lines.append('# HELP lan_pets_service_update_duration_seconds Time taken by each service update.')
+    lines.append('# TYPE lan_pets_service_update_duration_seconds histogram')
+    for s in stats:
+        label = f'service="{s.name}"'
+        count = 0
+        for bound, bucket_count in zip((*DURATION_BUCKETS_SEC, '+Inf'), s.bucket_counts):
+            count += bucket_count
+            lines.append(f'lan_pets_service_update_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'lan_pets_service_update_duration_seconds_sum{{{label}}} {s.duration_sum_sec}')
+        lines.append(f'lan_pets_service_update_duration_seconds_count{{{label}}} {count}')
+
+    add_metric('update_period_seconds', 'gauge', 'Configured update period.', 'update_period_sec')
+    add_metric('updates_total', 'counter', 'Updates run.', 'num_updates')
+    add_metric('overruns_total', 'counter', 'Updates that took longer than the update period.', 'num_overruns')
+    add_metric('coalesced_total', 'counter', 'Updates skipped because the service was busy.', 'num_coalesced')
+    add_metric('timeouts_total', 'counter', 'Updates cancelled for taking too long.', 'num_timeouts')
+    add_metric('errors_total', 'counter', 'Failed updates and errors handled by the service.', 'num_errors')
+    add_metric('items_total', 'counter', 'Observations written by the service.', 'num_items')
+    add_metric('last_success_timestamp_seconds', 'gauge', 'Unix time the last update finished.',
+               'last_success_time')
+    add_metric('last_error_timestamp_seconds', 'gauge', 'Unix time of the last error.', 'last_error_time')
+
+    lines.append('# HELP lan_pets_service_gauge Other values reported by the service.')
+    lines.append('# TYPE lan_pets_service_gauge gauge')
+    for s in stats:
+        for name, value in sorted(s.gauges.items()):
+            lines.append(f'lan_pets_service_gauge{{service="{s.name}",name="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
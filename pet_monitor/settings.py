@@ -5,7 +5,7 @@ import time
 from enum import Enum, auto
 from typing import NamedTuple, Optional
 
-from pet_monitor.common import NetworkInterfaceInfo
+from pet_monitor.common import DATA_DIR, NetworkInterfaceInfo
 
 _logger = logging.getLogger(__name__)
 
@@ -19,6 +19,8 @@ class PingerSettings(NamedTuple):
     '''
     update_period_sec = 60.0
     history_len = MAX_HISTORY_LEN_SEC
+    # Number of pings in flight at once.
+    max_concurrent_pings = 64
 
 
 class MoodAlgorithm(Enum):
@@ -74,7 +76,12 @@ class TPLinkSettings(NamedTuple):
     username: str
     password: str
     collect_traffic_data = True
+    # How often to poll the DHCP client list.
     update_period_sec = 60.0 * 10
+    # How often to poll the DHCP reservations, which rarely change.
+    reservations_period_sec = 60.0 * 60.0
+    # How often to sample the traffic counters.
+    traffic_period_sec = 30.0
     history_len = MAX_HISTORY_LEN_SEC
 
 
@@ -86,6 +93,21 @@ class NMAPSettings(NamedTuple):
     use_sudo = False
     nmap_flags = "--open -T4"
     time_between_scans = 60.0 * 10.0
+    # Ranges are split into networks of at most this size, each scanned by its own nmap process.
+    shard_prefix_len = 24
+    # Maximum number of nmap processes to run at once.
+    max_concurrent_scans = 4
+    # Scan one slice of ip_ranges every time_between_scans instead of the whole range, so that a full pass over the
+    # range takes rolling_pass_sec.
+    rolling_scan = False
+    rolling_pass_sec = 60.0 * 60.0 * 6.0
+    # In rolling mode, hosts found within the last pass are rescanned at this interval.
+    live_host_rescan_sec = 60.0 * 30.0
+    # Scan every time_between_scans with the cheap discovery_flags, and only port scan with nmap_flags the hosts that
+    # are new, changed IP or MAC, or were last port scanned more than port_scan_ttl_sec ago.
+    tiered_scan = False
+    discovery_flags = '-sn'
+    port_scan_ttl_sec = 60.0 * 60.0 * 24.0
 
 
 class SNMPSettings(NamedTuple):
@@ -94,6 +116,21 @@ class SNMPSettings(NamedTuple):
     '''
     router_ip = "192.168.1.1"
     community = 'public'
+    # UDP port the agents listen on.
+    agent_port = 161
+    # SNMP version to use ('1' or '2c'). With '2c' tables are walked with GETBULK, falling back to GetNext for
+    # agents that only support v1.
+    version = '2c'
+    # Number of table rows to request in each GETBULK round trip.
+    max_repetitions = 25
+    # Number of hosts to query at once.
+    max_concurrent_queries = 16
+    # How long to reuse the table indexes discovered for a device before walking its tables again.
+    query_plan_ttl_sec = 60.0 * 60.0 * 24.0
+    # Hosts that don't respond are skipped for this long, doubling after each consecutive failure.
+    unresponsive_retry_sec = 60.0 * 10.0
+    # Longest time to skip an unresponsive host.
+    max_unresponsive_retry_sec = 60.0 * 60.0 * 24.0
     time_between_scans = 60.0 * 10.0
     collect_traffic_data = False
     history_len = MAX_HISTORY_LEN_SEC
@@ -104,6 +141,103 @@ class MDNSSettings(NamedTuple):
     Parameters for running mDNS queries.
     '''
     time_between_updates = 60.0 * 10.0
+    # How long to wait for a device to respond with a service's info.
+    resolve_timeout_sec = 3.0
+    # How often to look for new service types to browse.
+    service_type_refresh_sec = 60.0 * 60.0
+
+
+class PassiveDiscoverySettings(NamedTuple):
+    '''
+    Parameters for discovering devices from the host's neighbor table and DHCP lease file.
+    '''
+    # Path to a dnsmasq or ISC dhcpd lease file, if the DHCP server runs on this host.
+    lease_file: Optional[str] = None
+    # How often to check the neighbor table and lease file for changes.
+    update_period_sec = 30.0
+    read_neighbor_table = True
+
+
+class SchedulerSettings(NamedTuple):
+    '''
+    Parameters for when the services run.
+    '''
+    # Delay between the first update of each service, so they don't all start at once.
+    startup_spacing_sec = 1.5
+    # Random delay of up to this long added to each update, so services with the same period drift apart.
+    jitter_sec = 1.0
+
+
+class SupervisorSettings(NamedTuple):
+    '''
+    Parameters for running services in worker processes.
+    '''
+    # Class names of the services to run in their own process, for example ('PetAi',). Empty to run all the services
+    # in the main process.
+    isolated_services: tuple[str, ...] = ()
+    # Delay before restarting a worker that exited, doubling after each consecutive failure.
+    restart_backoff_sec = 1.0
+    max_restart_backoff_sec = 60.0 * 5.0
+    # Workers that ran at least this long before exiting are restarted without backoff.
+    stable_run_sec = 60.0 * 10.0
+    # How long to wait for workers to stop before killing them.
+    stop_timeout_sec = 10.0
+
+
+class ProfilingSettings(NamedTuple):
+    '''
+    Parameters for sampling service updates and web views with cProfile.
+    '''
+    # Names of the services and views to profile, like 'PetAi' or 'view_pet', or '*' for all of them. Names in the
+    # comma separated LAN_PETS_PROFILE environment variable are profiled as well.
+    targets: tuple[str, ...] = ()
+    # Profile one out of this many calls of each target.
+    sample_every = 10
+    # Number of profiles to keep for each target. The oldest are deleted.
+    max_files_per_target = 20
+
+
+class MemoryTrackerSettings(NamedTuple):
+    '''
+    Parameters for finding memory growth with tracemalloc.
+    '''
+    # Allocations are traced while this file exists, so tracing can be started and stopped without restarting the
+    # monitor. Tracing slows down allocations and uses extra memory.
+    control_file = DATA_DIR / 'trace_memory'
+    # How often to check the control file.
+    update_period_sec = 60.0
+    # How often to log the growth since tracing started. Taking a snapshot pauses the process.
+    report_period_sec = 60.0 * 10.0
+    # Stack depth recorded for each allocation. Allocations are attributed to a service if its module is in the stack.
+    num_frames = 50
+    # Number of allocation sites to log for each service.
+    num_top_sites = 10
+
+
+class IngestSettings(NamedTuple):
+    '''
+    Parameters for writing the services' observations to the DB from a single thread.
+    '''
+    # Observations waiting to be written. Services block when the queue is full.
+    max_queue_size = 10000
+    # Observations are written in one transaction once this many are queued, or `max_batch_delay_sec` after the
+    # first one was queued.
+    max_batch_size = 500
+    max_batch_delay_sec = 1.0
+    # How long a service waits for space in a full queue before the observation is dropped.
+    put_timeout_sec = 10.0
+
+
+class QueryStatsSettings(NamedTuple):
+    '''
+    Parameters for timing the DB methods and the SQL statements they run.
+    '''
+    # Statements that take longer than this are logged, along with their query plan the first time.
+    slow_query_sec = 0.1
+    # Number of recent durations kept for each method and statement to find the 95th percentile.
+    max_samples = 1000
+    # How often to save the stats for the metrics page.
+    save_period_sec = 10.0
 
 
 class Settings(NamedTuple):
@@ -112,12 +246,19 @@ class Settings(NamedTuple):
     nmap_settings: Optional[NMAPSettings] = NMAPSettings()
     snmp_settings: Optional[SNMPSettings] = SNMPSettings()
     mdns_settings: Optional[MDNSSettings] = MDNSSettings()
+    passive_discovery_settings: Optional[PassiveDiscoverySettings] = PassiveDiscoverySettings()
 
     # List of clients to include even if they aren't discovered
     hard_coded_pet_interfaces: dict[str, NetworkInterfaceInfo] = {}
 
-    # How long to sleep between checking services
-    main_loop_sleep_sec = 0.1
+    scheduler_settings = SchedulerSettings()
+    supervisor_settings = SupervisorSettings()
+    profiling_settings = ProfilingSettings()
+    memory_tracker_settings: Optional[MemoryTrackerSettings] = MemoryTrackerSettings()
+    # None to have each service write to the DB directly.
+    ingest_settings: Optional[IngestSettings] = IngestSettings()
+    # Set to time DB access. Adds overhead to every query.
+    query_stats_settings: Optional[QueryStatsSettings] = None
 
     # Timezone to use for plots.
     plot_timezone = 'America/Los_Angeles'
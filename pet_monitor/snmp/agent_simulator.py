@@ -0,0 +1,343 @@
+'''
+Local UDP SNMP responder that serves synthetic MIB trees for a set of simulated hosts.
+
+Each simulated host is bound to its own loopback address (127.x.x.x on Linux) so the scraper can address them by IP
+like real devices. The first address is a router that serves the ARP table for the other hosts. Hosts serve
+hrProcessorLoad, hrStorage and ifTable values, and can be configured to only speak SNMPv1 or to not run an agent at
+all.
+
+Run standalone with `python -m pet_monitor.snmp.agent_simulator`.
+'''
+import heapq
+import ipaddress
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Callable, NamedTuple, Optional
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+_logger = logging.getLogger(__name__)
+
+# HOST-RESOURCES-MIB::hrProcessorLoad
+_HR_PROCESSOR_LOAD_OID = '1.3.6.1.2.1.25.3.3.1.2'
+# HOST-RESOURCES-MIB::hrStorageTable
+_HR_STORAGE_OID = '1.3.6.1.2.1.25.2.3.1'
+_RAM_RESOURCE_TYPE = '1.3.6.1.2.1.25.2.1.2'
+_FIXED_DISK_RESOURCE_TYPE = '1.3.6.1.2.1.25.2.1.4'
+# RFC1213-MIB::ifTable
+_IF_TABLE_OID = '1.3.6.1.2.1.2.2.1'
+# RFC1213-MIB::ipNetToMediaPhysAddress
+_IP_NET_TO_MEDIA_PHYS_ADDRESS_OID = '1.3.6.1.2.1.4.22.1.2'
+
+_ERROR_NO_SUCH_NAME = 2
+
+OID = tuple[int, ...]
+
+
+def _to_oid(oid: str) -> OID:
+    return tuple(int(x) for x in oid.split('.'))
+
+
+class SimulatorSettings(NamedTuple):
+    # Number of simulated hosts, not including the router.
+    num_hosts: int = 10
+    # Address of the router. The hosts use the following addresses.
+    base_ip: str = '127.1.0.1'
+    port: int = 16100
+    community: str = 'public'
+    # Delay before each response is sent.
+    latency_sec: float = 0.0
+    # Fraction of requests that are dropped without a response.
+    drop_rate: float = 0.0
+    # Fraction of hosts that don't run an SNMP agent and never respond.
+    non_snmp_fraction: float = 0.0
+    # Fraction of hosts that ignore SNMPv2c requests.
+    v1_only_fraction: float = 0.0
+    num_cpus: int = 4
+    num_interfaces: int = 4
+    seed: int = 0
+
+
+class SimulatedHost(NamedTuple):
+    ip: str
+    mac: str
+    has_agent: bool
+    v1_only: bool
+
+
+def get_simulated_hosts(settings: SimulatorSettings) -> list[SimulatedHost]:
+    '''
+    The router followed by the simulated hosts. Deterministic for a given settings.
+    '''
+    rand = random.Random(settings.seed)
+    base_ip = ipaddress.IPv4Address(settings.base_ip)
+    hosts = [SimulatedHost(str(base_ip), '02-00-00-00-00-00', True, False)]
+    for i in range(1, settings.num_hosts + 1):
+        mac = '-'.join(f'{b:02X}' for b in (2, 0, 0, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF))
+        hosts.append(SimulatedHost(
+            ip=str(base_ip + i),
+            mac=mac,
+            has_agent=rand.random() >= settings.non_snmp_fraction,
+            v1_only=rand.random() < settings.v1_only_fraction,
+        ))
+    return hosts
+
+
+class _MIBTree:
+    def __init__(self) -> None:
+        self.values: dict[OID, Callable[[], Any]] = {}
+        self.sorted_oids: list[OID] = []
+
+    def add(self, oid: str, value: Callable[[], Any]):
+        self.values[_to_oid(oid)] = value
+
+    def finalize(self):
+        self.sorted_oids = sorted(self.values)
+
+    def get(self, oid: OID) -> Optional[Any]:
+        value = self.values.get(oid)
+        return None if value is None else value()
+
+    def get_next(self, oid: OID) -> Optional[tuple[OID, Any]]:
+        idx = bisect_right(self.sorted_oids, oid)
+        if idx >= len(self.sorted_oids):
+            return None
+        next_oid = self.sorted_oids[idx]
+        return next_oid, self.values[next_oid]()
+
+
+def _build_router_tree(hosts: list[SimulatedHost]) -> _MIBTree:
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    tree = _MIBTree()
+    for host in hosts[1:]:
+        mac = pMod.OctetString(bytes.fromhex(host.mac.replace('-', '')))
+        tree.add(f'{_IP_NET_TO_MEDIA_PHYS_ADDRESS_OID}.1.{host.ip}', lambda mac=mac: mac)
+    tree.finalize()
+    return tree
+
+
+def _build_host_tree(settings: SimulatorSettings, rand: random.Random) -> _MIBTree:
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    tree = _MIBTree()
+    start_time = time.monotonic()
+
+    for i in range(settings.num_cpus):
+        tree.add(f'{_HR_PROCESSOR_LOAD_OID}.{196608 + i}', lambda: pMod.Integer(rand.randint(0, 100)))
+
+    storage = (
+        (1, _FIXED_DISK_RESOURCE_TYPE, 4096, 1000000),
+        (2, _RAM_RESOURCE_TYPE, 1024, 4000000),
+    )
+    for idx, resource_type, units, size in storage:
+        tree.add(f'{_HR_STORAGE_OID}.1.{idx}', lambda idx=idx: pMod.Integer(idx))
+        tree.add(f'{_HR_STORAGE_OID}.2.{idx}', lambda t=resource_type: pMod.ObjectIdentifier(t))
+        tree.add(f'{_HR_STORAGE_OID}.4.{idx}', lambda u=units: pMod.Integer(u))
+        tree.add(f'{_HR_STORAGE_OID}.5.{idx}', lambda s=size: pMod.Integer(s))
+        tree.add(f'{_HR_STORAGE_OID}.6.{idx}', lambda s=size: pMod.Integer(rand.randint(0, s)))
+
+    for i in range(1, settings.num_interfaces + 1):
+        rate = rand.randint(100, 100000)
+        tree.add(f'{_IF_TABLE_OID}.1.{i}', lambda i=i: pMod.Integer(i))
+        for col in (10, 16):
+            tree.add(f'{_IF_TABLE_OID}.{col}.{i}', lambda rate=rate: pMod.Counter32(
+                int((time.monotonic() - start_time) * rate) % 2**32))
+    tree.finalize()
+    return tree
+
+
+class SNMPAgentSimulator:
+    def __init__(self, settings: SimulatorSettings = SimulatorSettings()) -> None:
+        self.settings = settings
+        self.hosts = get_simulated_hosts(settings)
+        self.router_ip = self.hosts[0].ip
+        self.is_running = False
+        self.thread: Optional[threading.Thread] = None
+        self.num_requests = 0
+        self._rand = random.Random(settings.seed)
+        self._selector = selectors.DefaultSelector()
+        self._sockets: list[socket.socket] = []
+        # Heap of (send time, sequence, socket, data, address) for delayed responses.
+        self._pending: list[tuple[float, int, socket.socket, bytes, Any]] = []
+        self._sequence = 0
+
+        self._trees: dict[str, _MIBTree] = {self.router_ip: _build_router_tree(self.hosts)}
+        for host in self.hosts[1:]:
+            self._trees[host.ip] = _build_host_tree(settings, self._rand)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self.is_running:
+            return
+        for host in self.hosts:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((host.ip, self.settings.port))
+            sock.setblocking(False)
+            self._sockets.append(sock)
+            self._selector.register(sock, selectors.EVENT_READ, host)
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run_loop, name='snmp_agent_simulator')
+        self.thread.start()
+
+    def stop(self):
+        if self.is_running and self.thread:
+            self.is_running = False
+            self.thread.join()
+        for sock in self._sockets:
+            self._selector.unregister(sock)
+            sock.close()
+        self._sockets = []
+
+    def _run_loop(self):
+        while self.is_running:
+            timeout = 0.1
+            if len(self._pending) > 0:
+                timeout = min(timeout, max(0, self._pending[0][0] - time.monotonic()))
+            for key, _ in self._selector.select(timeout):
+                sock: socket.socket = key.fileobj  # type: ignore
+                try:
+                    data, address = sock.recvfrom(65535)
+                except BlockingIOError:
+                    continue
+                self._handle_packet(key.data, sock, data, address)
+
+            now = time.monotonic()
+            while len(self._pending) > 0 and self._pending[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self._pending)
+                sock.sendto(data, address)
+
+    def _handle_packet(self, host: SimulatedHost, sock: socket.socket, data: bytes, address):
+        self.num_requests += 1
+        if not host.has_agent or self._rand.random() < self.settings.drop_rate:
+            return
+        try:
+            response = self._get_response(host, data)
+        except Exception:
+            _logger.debug('Failed to handle request', exc_info=True)
+            return
+        if response is None:
+            return
+
+        if self.settings.latency_sec > 0:
+            self._sequence += 1
+            heapq.heappush(self._pending, (time.monotonic() + self.settings.latency_sec,
+                                           self._sequence, sock, response, address))
+        else:
+            sock.sendto(response, address)
+
+    def _get_response(self, host: SimulatedHost, data: bytes) -> Optional[bytes]:
+        version = int(api.decodeMessageVersion(data))
+        if host.v1_only and version != api.SNMP_VERSION_1:
+            return None
+        pMod = api.PROTOCOL_MODULES[version]
+        reqMsg, _ = decoder.decode(data, asn1Spec=pMod.Message())
+        if str(pMod.apiMessage.get_community(reqMsg)) != self.settings.community:
+            return None
+
+        reqPDU = pMod.apiMessage.get_pdu(reqMsg)
+        rspMsg = pMod.apiMessage.get_response(reqMsg)
+        rspPDU = pMod.apiMessage.get_pdu(rspMsg)
+        tree = self._trees[host.ip]
+        is_v2c = version == api.SNMP_VERSION_2C
+        request_oids = [_to_oid(str(oid)) for oid, _ in pMod.apiPDU.get_varbinds(reqPDU)]
+
+        varbinds: list[tuple[OID, Any]] = []
+        error_index = None
+        if reqPDU.isSameTypeWith(pMod.GetRequestPDU()):
+            for i, oid in enumerate(request_oids):
+                value = tree.get(oid)
+                if value is None:
+                    value = api.v2c.NoSuchInstance() if is_v2c else pMod.Null('')
+                    error_index = i if error_index is None else error_index
+                varbinds.append((oid, value))
+        elif reqPDU.isSameTypeWith(pMod.GetNextRequestPDU()):
+            for i, oid in enumerate(request_oids):
+                result = tree.get_next(oid)
+                if result is None:
+                    result = (oid, api.v2c.EndOfMibView() if is_v2c else pMod.Null(''))
+                    error_index = i if error_index is None else error_index
+                varbinds.append(result)
+        elif is_v2c and reqPDU.isSameTypeWith(pMod.GetBulkRequestPDU()):
+            non_repeaters = min(int(pMod.apiBulkPDU.get_non_repeaters(reqPDU)), len(request_oids))
+            max_repetitions = int(pMod.apiBulkPDU.get_max_repetitions(reqPDU))
+            for oid in request_oids[:non_repeaters]:
+                varbinds.append(tree.get_next(oid) or (oid, api.v2c.EndOfMibView()))
+            last_oids = request_oids[non_repeaters:]
+            for _ in range(max_repetitions):
+                if len(last_oids) == 0:
+                    break
+                row = [tree.get_next(oid) or (oid, api.v2c.EndOfMibView()) for oid in last_oids]
+                varbinds += row
+                if all(isinstance(v, api.v2c.EndOfMibView) for _, v in row):
+                    break
+                last_oids = [oid for oid, _ in row]
+        else:
+            return None
+
+        # SNMPv1 reports missing values as an error instead of exceptions in the varbinds.
+        if not is_v2c and error_index is not None:
+            pMod.apiPDU.set_error_status(rspPDU, _ERROR_NO_SUCH_NAME)
+            pMod.apiPDU.set_error_index(rspPDU, error_index + 1)
+            pMod.apiPDU.set_varbinds(rspPDU, [(oid, pMod.Null('')) for oid in request_oids])
+        else:
+            pMod.apiPDU.set_varbinds(rspPDU, varbinds)
+        return encoder.encode(rspMsg)
+
+
+def run_simulator(settings: SimulatorSettings, ready: Optional[Any] = None, stop: Optional[Any] = None):
+    '''
+    Run the simulator until `stop` is set. Meant as a multiprocessing target so the simulator doesn't share the GIL
+    with the code being measured.
+    '''
+    with SNMPAgentSimulator(settings):
+        if ready is not None:
+            ready.set()
+        while stop is None or not stop.wait(0.1):
+            pass
+
+
+def main():
+    import argparse
+
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    defaults = SimulatorSettings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-hosts', type=int, default=defaults.num_hosts)
+    parser.add_argument('--base-ip', default=defaults.base_ip)
+    parser.add_argument('--port', type=int, default=defaults.port)
+    parser.add_argument('--latency-sec', type=float, default=defaults.latency_sec)
+    parser.add_argument('--drop-rate', type=float, default=defaults.drop_rate)
+    parser.add_argument('--non-snmp-fraction', type=float, default=defaults.non_snmp_fraction)
+    parser.add_argument('--v1-only-fraction', type=float, default=defaults.v1_only_fraction)
+    args = parser.parse_args()
+
+    settings = SimulatorSettings(
+        num_hosts=args.num_hosts,
+        base_ip=args.base_ip,
+        port=args.port,
+        latency_sec=args.latency_sec,
+        drop_rate=args.drop_rate,
+        non_snmp_fraction=args.non_snmp_fraction,
+        v1_only_fraction=args.v1_only_fraction,
+    )
+    router_ip = get_simulated_hosts(settings)[0].ip
+    _logger.info(f'Router at {router_ip}:{settings.port} with {settings.num_hosts} hosts.')
+    try:
+        run_simulator(settings)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+'''
+Cached request encoding and a fast path for decoding common SNMP responses.
+
+Building the pysnmp PDU and Message objects and BER encoding them, then decoding each response against `asn1Spec`,
+dominates the CPU cost of polling many devices. Requests are encoded once per (version, community, PDU type, OIDs)
+and only the request-id is patched for each send. Responses made of the common value types are parsed directly, and
+anything else falls back to the pyasn1 decoder.
+'''
+# https://www.ranecommercial.com/legacy/note161.html
+
+import itertools
+import random
+from enum import Enum, auto
+from functools import lru_cache
+from typing import Any, NamedTuple
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api, rfc1905
+
+# Map of settings version strings to the pysnmp protocol module IDs.
+SNMP_VERSIONS = {
+    '1': api.SNMP_VERSION_1,
+    '2c': api.SNMP_VERSION_2C,
+}
+
+
+class PDUType(Enum):
+    GET = auto()
+    GET_NEXT = auto()
+    GET_BULK = auto()
+
+
+# Request IDs are kept in a range that always encodes to 4 bytes so the templates can be patched in place.
+_MIN_REQUEST_ID = 0x00800000
+_MAX_REQUEST_ID = 0x7FFFFFFF
+_TEMPLATE_REQUEST_ID = _MAX_REQUEST_ID
+_REQUEST_ID_LEN = 4
+
+_request_ids = itertools.count(random.randint(_MIN_REQUEST_ID, _MAX_REQUEST_ID))
+
+
+def next_request_id() -> int:
+    return _MIN_REQUEST_ID + next(_request_ids) % (_MAX_REQUEST_ID - _MIN_REQUEST_ID)
+
+
+class RequestTemplate(NamedTuple):
+    # Encoded message with a placeholder request-id.
+    data: bytes
+    # Offset of the request-id value in `data`.
+    request_id_offset: int
+
+    def encode(self, request_id: int) -> bytes:
+        end = self.request_id_offset + _REQUEST_ID_LEN
+        return self.data[:self.request_id_offset] + request_id.to_bytes(_REQUEST_ID_LEN, 'big') + self.data[end:]
+
+
+class Response(NamedTuple):
+    request_id: int
+    error_status: int
+    # Values are plain Python types (int, bytes, dotted OID str) when decoded with the fast path, and pysnmp objects
+    # otherwise. Both can be converted with int(), bytes() or str() as appropriate.
+    varbinds: list[tuple[str, Any]]
+
+
+class _UnsupportedEncoding(Exception):
+    pass
+
+
+# Universal and SNMP application tags.
+_TAG_INTEGER = 0x02
+_TAG_OCTET_STRING = 0x04
+_TAG_NULL = 0x05
+_TAG_OID = 0x06
+_TAG_SEQUENCE = 0x30
+_TAG_IP_ADDRESS = 0x40
+_TAG_COUNTER32 = 0x41
+_TAG_GAUGE32 = 0x42
+_TAG_TIME_TICKS = 0x43
+_TAG_OPAQUE = 0x44
+_TAG_COUNTER64 = 0x46
+_TAG_NO_SUCH_OBJECT = 0x80
+_TAG_NO_SUCH_INSTANCE = 0x81
+_TAG_END_OF_MIB_VIEW = 0x82
+_TAG_GET_RESPONSE = 0xA2
+
+_INTEGER_TAGS = {_TAG_COUNTER32, _TAG_GAUGE32, _TAG_TIME_TICKS, _TAG_COUNTER64}
+_BYTES_TAGS = {_TAG_OCTET_STRING, _TAG_IP_ADDRESS, _TAG_OPAQUE}
+_MISSING_VALUES = {
+    _TAG_NO_SUCH_OBJECT: rfc1905.noSuchObject,
+    _TAG_NO_SUCH_INSTANCE: rfc1905.noSuchInstance,
+    _TAG_END_OF_MIB_VIEW: rfc1905.endOfMibView,
+}
+
+
+def _read_header(data: bytes, pos: int) -> tuple[int, int, int]:
+    '''
+    Read the tag and length at `pos`. Returns (tag, content start, content end).
+    '''
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num_bytes = length & 0x7F
+        if num_bytes == 0:
+            # Indefinite lengths aren't used by agents in practice.
+            raise _UnsupportedEncoding()
+        length = int.from_bytes(data[pos:pos + num_bytes], 'big')
+        pos += num_bytes
+    end = pos + length
+    if end > len(data):
+        raise _UnsupportedEncoding()
+    return tag, pos, end
+
+
+def _expect(data: bytes, pos: int, expected_tag: int) -> tuple[int, int]:
+    tag, start, end = _read_header(data, pos)
+    if tag != expected_tag:
+        raise _UnsupportedEncoding()
+    return start, end
+
+
+def _decode_oid(content: bytes) -> str:
+    first_arc = min(content[0] // 40, 2)
+    arcs = [first_arc, content[0] - 40 * first_arc]
+    value = 0
+    for b in content[1:]:
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            arcs.append(value)
+            value = 0
+    return '.'.join(str(a) for a in arcs)
+
+
+def _decode_value(tag: int, content: bytes) -> Any:
+    if tag == _TAG_INTEGER:
+        return int.from_bytes(content, 'big', signed=True)
+    elif tag in _INTEGER_TAGS:
+        return int.from_bytes(content, 'big')
+    elif tag in _BYTES_TAGS:
+        return content
+    elif tag == _TAG_OID:
+        return _decode_oid(content)
+    elif tag == _TAG_NULL:
+        return None
+    elif tag in _MISSING_VALUES:
+        return _MISSING_VALUES[tag]
+    raise _UnsupportedEncoding()
+
+
+def _decode_response_fast(data: bytes) -> Response:
+    pos, _ = _expect(data, 0, _TAG_SEQUENCE)
+    # Skip the version and community.
+    _, pos = _expect(data, pos, _TAG_INTEGER)
+    _, pos = _expect(data, pos, _TAG_OCTET_STRING)
+    pos, _ = _expect(data, pos, _TAG_GET_RESPONSE)
+
+    start, pos = _expect(data, pos, _TAG_INTEGER)
+    request_id = int.from_bytes(data[start:pos], 'big', signed=True)
+    start, pos = _expect(data, pos, _TAG_INTEGER)
+    error_status = int.from_bytes(data[start:pos], 'big', signed=True)
+    _, pos = _expect(data, pos, _TAG_INTEGER)
+
+    pos, varbinds_end = _expect(data, pos, _TAG_SEQUENCE)
+    varbinds: list[tuple[str, Any]] = []
+    while pos < varbinds_end:
+        pos, varbind_end = _expect(data, pos, _TAG_SEQUENCE)
+        start, pos = _expect(data, pos, _TAG_OID)
+        oid = _decode_oid(data[start:pos])
+        tag, start, pos = _read_header(data, pos)
+        varbinds.append((oid, _decode_value(tag, data[start:pos])))
+        pos = varbind_end
+
+    return Response(request_id, error_status, varbinds)
+
+
+def _decode_response_pyasn1(data: bytes, version: str) -> Response:
+    pMod = api.PROTOCOL_MODULES[SNMP_VERSIONS[version]]
+    rspMsg, wholeMsg = decoder.decode(data, asn1Spec=pMod.Message())
+    rspPDU = pMod.apiMessage.get_pdu(rspMsg)
+    return Response(
+        int(pMod.apiPDU.get_request_id(rspPDU)),
+        int(pMod.apiPDU.get_error_status(rspPDU)),
+        [(str(oid), val) for oid, val in pMod.apiPDU.get_varbinds(rspPDU)]
+    )
+
+
+def decode_response(data: bytes, version: str) -> Response:
+    try:
+        return _decode_response_fast(data)
+    except (_UnsupportedEncoding, IndexError, ValueError):
+        return _decode_response_pyasn1(data, version)
+
+
+def _find_request_id_offset(data: bytes) -> int:
+    _, pos, _ = _read_header(data, 0)
+    # Skip the version and community.
+    for _ in range(2):
+        _, _, pos = _read_header(data, pos)
+    _, pos, _ = _read_header(data, pos)
+    start, end = _expect(data, pos, _TAG_INTEGER)
+    if end - start != _REQUEST_ID_LEN:
+        raise ValueError('Unexpected request-id encoding.')
+    return start
+
+
+@lru_cache(maxsize=1024)
+def get_request_template(version: str, community: str, pdu_type: PDUType, oids: tuple[str, ...],
+                         max_repetitions=0) -> RequestTemplate:
+    pMod = api.PROTOCOL_MODULES[SNMP_VERSIONS[version]]
+
+    # Build PDU
+    if pdu_type is PDUType.GET_BULK:
+        reqPDU = pMod.GetBulkRequestPDU()
+        pMod.apiBulkPDU.set_defaults(reqPDU)
+        pMod.apiBulkPDU.set_non_repeaters(reqPDU, 0)
+        pMod.apiBulkPDU.set_max_repetitions(reqPDU, max_repetitions)
+    else:
+        reqPDU = pMod.GetNextRequestPDU() if pdu_type is PDUType.GET_NEXT else pMod.GetRequestPDU()
+        pMod.apiPDU.set_defaults(reqPDU)
+    pMod.apiPDU.set_request_id(reqPDU, _TEMPLATE_REQUEST_ID)
+    pMod.apiPDU.set_varbinds(reqPDU, tuple((oid, pMod.Null('')) for oid in oids))
+
+    # Build message
+    reqMsg = pMod.Message()
+    pMod.apiMessage.set_defaults(reqMsg)
+    pMod.apiMessage.set_community(reqMsg, community)
+    pMod.apiMessage.set_pdu(reqMsg, reqPDU)
+
+    data = encoder.encode(reqMsg)
+    return RequestTemplate(data, _find_request_id_offset(data))
@@ -4,26 +4,59 @@
 # https://www.oss.com/asn1/resources/asn1-made-simple/asn1-quick-reference/octetstring.html
 
 import socket
-from typing import Any, Optional
+import time
+from typing import Any, Generator, NamedTuple, Optional
 
-from pyasn1.codec.ber import decoder, encoder
 from pysnmp.proto import api
 
+from pet_monitor.snmp.codec import (PDUType, Response, decode_response,
+                                    get_request_template, next_request_id)
+
+# Number of table rows to request in each GETBULK round trip.
+DEFAULT_MAX_REPETITIONS = 25
+
+# Largest possible UDP payload. Bulk responses are often much bigger than a single GET response.
+_MAX_PACKET_SIZE = 65535
+
+# UDP port the agents listen on.
+_agent_port = 161
+
+# How long to keep using SNMPv1 for a host that only answered SNMPv1 requests, before trying GETBULK again.
+V1_ONLY_EXPIRY_SEC = 60.0 * 60.0
+
+# Monotonic time each host that didn't answer GETBULK, but did answer GetNext, should be queried with SNMPv1 until.
+_v1_only_hosts: dict[str, float] = {}
+
+
+def set_agent_port(port: int):
+    global _agent_port
+    _agent_port = port
+
+
+def is_v1_only(host: str) -> bool:
+    expiry = _v1_only_hosts.get(host)
+    if expiry is None:
+        return False
+    if time.monotonic() >= expiry:
+        _v1_only_hosts.pop(host, None)
+        return False
+    return True
+
 
 def _send_packet_get_response(host: str, send_data: bytes) -> Optional[bytes]:
     # Create a UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    # Bind the socket to the client address
-    sock.bind(("0.0.0.0", 1161))
+    # Bind to an ephemeral port, so concurrent queries each get their own responses.
+    sock.bind(("0.0.0.0", 0))
 
     try:
         # Send the message
-        sock.sendto(send_data, (host, 161))
+        sock.sendto(send_data, (host, _agent_port))
 
         # Wait for a response (with a timeout)
         sock.settimeout(1)  # Set a 1-second timeout
-        data, addr = sock.recvfrom(1024)
+        data, addr = sock.recvfrom(_MAX_PACKET_SIZE)
         return data
     except (socket.timeout, socket.gaierror):
         pass
@@ -35,64 +68,132 @@ def _send_packet_get_response(host: str, send_data: bytes) -> Optional[bytes]:
     return None
 
 
-def send_requests(host: str, community: str, oids: list[str], use_get_next=False) -> dict[str, Any]:
-    results = {} if use_get_next else {oid: None for oid in oids}
+def _send_request(host: str, community: str, version: str, pdu_type: PDUType, oids: list[str],
+                  max_repetitions=0) -> Optional[Response]:
+    '''
+    Send a request built from a cached template. Returns None if there was no matching response.
+    '''
+    template = get_request_template(version, community, pdu_type, tuple(oids), max_repetitions)
+    request_id = next_request_id()
+    resp_data = _send_packet_get_response(host, template.encode(request_id))
+    if resp_data is None:
+        return None
+
+    response = decode_response(resp_data, version)
+    # Ignore late responses to earlier requests.
+    if response.request_id != request_id:
+        return None
+    return response
+
 
-    # Protocol version to use
-    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_1]
-    # pMod = api.protoModules[api.protoVersion2c]
+def _is_missing_value(val: Any) -> bool:
+    # SNMPv2c reports missing values as exceptions in the varbinds instead of an error status.
+    return isinstance(val, (api.v2c.NoSuchObject, api.v2c.NoSuchInstance, api.v2c.EndOfMibView))
 
-    # Build PDU
-    reqPDU = pMod.GetNextRequestPDU() if use_get_next else pMod.GetRequestPDU()
-    pMod.apiPDU.set_defaults(reqPDU)
-    pMod.apiPDU.set_varbinds(
-        reqPDU, tuple((oid, pMod.Null('')) for oid in oids)
-    )
 
-    # Build message
-    reqMsg = pMod.Message()
-    pMod.apiMessage.set_defaults(reqMsg)
-    pMod.apiMessage.set_community(reqMsg, community)
-    pMod.apiMessage.set_pdu(reqMsg, reqPDU)
+def send_requests(host: str, community: str, oids: list[str], use_get_next=False, version='1') -> dict[str, Any]:
+    results = {} if use_get_next else {oid: None for oid in oids}
 
-    resp_data = _send_packet_get_response(host, encoder.encode(reqMsg))
+    if is_v1_only(host):
+        version = '1'
 
-    if resp_data is not None:
-        rspMsg, wholeMsg = decoder.decode(resp_data, asn1Spec=pMod.Message())
-        rspPDU = pMod.apiMessage.get_pdu(rspMsg)
-        # print(rspMsg)
+    pdu_type = PDUType.GET_NEXT if use_get_next else PDUType.GET
+    response = _send_request(host, community, version, pdu_type, oids)
 
+    if response is not None:
         # Check for SNMP errors reported
-        errorStatus = pMod.apiPDU.get_error_status(rspPDU)
-        if errorStatus:
-            # print(errorStatus.prettyPrint())
+        if response.error_status:
             pass
         else:
-            for oid, val in pMod.apiPDU.get_varbinds(rspPDU):
-                # print('%s = %s' % (oid.prettyPrint(), val.prettyPrint()))
-                results[str(oid)] = val
+            for oid, val in response.varbinds:
+                if not _is_missing_value(val):
+                    results[oid] = val
 
     return results
 
 
-def walk_tree(host: str, community: str, root_oid: str) -> dict[str, Any]:
-    last_oid = root_oid
-    results = {}
-    done = False
-    while not done:
+def send_bulk_request(host: str, community: str, oid: str,
+                      max_repetitions=DEFAULT_MAX_REPETITIONS) -> Optional[list[tuple[str, Any]]]:
+    '''
+    Send a SNMPv2c GETBULK request for the values following `oid`.
+
+    Returns None if the host didn't respond. Otherwise the returned list ends at the end of the agent's MIB view.
+    '''
+    response = _send_request(host, community, '2c', PDUType.GET_BULK, [oid], max_repetitions)
+    if response is None:
+        return None
+
+    results: list[tuple[str, Any]] = []
+    if response.error_status:
+        return results
+
+    for oid, val in response.varbinds:
+        if _is_missing_value(val):
+            break
+        results.append((oid, val))
+    return results
+
+
+def _iter_tree_get_next(host: str, community: str, root_oid: str,
+                        last_oid: str) -> Generator[tuple[str, Any], None, None]:
+    while True:
         result = send_requests(host, community, [last_oid], use_get_next=True)
         if len(result) == 0:
-            break
+            return
 
-        for oid, val in result.items():
-            if not oid.startswith(root_oid):
-                done = True
-            else:
-                results[oid] = val
-                last_oid = oid
-            break
+        oid, val = next(iter(result.items()))
+        # Stop if the walk leaves the subtree, or a misbehaving agent stops advancing.
+        if not oid.startswith(root_oid + '.') or oid == last_oid:
+            return
+        yield oid, val
+        last_oid = oid
 
-    return results
+
+def _iter_tree_bulk(host: str, community: str, root_oid: str,
+                    max_repetitions: int) -> Generator[tuple[str, Any], None, None]:
+    last_oid = root_oid
+    while True:
+        result = send_bulk_request(host, community, last_oid, max_repetitions)
+        if result is None:
+            # Only fall back if nothing was received yet. Otherwise this was a dropped packet mid walk.
+            if last_oid == root_oid:
+                answered = False
+                for oid, val in _iter_tree_get_next(host, community, root_oid, last_oid):
+                    # A host that is down, or only dropped the GETBULK request, doesn't answer the GetNext walk.
+                    if not answered:
+                        _v1_only_hosts[host] = time.monotonic() + V1_ONLY_EXPIRY_SEC
+                        answered = True
+                    yield oid, val
+            return
+
+        if len(result) == 0:
+            return
+
+        # Agents may return fewer rows than requested to fit the response in a packet, so keep going until the
+        # walk leaves the subtree.
+        for oid, val in result:
+            if not oid.startswith(root_oid + '.') or oid == last_oid:
+                return
+            yield oid, val
+            last_oid = oid
+
+
+def iter_tree(host: str, community: str, root_oid: str, version='1',
+              max_repetitions=DEFAULT_MAX_REPETITIONS) -> Generator[tuple[str, Any], None, None]:
+    '''
+    Yield the values in the subtree under `root_oid` as each response is received.
+
+    With SNMPv2c the subtree is walked with GETBULK requests, falling back to GetNext requests for SNMPv1 agents.
+    '''
+    if version == '2c' and not is_v1_only(host):
+        yield from _iter_tree_bulk(host, community, root_oid, max_repetitions)
+    else:
+        yield from _iter_tree_get_next(host, community, root_oid, root_oid)
+
+
+def walk_tree(host: str, community: str, root_oid: str, version='1',
+              max_repetitions=DEFAULT_MAX_REPETITIONS) -> dict[str, Any]:
+    return dict(iter_tree(host, community, root_oid, version, max_repetitions))
 
 
 def get_load_averages(host: str, community: str) -> tuple[float, float, float]:
@@ -113,14 +214,15 @@ def get_load_averages(host: str, community: str) -> tuple[float, float, float]:
     return tuple(results)  # type: ignore
 
 
-def get_attached_ips(host: str, community: str) -> list[tuple[str, str]]:
+def get_attached_ips(host: str, community: str, version='1',
+                     max_repetitions=DEFAULT_MAX_REPETITIONS) -> list[tuple[str, str]]:
     # # RFC1213-MIB Network Management
     # base_oid = '1.3.6.1.2.1.4'
 
     # RFC1213-MIB::ipNetToMediaPhysAddress
     base_oid = '1.3.6.1.2.1.4.22.1.2'
 
-    results = walk_tree(host, community, base_oid)
+    results = walk_tree(host, community, base_oid, version, max_repetitions)
     return [
         (
             '.'.join(oid.split('.')[11:]),
@@ -141,26 +243,29 @@ def get_cpu_idle_percent(host: str, community: str) -> Optional[int]:
         return int(value)
 
 
-def get_per_cpu_usage(host: str, community: str) -> list[int]:
+def get_per_cpu_usage(host: str, community: str, version='1',
+                      max_repetitions=DEFAULT_MAX_REPETITIONS) -> list[int]:
     # HOST-RESOURCES-MIB::hrStorageTable
     BASE_OID = '1.3.6.1.2.1.25.3.3.1.2'
-    results = walk_tree(host, community, BASE_OID)
+    results = walk_tree(host, community, BASE_OID, version, max_repetitions)
     return [int(d) for d in results.values()]
 
 
-def get_total_cpu_usage(host: str, community: str) -> Optional[float]:
-    cpu_loads = get_per_cpu_usage(host, community)
+def get_total_cpu_usage(host: str, community: str, version='1',
+                        max_repetitions=DEFAULT_MAX_REPETITIONS) -> Optional[float]:
+    cpu_loads = get_per_cpu_usage(host, community, version, max_repetitions)
     if len(cpu_loads) > 0:
         return float(sum(cpu_loads)) / float(len(cpu_loads))
     else:
         return None
 
 
-def get_ram_info(host: str, community: str) -> Optional[tuple[int, int]]:
+def get_ram_info(host: str, community: str, version='1',
+                 max_repetitions=DEFAULT_MAX_REPETITIONS) -> Optional[tuple[int, int]]:
     # HOST-RESOURCES-MIB::hrStorageTable
     BASE_OID = '1.3.6.1.2.1.25.2.3.1'
     RESOURCE_TYPE_OID = BASE_OID + '.2'
-    results = walk_tree(host, community, RESOURCE_TYPE_OID)
+    results = walk_tree(host, community, RESOURCE_TYPE_OID, version, max_repetitions)
     for oid, data in results.items():
         type_oid = str(data)
         # https://mibs.observium.org/mib/HOST-RESOURCES-TYPES/
@@ -171,7 +276,8 @@ def get_ram_info(host: str, community: str) -> Optional[tuple[int, int]]:
             STORAGE_SIZE_OID = BASE_OID + f'.5.{idx}'
             STORAGE_USED_OID = BASE_OID + f'.6.{idx}'
 
-            response = send_requests(host, community, [ALLOCATION_UNITS_OID, STORAGE_SIZE_OID, STORAGE_USED_OID])
+            response = send_requests(host, community, [ALLOCATION_UNITS_OID,
+                                     STORAGE_SIZE_OID, STORAGE_USED_OID], version=version)
             unit_size = int(response[ALLOCATION_UNITS_OID])
             total = int(response[STORAGE_SIZE_OID]) * unit_size
             used = int(response[STORAGE_USED_OID]) * unit_size
@@ -180,26 +286,28 @@ def get_ram_info(host: str, community: str) -> Optional[tuple[int, int]]:
     return None
 
 
-def get_ram_used_percent(host: str, community: str) -> Optional[float]:
+def get_ram_used_percent(host: str, community: str, version='1',
+                         max_repetitions=DEFAULT_MAX_REPETITIONS) -> Optional[float]:
     # HOST-RESOURCES-MIB::hrStorageTable
-    ram_info = get_ram_info(host, community)
+    ram_info = get_ram_info(host, community, version, max_repetitions)
     if ram_info is None:
         return None
     else:
         return float(ram_info[0]) / float(ram_info[1]) * 100.0
 
 
-def get_max_if_in_out_bytes(host: str, community: str) -> Optional[tuple[int, int]]:
+def get_max_if_in_out_bytes(host: str, community: str, version='1',
+                            max_repetitions=DEFAULT_MAX_REPETITIONS) -> Optional[tuple[int, int]]:
     # IF-MIB MIB .1.3.6.1.2.1.2.
 
     # RFC1213-MIB::ifTable
     BASE_OID = '1.3.6.1.2.1.2.2.1'
     IN_OCTETS_OID = BASE_OID + '.10'
     OUT_OCTETS_OID = BASE_OID + '.16'
-    in_results = walk_tree(host, community, IN_OCTETS_OID)
+    in_results = walk_tree(host, community, IN_OCTETS_OID, version, max_repetitions)
     if len(in_results) == 0:
         return None
-    out_results = walk_tree(host, community, OUT_OCTETS_OID)
+    out_results = walk_tree(host, community, OUT_OCTETS_OID, version, max_repetitions)
     if len(in_results) == 0:
         return None
 
@@ -209,6 +317,120 @@ def get_max_if_in_out_bytes(host: str, community: str) -> Optional[tuple[int, in
     return (_get_max(in_results.values()), _get_max(out_results.values()))
 
 
+# HOST-RESOURCES-MIB::hrProcessorLoad
+_HR_PROCESSOR_LOAD_OID = '1.3.6.1.2.1.25.3.3.1.2'
+# HOST-RESOURCES-MIB::hrStorageTable
+_HR_STORAGE_OID = '1.3.6.1.2.1.25.2.3.1'
+# https://mibs.observium.org/mib/HOST-RESOURCES-TYPES/
+_RAM_RESOURCE_TYPE = '1.3.6.1.2.1.25.2.1.2'
+# RFC1213-MIB::ifInOctets
+_IF_IN_OCTETS_OID = '1.3.6.1.2.1.2.2.1.10'
+# RFC1213-MIB::ifOutOctets
+_IF_OUT_OCTETS_OID = '1.3.6.1.2.1.2.2.1.16'
+
+
+class DeviceStats(NamedTuple):
+    # Average load across all processors.
+    cpu_used_percent: Optional[float] = None
+    mem_used_percent: Optional[float] = None
+    # Max (in, out) byte counters across the interfaces.
+    if_in_out_bytes: Optional[tuple[int, int]] = None
+
+
+class DeviceQueryPlan(NamedTuple):
+    '''
+    Table indexes discovered for a device so that all its stats can be read with a single GET.
+    '''
+    # HOST-RESOURCES-MIB::hrProcessorTable rows.
+    cpu_indexes: tuple[int, ...] = ()
+    # HOST-RESOURCES-MIB::hrStorageTable row for RAM.
+    ram_index: Optional[int] = None
+    # RFC1213-MIB::ifTable rows.
+    if_indexes: tuple[int, ...] = ()
+
+    def is_empty(self) -> bool:
+        return len(self.cpu_indexes) == 0 and self.ram_index is None and len(self.if_indexes) == 0
+
+    def get_supported_mibs(self) -> list[str]:
+        mibs = []
+        if len(self.cpu_indexes) > 0 or self.ram_index is not None:
+            mibs.append('HOST-RESOURCES-MIB')
+        if len(self.if_indexes) > 0:
+            mibs.append('IF-MIB')
+        return mibs
+
+    def get_oids(self) -> list[str]:
+        oids = [f'{_HR_PROCESSOR_LOAD_OID}.{i}' for i in self.cpu_indexes]
+        if self.ram_index is not None:
+            # The allocation units cancel out when computing the used percentage.
+            oids += [f'{_HR_STORAGE_OID}.{col}.{self.ram_index}' for col in (5, 6)]
+        for i in self.if_indexes:
+            oids += [f'{_IF_IN_OCTETS_OID}.{i}', f'{_IF_OUT_OCTETS_OID}.{i}']
+        return oids
+
+
+def _get_index(oid: str) -> int:
+    return int(oid.split('.')[-1])
+
+
+def discover_query_plan(host: str, community: str, include_traffic: bool, version='1',
+                        max_repetitions=DEFAULT_MAX_REPETITIONS) -> DeviceQueryPlan:
+    '''
+    Walk the tables needed to find the indexes of the CPU, RAM and interface stats.
+    '''
+    cpu_indexes = tuple(_get_index(oid) for oid, _ in iter_tree(
+        host, community, _HR_PROCESSOR_LOAD_OID, version, max_repetitions))
+
+    ram_index = None
+    # Like the individual queries, only look for memory on devices that report CPU usage.
+    if len(cpu_indexes) > 0:
+        for oid, data in iter_tree(host, community, _HR_STORAGE_OID + '.2', version, max_repetitions):
+            if str(data) == _RAM_RESOURCE_TYPE:
+                ram_index = _get_index(oid)
+                break
+
+    if_indexes: tuple[int, ...] = ()
+    if include_traffic:
+        if_indexes = tuple(_get_index(oid) for oid, _ in iter_tree(
+            host, community, _IF_IN_OCTETS_OID, version, max_repetitions))
+
+    return DeviceQueryPlan(cpu_indexes, ram_index, if_indexes)
+
+
+def query_device_stats(host: str, community: str, plan: DeviceQueryPlan, version='1') -> Optional[DeviceStats]:
+    '''
+    Read the stats in the plan with a single GET. Returns None if any value is missing, which indicates the plan
+    needs to be rediscovered.
+    '''
+    oids = plan.get_oids()
+    if len(oids) == 0:
+        return DeviceStats()
+
+    response = send_requests(host, community, oids, version=version)
+    if any(v is None for v in response.values()):
+        return None
+
+    cpu_used_percent = None
+    if len(plan.cpu_indexes) > 0:
+        cpu_loads = [int(response[f'{_HR_PROCESSOR_LOAD_OID}.{i}']) for i in plan.cpu_indexes]
+        cpu_used_percent = float(sum(cpu_loads)) / float(len(cpu_loads))
+
+    mem_used_percent = None
+    if plan.ram_index is not None:
+        total, used = (int(response[f'{_HR_STORAGE_OID}.{col}.{plan.ram_index}']) for col in (5, 6))
+        if total > 0:
+            mem_used_percent = float(used) / float(total) * 100.0
+
+    if_in_out_bytes = None
+    if len(plan.if_indexes) > 0:
+        if_in_out_bytes = (
+            max(int(response[f'{_IF_IN_OCTETS_OID}.{i}']) for i in plan.if_indexes),
+            max(int(response[f'{_IF_OUT_OCTETS_OID}.{i}']) for i in plan.if_indexes),
+        )
+
+    return DeviceStats(cpu_used_percent, mem_used_percent, if_in_out_bytes)
+
+
 if __name__ == '__main__':
     import sys
 
@@ -1,41 +1,78 @@
+import asyncio
 import logging
 import time
 from collections import defaultdict
+from typing import Optional
 
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
 from pet_monitor.common import (TRACE, CPUStats, NetworkInterfaceInfo,
-                                TrafficStats)
+                                SNMPCapabilities, TrafficStats)
+from pet_monitor.ingest import get_writer
+from pet_monitor.neighbor_table import neighbor_table
 from pet_monitor.network_db import DBInterface
-from pet_monitor.service_base import ServiceBase
+from pet_monitor.network_info_differ import NetworkInfoDiffer
 from pet_monitor.settings import SNMPSettings, get_settings
-from pet_monitor.snmp.get_device_stats import (get_attached_ips,
-                                               get_max_if_in_out_bytes,
-                                               get_ram_used_percent,
-                                               get_total_cpu_usage)
+from pet_monitor.snmp.get_device_stats import (DeviceQueryPlan, DeviceStats,
+                                               discover_query_plan,
+                                               get_attached_ips,
+                                               query_device_stats,
+                                               set_agent_port)
 
 _logger = logging.getLogger(__name__)
 
 
-class SNMPScraper(ServiceBase):
+class SNMPScraper(AsyncServiceBase):
     def __init__(self, settings: SNMPSettings) -> None:
         super().__init__(settings.time_between_scans)
         self.settings = settings
-
-    def _update(self):
-        try:
-            devices = get_attached_ips(self.settings.router_ip, self.settings.community)
-            # Filter devices with multiple IPs.
-            mac_counts: dict[str, int] = defaultdict(int)
-            for device in devices:
-                mac_counts[device[1]] += 1
-            original_len = len(devices)
-            devices = [d for d in devices if mac_counts[d[1]] == 1]
-            _logger.log(TRACE, devices)
-        except Exception as e:
-            _logger.error(e)
-            return False
-
-        _logger.debug(f'Router SNMP found had {len(devices)} clients with unique IP out of {original_len}.')
-
+        set_agent_port(settings.agent_port)
+        # Cache of (monotonic discovery time, plan) for each host.
+        self.query_plans: dict[str, tuple[float, DeviceQueryPlan]] = {}
+        self.network_info = NetworkInfoDiffer()
+
+    def _get_device_stats(self, host: str) -> tuple[Optional[DeviceStats], Optional[DeviceQueryPlan]]:
+        '''
+        Query `host`, returning the stats along with the plan used to get them.
+        '''
+        # Runs in several threads at once, and a host can be queried twice in a pass if the router lists it under more
+        # than one IP. So the cache is only accessed with single dict operations, and the plan is returned instead of
+        # being read back from it.
+        now = time.monotonic()
+        cached = self.query_plans.get(host)
+        if cached is not None:
+            discovery_time, plan = cached
+            if now - discovery_time < self.settings.query_plan_ttl_sec:
+                stats = query_device_stats(host, self.settings.community, plan, self.settings.version)
+                if stats is not None:
+                    return stats, plan
+                _logger.debug(f'SNMP query plan for {host} failed, rediscovering.')
+            self.query_plans.pop(host, None)
+
+        plan = discover_query_plan(host, self.settings.community, self.settings.collect_traffic_data,
+                                   self.settings.version, self.settings.max_repetitions)
+        if plan.is_empty():
+            return None, None
+        _logger.log(TRACE, f'SNMP query plan for {host}: {plan}')
+        self.query_plans[host] = (now, plan)
+        return query_device_stats(host, self.settings.community, plan, self.settings.version), plan
+
+    def _get_updated_capabilities(self, host: str, previous: Optional[SNMPCapabilities],
+                                  stats: Optional[DeviceStats], plan: Optional[DeviceQueryPlan],
+                                  timestamp: int) -> SNMPCapabilities:
+        if stats is not None and plan is not None:
+            mibs = plan.get_supported_mibs()
+            return SNMPCapabilities(host=host, responded=True, supported_mibs=','.join(mibs),
+                                    last_success=timestamp, consecutive_failures=0, next_attempt=0)
+
+        if previous is None:
+            previous = SNMPCapabilities(host=host)
+        failures = previous.consecutive_failures + 1
+        retry_sec = min(self.settings.unresponsive_retry_sec * 2 ** (failures - 1),
+                        self.settings.max_unresponsive_retry_sec)
+        return previous._replace(responded=False, consecutive_failures=failures,
+                                 next_attempt=timestamp + int(retry_sec))
+
+    def _load_hosts(self) -> tuple[dict[str, str], dict[str, SNMPCapabilities]]:
         with DBInterface() as db_interface:
             # Clear old data.
             db_interface.delete_old_cpu_stats(int(self.settings.history_len))
@@ -43,45 +80,104 @@ class SNMPScraper(ServiceBase):
                 db_interface.delete_old_traffic_stats(self.settings.history_len)
             pet_info = db_interface.get_pet_info()
             pet_device_map = db_interface.get_network_info_for_pets(pet_info)
+            capabilities = db_interface.get_snmp_capabilities()
 
-        cpu_stats: dict[str, CPUStats] = {}
-        traffic_stats: dict[str, TrafficStats] = {}
+        hosts = {}
         for name, device in pet_device_map.items():
             host = device.get_host()
             if host:
-                cpu_usage = get_total_cpu_usage(host, self.settings.community)
-                if cpu_usage is not None:
-                    mem_usage = get_ram_used_percent(host, self.settings.community)
-                    if mem_usage is not None:
-                        cpu_stats[name] = CPUStats(cpu_usage, mem_usage, int(time.time()))
-
-                if self.settings.collect_traffic_data:
-                    if_traffic = get_max_if_in_out_bytes(host, self.settings.community)
-                    if if_traffic is not None:
-                        traffic_stats[name] = TrafficStats(
-                            rx_bytes=if_traffic[0],
-                            tx_bytes=if_traffic[1],
-                            timestamp=int(
-                                time.time()))
-
-        _logger.debug(f'SNMP found {len(cpu_stats)} devices with cpu stats.')
-        if self.settings.collect_traffic_data:
-            _logger.debug(f'SNMP found {len(traffic_stats)} devices with traffic stats.')
-
+                hosts[name] = host
+        return hosts, capabilities
+
+    async def _query_host(self, host: str, previous: Optional[SNMPCapabilities],
+                          semaphore: asyncio.Semaphore) -> tuple[SNMPCapabilities, Optional[DeviceStats]]:
+        async with semaphore:
+            timestamp = int(time.time())
+            stats, plan = await asyncio.to_thread(self._get_device_stats, host)
+        return self._get_updated_capabilities(host, previous, stats, plan, timestamp), stats
+
+    def _write_results(self, devices: list[tuple[str, str]], updated_capabilities: list[SNMPCapabilities],
+                       cpu_stats: dict[str, CPUStats], traffic_stats: dict[str, TrafficStats]):
         timestamp = int(time.time())
         with DBInterface() as db_interface:
+            db_interface.set_snmp_capabilities(updated_capabilities)
+            writer = get_writer(db_interface)
+
             for device in devices:
-                db_interface.add_network_info(NetworkInterfaceInfo(
+                self.network_info.write(writer, NetworkInterfaceInfo(
                     timestamp=timestamp,
                     ip=device[0],
                     mac=device[1],
                 ))
+            self.network_info.flush_touches(writer)
 
             for name, stats in cpu_stats.items():
-                db_interface.add_cpu_stats_for_pet(name, stats)
+                writer.add_cpu_stats_for_pet(name, stats)
 
             for name, stats in traffic_stats.items():
-                db_interface.add_traffic_for_pet(name, int(stats.rx_bytes), int(stats.tx_bytes), stats.timestamp)
+                writer.add_traffic_for_pet(name, int(stats.rx_bytes), int(stats.tx_bytes), stats.timestamp)
+        self.stats.add_items(len(devices) + len(cpu_stats) + len(traffic_stats))
+
+    async def update(self):
+        try:
+            devices = await asyncio.to_thread(get_attached_ips, self.settings.router_ip, self.settings.community,
+                                              self.settings.version, self.settings.max_repetitions)
+            neighbor_table.add_entries(devices)
+            # Filter devices with multiple IPs.
+            mac_counts: dict[str, int] = defaultdict(int)
+            for device in devices:
+                mac_counts[device[1]] += 1
+            original_len = len(devices)
+            devices = [d for d in devices if mac_counts[d[1]] == 1]
+            _logger.log(TRACE, devices)
+        except Exception as e:
+            _logger.error(e)
+            self.stats.record_error(e)
+            return
+
+        _logger.debug(f'Router SNMP found had {len(devices)} clients with unique IP out of {original_len}.')
+
+        hosts, capabilities = await asyncio.to_thread(self._load_hosts)
+
+        timestamp = int(time.time())
+        queries = {}
+        skipped_hosts = 0
+        for name, host in hosts.items():
+            previous = capabilities.get(host)
+            # Skip hosts that haven't been responding until their backoff expires.
+            if previous is not None and previous.next_attempt > timestamp:
+                skipped_hosts += 1
+                continue
+            queries[name] = (host, previous)
+
+        # The SNMP client blocks, so each query runs in a thread, up to max_concurrent_queries at once.
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_queries)
+        results = await asyncio.gather(*(self._query_host(host, previous, semaphore)
+                                         for host, previous in queries.values()))
+
+        cpu_stats: dict[str, CPUStats] = {}
+        traffic_stats: dict[str, TrafficStats] = {}
+        updated_capabilities: list[SNMPCapabilities] = []
+        for name, (host_capabilities, stats) in zip(queries, results):
+            updated_capabilities.append(host_capabilities)
+            if stats is None:
+                continue
+
+            if stats.cpu_used_percent is not None and stats.mem_used_percent is not None:
+                cpu_stats[name] = CPUStats(stats.cpu_used_percent, stats.mem_used_percent, int(time.time()))
+
+            if self.settings.collect_traffic_data and stats.if_in_out_bytes is not None:
+                traffic_stats[name] = TrafficStats(
+                    rx_bytes=stats.if_in_out_bytes[0],
+                    tx_bytes=stats.if_in_out_bytes[1],
+                    timestamp=int(
+                        time.time()))
+
+        _logger.debug(f'SNMP found {len(cpu_stats)} devices with cpu stats. Skipped {skipped_hosts} unresponsive.')
+        if self.settings.collect_traffic_data:
+            _logger.debug(f'SNMP found {len(traffic_stats)} devices with traffic stats.')
+
+        await asyncio.to_thread(self._write_results, devices, updated_capabilities, cpu_stats, traffic_stats)
 
 
 def main():
@@ -94,7 +190,7 @@ def main():
 
     DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
     snmp = SNMPScraper(settings.snmp_settings)
-    ServiceBase.run_services([snmp])
+    AsyncServiceRunner([snmp]).run_services()
 
 
 if __name__ == '__main__':
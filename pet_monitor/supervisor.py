@@ -0,0 +1,256 @@
+'''
+Runs services in worker processes, so CPU heavy services don't compete for the GIL with the latency sensitive ones.
+
+Each worker builds its service from the service class and settings, opens its own DB connections and runs the
+service on an `AsyncServiceRunner`. Workers that exit are restarted with exponential backoff. Log records from the
+workers are sent to the parent and handled by its loggers.
+'''
+import asyncio
+import contextlib
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+from typing import Any, NamedTuple, Optional, Union
+
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
+from pet_monitor.ingest import IngestQueue, set_default_queue
+from pet_monitor.memory_tracker import MemoryTracker
+from pet_monitor.network_db import DBInterface
+from pet_monitor.profiling import Profiler
+from pet_monitor.query_stats import QUERY_STATS_DIR, QueryStats
+from pet_monitor.service_base import ServiceBase
+from pet_monitor.settings import (IngestSettings, MemoryTrackerSettings,
+                                  ProfilingSettings, QueryStatsSettings,
+                                  SchedulerSettings, SupervisorSettings)
+
+_logger = logging.getLogger(__name__)
+
+# Workers are started fresh instead of forked, since the parent has threads running.
+_mp_context = multiprocessing.get_context('spawn')
+
+
+class WorkerSpec(NamedTuple):
+    # Class of the service to run. Constructed in the worker with `settings`.
+    service_class: type[Union[AsyncServiceBase, ServiceBase]]
+    settings: Any
+
+
+class _WorkerConfig(NamedTuple):
+    spec: WorkerSpec
+    db_path: Any
+    hard_coded_pet_interfaces: dict
+    profiling_settings: ProfilingSettings
+    scheduler_settings: SchedulerSettings
+    metrics_dir: Optional[Path]
+    memory_tracker_settings: Optional[MemoryTrackerSettings]
+    ingest_settings: Optional[IngestSettings]
+    query_stats_settings: Optional[QueryStatsSettings]
+    log_queue: Any
+    log_level: int
+
+
+def _run_worker(config: _WorkerConfig):
+    # Ctrl-C reaches the whole process group. Leave it to the supervisor to stop the worker.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(config.log_queue)]
+    root_logger.setLevel(config.log_level)
+    logger = logging.getLogger(__name__)
+
+    DBInterface.set_default_db_path(config.db_path)
+    DBInterface.set_hard_coded_pet_interfaces(config.hard_coded_pet_interfaces)
+    Profiler.set_settings(config.profiling_settings)
+    if config.query_stats_settings is not None:
+        stats_dir = None if config.metrics_dir is None else Path(config.metrics_dir) / QUERY_STATS_DIR.name
+        DBInterface.set_query_stats(QueryStats(f'worker_{config.spec.service_class.__name__}',
+                                               config.query_stats_settings, stats_dir))
+    service = config.spec.service_class(config.spec.settings)
+    services = [service]
+    if config.memory_tracker_settings is not None:
+        services.append(MemoryTracker(config.memory_tracker_settings, [service]))
+    runner = AsyncServiceRunner(services, config.scheduler_settings, config.metrics_dir)
+    ingest_queue = None
+    if config.ingest_settings is not None:
+        # Each worker has its own writer thread.
+        ingest_queue = IngestQueue(config.ingest_settings, name=f'IngestWriter_{service.get_name()}')
+        ingest_queue.start(config.metrics_dir)
+        set_default_queue(ingest_queue)
+
+    async def main():
+        task = asyncio.create_task(runner.run())
+        # The supervisor stops workers with SIGTERM. Cancelling lets the services clean up.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        logger.error(f'{service.get_name()} worker failed:', exc_info=True)
+        sys.exit(1)
+    finally:
+        if ingest_queue is not None:
+            ingest_queue.stop()
+
+
+class _Worker:
+    def __init__(self, spec: WorkerSpec) -> None:
+        self.spec = spec
+        self.name = spec.service_class.__name__
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.start_time = 0.0
+        # Monotonic time to restart the worker after it exited.
+        self.restart_time: Optional[float] = None
+        self.num_restarts = 0
+        self.consecutive_failures = 0
+
+
+class ServiceSupervisor:
+    '''
+    Runs each added service in its own worker process until `stop` is called.
+    '''
+
+    def __init__(self, settings: SupervisorSettings = SupervisorSettings(),
+                 scheduler_settings: SchedulerSettings = SchedulerSettings(),
+                 metrics_dir: Optional[Path] = None,
+                 memory_tracker_settings: Optional[MemoryTrackerSettings] = None,
+                 ingest_settings: Optional[IngestSettings] = None) -> None:
+        self.settings = settings
+        self.scheduler_settings = scheduler_settings
+        # Passed to the workers' `AsyncServiceRunner`, since their stats can only be read from the saved files.
+        self.metrics_dir = metrics_dir
+        # Each worker traces its own allocations.
+        self.memory_tracker_settings = memory_tracker_settings
+        self.ingest_settings = ingest_settings
+        self.workers: list[_Worker] = []
+        self.log_queue = _mp_context.Queue()
+        self.is_running = False
+        self.thread: Optional[Thread] = None
+        self.log_thread: Optional[Thread] = None
+        # Wakes the monitor thread when stopping.
+        self._wake_reader, self._wake_writer = _mp_context.Pipe(duplex=False)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def add(self, service_class: type[Union[AsyncServiceBase, ServiceBase]], settings: Any):
+        worker = _Worker(WorkerSpec(service_class, settings))
+        self.workers.append(worker)
+        if self.is_running:
+            # Let the monitor thread start it.
+            worker.restart_time = time.monotonic()
+            self._wake_writer.send(None)
+
+    def _start_worker(self, worker: _Worker):
+        config = _WorkerConfig(
+            spec=worker.spec,
+            db_path=DBInterface._default_db_path,
+            hard_coded_pet_interfaces=DBInterface._hard_coded_pet_interfaces,
+            profiling_settings=Profiler._settings,
+            scheduler_settings=self.scheduler_settings,
+            metrics_dir=self.metrics_dir,
+            memory_tracker_settings=self.memory_tracker_settings,
+            ingest_settings=self.ingest_settings,
+            # Workers time their DB access if this process does.
+            query_stats_settings=None if DBInterface._query_stats is None else DBInterface._query_stats.settings,
+            log_queue=self.log_queue,
+            log_level=logging.getLogger('pet_monitor').getEffectiveLevel(),
+        )
+        worker.process = _mp_context.Process(target=_run_worker, args=(config,), name=f'{worker.name}_worker')
+        worker.process.start()
+        worker.start_time = time.monotonic()
+        worker.restart_time = None
+        _logger.info(f'Started {worker.name} in process {worker.process.pid}.')
+
+    def _handle_exit(self, worker: _Worker):
+        assert worker.process is not None
+        # The sentinel is ready once the process exited, but it still has to be joined to get the exit code.
+        worker.process.join()
+        run_sec = time.monotonic() - worker.start_time
+        # Only back off from workers that fail soon after starting.
+        if run_sec >= self.settings.stable_run_sec:
+            worker.consecutive_failures = 0
+        backoff = min(self.settings.restart_backoff_sec * 2 ** worker.consecutive_failures,
+                      self.settings.max_restart_backoff_sec)
+        worker.consecutive_failures += 1
+        worker.restart_time = time.monotonic() + backoff
+        _logger.error(f'{worker.name} worker exited with {worker.process.exitcode} after {run_sec:.1f}s. '
+                      f'Restarting in {backoff:.1f}s.')
+        worker.process.close()
+        worker.process = None
+
+    def _run_monitor(self):
+        while self.is_running:
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process is None and worker.restart_time is not None and worker.restart_time <= now:
+                    # Workers added while running haven't exited yet.
+                    if worker.consecutive_failures > 0:
+                        worker.num_restarts += 1
+                    self._start_worker(worker)
+
+            sentinels = {w.process.sentinel: w for w in self.workers if w.process is not None}
+            restart_times = [w.restart_time for w in self.workers if w.restart_time is not None]
+            timeout = None if len(restart_times) == 0 else max(0.0, min(restart_times) - now)
+            ready = multiprocessing.connection.wait([*sentinels, self._wake_reader], timeout)
+            if not self.is_running:
+                break
+            for sentinel in ready:
+                if sentinel is self._wake_reader:
+                    self._wake_reader.recv()
+                elif sentinel in sentinels:
+                    self._handle_exit(sentinels[sentinel])
+
+    def _forward_logs(self):
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                break
+            # The worker already filtered by level, so hand the record straight to the parent's handlers.
+            logging.getLogger(record.name).handle(record)
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.log_thread = Thread(target=self._forward_logs, name='supervisor_logs')
+        self.log_thread.start()
+        for worker in self.workers:
+            self._start_worker(worker)
+        self.thread = Thread(target=self._run_monitor, name='supervisor')
+        self.thread.start()
+
+    def stop(self):
+        if not self.is_running or self.thread is None or self.log_thread is None:
+            return
+        self.is_running = False
+        self._wake_writer.send(None)
+        self.thread.join()
+
+        processes = [w.process for w in self.workers if w.process is not None]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + self.settings.stop_timeout_sec
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                _logger.warning(f'{process.name} did not stop, killing it.')
+                process.kill()
+                process.join()
+        for worker in self.workers:
+            worker.process = None
+
+        self.log_queue.put(None)
+        self.log_thread.join()
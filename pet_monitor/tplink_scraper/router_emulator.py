@@ -0,0 +1,278 @@
+'''
+Local HTTP stand-in for the TP-Link Omada router web API used by `TPLinkInterface`.
+
+Implements the luci login flow (RSA public key, encrypted password, `stok` token and `sysauth` cookie) and the
+`dhcps`, `ipstats`, `sys_status` and `interface` endpoints, serving a configurable number of synthetic clients. Point
+`TPLinkInterface` at it with an address of "host:port".
+
+Run standalone with `python -m pet_monitor.tplink_scraper.router_emulator`.
+'''
+import ipaddress
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, NamedTuple, Optional
+
+from Crypto.PublicKey import RSA
+from Crypto.Util.number import bytes_to_long, long_to_bytes
+
+_logger = logging.getLogger(__name__)
+
+_LOGIN_PATH = '/cgi-bin/luci/;stok=/login'
+_ADMIN_PREFIX = '/cgi-bin/luci/;stok='
+
+# Returned by the router when the token or cookie isn't valid.
+_ERROR_UNAUTHORIZED = '-40401'
+_ERROR_BAD_PASSWORD = '-40210'
+_ERROR_NOT_FOUND = '-40101'
+
+
+class EmulatorSettings(NamedTuple):
+    host: str = '127.0.0.1'
+    port: int = 18080
+    username: str = 'admin'
+    password: str = 'password'
+    # Number of DHCP clients.
+    num_clients: int = 1000
+    # Fraction of clients with a DHCP reservation.
+    reservation_fraction: float = 0.1
+    # First client address.
+    base_ip: str = '192.168.0.2'
+    # Delay before each response is sent.
+    latency_sec: float = 0.0
+    # How long a login stays valid. 0 for no limit.
+    stok_lifetime_sec: float = 0.0
+    seed: int = 0
+
+
+class EmulatedClient(NamedTuple):
+    ip: str
+    mac: str
+    name: str
+    is_reserved: bool
+    # Traffic counter growth in bytes per second.
+    rx_rate: int
+    tx_rate: int
+
+
+def get_emulated_clients(settings: EmulatorSettings) -> list[EmulatedClient]:
+    '''
+    The synthetic DHCP clients. Deterministic for a given settings.
+    '''
+    rand = random.Random(settings.seed)
+    base_ip = ipaddress.IPv4Address(settings.base_ip)
+    clients = []
+    for i in range(settings.num_clients):
+        clients.append(EmulatedClient(
+            ip=str(base_ip + i),
+            mac='-'.join(f'{b:02X}' for b in (2, 1, 0, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)),
+            name='--' if rand.random() < 0.2 else f'client-{i}',
+            is_reserved=rand.random() < settings.reservation_fraction,
+            rx_rate=rand.randint(0, 100000),
+            tx_rate=rand.randint(0, 20000),
+        ))
+    return clients
+
+
+class TPLinkRouterEmulator:
+    def __init__(self, settings: EmulatorSettings = EmulatorSettings()) -> None:
+        self.settings = settings
+        self.clients = get_emulated_clients(settings)
+        self.address = f'{settings.host}:{settings.port}'
+        self.num_requests = 0
+        self.num_logins = 0
+        self._key = RSA.generate(1024)
+        self._lock = threading.Lock()
+        # Login time by (stok, sysauth cookie).
+        self._sessions: dict[tuple[str, str], float] = {}
+        self._start_time = time.monotonic()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._server is not None:
+            return
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                emulator._handle_post(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.settings.host, self.settings.port), Handler)
+        self._server.daemon_threads = True
+        self.thread = threading.Thread(target=self._server.serve_forever, name='tplink_router_emulator')
+        self.thread.start()
+
+    def stop(self):
+        if self._server is not None and self.thread is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self.thread.join()
+            self._server = None
+
+    def invalidate_sessions(self):
+        '''
+        Reject all current logins, as the router does after a timeout or reboot.
+        '''
+        with self._lock:
+            self._sessions = {}
+
+    def _decrypt_password(self, encrypted_hex: str) -> str:
+        # The client pads with zeros instead of PKCS#1 v1.5 padding. See custom_rsa.py.
+        value = pow(bytes_to_long(bytes.fromhex(encrypted_hex)), self._key.d, self._key.n)
+        return long_to_bytes(value, self._key.size_in_bytes()).rstrip(b'\x00').decode('ascii', errors='replace')
+
+    def _login(self, request: dict) -> tuple[dict, Optional[str]]:
+        if request.get('method') == 'get':
+            return {'result': {'username': '', 'password': [f'{self._key.n:X}', f'{self._key.e:06X}']},
+                    'error_code': '0'}, None
+
+        params = request.get('params', {})
+        is_valid_user = params.get('username') == self.settings.username
+        if not is_valid_user or self._decrypt_password(params.get('password', '')) != self.settings.password:
+            return {'result': {}, 'error_code': _ERROR_BAD_PASSWORD}, None
+
+        stok = secrets.token_hex(16)
+        sysauth = secrets.token_hex(16)
+        with self._lock:
+            self._sessions[(stok, sysauth)] = time.monotonic()
+            self.num_logins += 1
+        return {'result': {'stok': stok}, 'error_code': '0'}, sysauth
+
+    def _is_authorized(self, stok: str, sysauth: Optional[str]) -> bool:
+        with self._lock:
+            login_time = self._sessions.get((stok, sysauth or ''))
+        if login_time is None:
+            return False
+        lifetime = self.settings.stok_lifetime_sec
+        return lifetime <= 0 or time.monotonic() - login_time < lifetime
+
+    def _get_traffic(self) -> list[dict[str, Any]]:
+        elapsed = time.monotonic() - self._start_time
+        traffic = []
+        for client in self.clients:
+            rx_bytes = int(client.rx_rate * elapsed)
+            tx_bytes = int(client.tx_rate * elapsed)
+            traffic.append({'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes, 'addr': client.ip,
+                            'tx_pps': 0, 'tx_bps': client.tx_rate * 8, 'rx_bps': client.rx_rate * 8,
+                            'rx_pkts': rx_bytes // 1000, 'tx_pkts': tx_bytes // 1000, 'rx_pps': 0})
+        return traffic
+
+    def _query(self, endpoint: str) -> Optional[Any]:
+        if endpoint == 'dhcps?form=client':
+            return [{'leasetime': '1:40:9', 'name': c.name, 'macaddr': c.mac, 'ipaddr': c.ip, 'interface': 'lan'}
+                    for c in self.clients]
+        elif endpoint == 'dhcps?form=reservation':
+            return [{'mac': c.mac, 'note': urllib.parse.quote(f'reserved {c.name}'), 'bind': '1', 'enable': 'on',
+                     'ip': c.ip, 'interface': 'LAN1'} for c in self.clients if c.is_reserved]
+        elif endpoint == 'ipstats?form=list':
+            return self._get_traffic()
+        elif endpoint == 'sys_status?form=all_usage':
+            cores = {f'core{i}': random.randint(0, 100) for i in range(1, 5)}
+            return {'cpu_log': {core: [value] for core, value in cores.items()}, 'mem_usage': {'mem': 29},
+                    'cpu_usage': cores}
+        elif endpoint == 'interface?form=status2':
+            return {'normal': [{'t_proto': 'static', 'ipaddr': self.settings.host, 't_type': 'physical',
+                                't_linktype': 'static', 'macaddr': '02-01-FF-00-00-00', 't_label': 'LAN',
+                                't_isup': True, 'netmask': '255.255.255.0', 't_name': 'LAN1'}], 'vpn': {}}
+        return None
+
+    def _handle_post(self, handler: BaseHTTPRequestHandler):
+        with self._lock:
+            self.num_requests += 1
+        if self.settings.latency_sec > 0:
+            time.sleep(self.settings.latency_sec)
+
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0))).decode()
+        data = urllib.parse.parse_qs(body).get('data', ['{}'])[0]
+        try:
+            request = json.loads(data)
+        except json.JSONDecodeError:
+            request = {}
+
+        path = handler.path
+        sysauth = None
+        if path.startswith(_LOGIN_PATH):
+            response, sysauth = self._login(request)
+        elif path.startswith(_ADMIN_PREFIX) and '/admin/' in path:
+            stok, endpoint = path[len(_ADMIN_PREFIX):].split('/admin/', 1)
+            cookie = handler.headers.get('Cookie', '')
+            cookies = dict(c.strip().split('=', 1) for c in cookie.split(';') if '=' in c)
+            if not self._is_authorized(stok, cookies.get('sysauth')):
+                response = {'error_code': _ERROR_UNAUTHORIZED}
+            else:
+                result = self._query(endpoint)
+                response = {'error_code': _ERROR_NOT_FOUND} if result is None else {'result': result,
+                                                                                    'error_code': '0'}
+        else:
+            handler.send_error(404)
+            return
+
+        payload = json.dumps({'id': 1, **response}).encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        if sysauth is not None:
+            handler.send_header('Set-Cookie', f'sysauth={sysauth}; path=/cgi-bin/luci')
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+def run_emulator(settings: EmulatorSettings, ready: Optional[Any] = None, stop: Optional[Any] = None):
+    '''
+    Run the emulator until `stop` is set. Meant as a multiprocessing target so the emulator doesn't share the GIL
+    with the code being measured.
+    '''
+    with TPLinkRouterEmulator(settings):
+        if ready is not None:
+            ready.set()
+        while stop is None or not stop.wait(0.1):
+            pass
+
+
+def main():
+    import argparse
+
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    defaults = EmulatorSettings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=defaults.host)
+    parser.add_argument('--port', type=int, default=defaults.port)
+    parser.add_argument('--password', default=defaults.password)
+    parser.add_argument('--num-clients', type=int, default=defaults.num_clients)
+    parser.add_argument('--latency-sec', type=float, default=defaults.latency_sec)
+    parser.add_argument('--stok-lifetime-sec', type=float, default=defaults.stok_lifetime_sec)
+    args = parser.parse_args()
+
+    settings = EmulatorSettings(
+        host=args.host,
+        port=args.port,
+        password=args.password,
+        num_clients=args.num_clients,
+        latency_sec=args.latency_sec,
+        stok_lifetime_sec=args.stok_lifetime_sec,
+    )
+    _logger.info(f'Router at {settings.host}:{settings.port} with {settings.num_clients} clients.')
+    try:
+        run_emulator(settings)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,78 +1,125 @@
+import asyncio
 import logging
 import time
 import urllib.parse
 from collections import defaultdict
+from typing import Any
 
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
 from pet_monitor.common import ExtraNetworkInfoType, NetworkInterfaceInfo
+from pet_monitor.ingest import get_writer
 from pet_monitor.network_db import DBInterface
-from pet_monitor.service_base import ServiceBase
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+from pet_monitor.service_base import RateLimiter
 from pet_monitor.settings import TPLinkSettings, get_settings
 from pet_monitor.tplink_scraper.tplink_interface import TPLinkInterface
 
 _logger = logging.getLogger(__name__)
 
 
-class TPLinkScraper(ServiceBase):
+class TPLinkScraper(AsyncServiceBase):
     def __init__(self, settings: TPLinkSettings) -> None:
-        super().__init__(settings.update_period_sec)
+        self.endpoint_limiters = {
+            'clients': RateLimiter(settings.update_period_sec),
+            'reservations': RateLimiter(settings.reservations_period_sec),
+        }
+        if settings.collect_traffic_data:
+            self.endpoint_limiters['traffic'] = RateLimiter(settings.traffic_period_sec)
+        super().__init__(min(limiter.update_period_sec for limiter in self.endpoint_limiters.values()))
         self.settings = settings
+        self.network_info = NetworkInfoDiffer()
+        # Kept between updates so the login is reused.
+        self.tplink = TPLinkInterface(self.settings.router_ip, self.settings.username, self.settings.password)
+        self.endpoint_queries = {
+            'clients': self.tplink.get_dhcp_clients,
+            'reservations': self.tplink.get_dhcp_static_reservations,
+            'traffic': self.tplink.get_traffic_stats,
+        }
+        # Last results of the endpoints that are polled less often.
+        self.clients: list[dict] = []
+        self.reservations: list[dict] = []
+
+    def _write_devices(self, db_interface: DBInterface, timestamp: int):
+        writer = get_writer(db_interface)
+        devices: dict[str, NetworkInterfaceInfo] = {}
+        extra_info = defaultdict(dict)
+        for entry in self.reservations:
+            mac = entry['mac']
+            devices[mac] = NetworkInterfaceInfo(
+                timestamp=timestamp,
+                mac=mac,
+                ip=entry['ip']
+            )
+            extra_info[mac][ExtraNetworkInfoType.ROUTER_DESCRIPTION] = urllib.parse.unquote(entry['note'])
+        for entry in self.clients:
+            mac = entry['macaddr']
+            if mac not in devices:
+                devices[mac] = NetworkInterfaceInfo(
+                    timestamp=timestamp,
+                    mac=mac,
+                    ip=entry['ipaddr'],
+                )
+            if entry['name'] != '--':
+                extra_info[mac][ExtraNetworkInfoType.DHCP_NAME] = entry['name']
+
+        for mac, device in devices.items():
+            self.network_info.write(writer, device, extra_info=extra_info[mac])
+        self.network_info.flush_touches(writer)
+        self.stats.add_items(len(devices))
+
+    def _write_traffic(self, db_interface: DBInterface, traffic: list[dict], timestamp: int):
+        pet_info = db_interface.get_pet_info()
+        pet_device_map = db_interface.get_network_info_for_pets(pet_info)
+        pet_ips = {interface.ip: name for name, interface in pet_device_map.items() if interface.ip is not None}
+        writer = get_writer(db_interface)
+        for traffic_entry in traffic:
+            name = pet_ips.get(traffic_entry['addr'])
+            if name is not None:
+                writer.add_traffic_for_pet(name, traffic_entry['rx_bytes'], traffic_entry['tx_bytes'], timestamp)
+                self.stats.add_items(1)
+
+    def _write_results(self, results: dict[str, Any]):
+        with DBInterface() as db_interface:
+            timestamp = int(time.time())
+            if 'clients' in results or 'reservations' in results:
+                if self.settings.collect_traffic_data:
+                    db_interface.delete_old_traffic_stats(self.settings.history_len)
+                self._write_devices(db_interface, timestamp)
+
+            if 'traffic' in results:
+                self._write_traffic(db_interface, results['traffic'], timestamp)
+
+    async def update(self) -> None:
+        # Compare against the deadline of this update so endpoints with the shortest period aren't skipped. Deadlines
+        # are multiples of the base period apart, so endpoints due within half a period are polled now.
+        update_time = self.last_update
+        due = [endpoint for endpoint, limiter in self.endpoint_limiters.items()
+               if update_time - limiter.last_update >= limiter.update_period_sec - self.update_period_sec / 2]
+        if len(due) == 0:
+            return
 
-    def _update(self) -> bool:
         try:
-            tplink = TPLinkInterface(
-                self.settings.router_ip, self.settings.username, self.settings.password)
-            clients = tplink.get_dhcp_clients()
-            reservations = tplink.get_dhcp_static_reservations()
-            if self.settings.collect_traffic_data:
-                traffic = tplink.get_traffic_stats()
-            else:
-                traffic = {}
+            # The HTTP client blocks, so each query runs in its own thread.
+            responses = await asyncio.gather(*(asyncio.to_thread(self.endpoint_queries[endpoint]) for endpoint in due))
+            results = dict(zip(due, responses))
         except Exception as e:
             _logger.error(e)
-            return False
+            self.stats.record_error(e)
+            return
+        finally:
+            for endpoint, timing in self.tplink.endpoint_timing.items():
+                _logger.debug(f'{endpoint}: last={timing.last_sec * 1000:.0f}ms '
+                              f'mean={timing.get_mean_sec() * 1000:.0f}ms max={timing.max_sec * 1000:.0f}ms '
+                              f'errors={timing.num_errors}/{timing.num_requests}')
 
-        with DBInterface() as db_interface:
-            if self.settings.collect_traffic_data:
-                db_interface.delete_old_traffic_stats(self.settings.history_len)
+        for endpoint in due:
+            self.endpoint_limiters[endpoint].last_update = update_time
+        self.clients = results.get('clients', self.clients)
+        self.reservations = results.get('reservations', self.reservations)
 
-            timestamp = int(time.time())
-            devices: dict[str, NetworkInterfaceInfo] = {}
-            extra_info = defaultdict(dict)
-            for entry in reservations:
-                mac = entry['mac']
-                devices[mac] = NetworkInterfaceInfo(
-                    timestamp=timestamp,
-                    mac=mac,
-                    ip=entry['ip']
-                )
-                extra_info[mac][ExtraNetworkInfoType.ROUTER_DESCRIPTION] = urllib.parse.unquote(entry['note'])
-            for entry in clients:
-                mac = entry['macaddr']
-                if mac not in devices:
-                    devices[mac] = NetworkInterfaceInfo(
-                        timestamp=timestamp,
-                        mac=mac,
-                        ip=entry['ipaddr'],
-                    )
-                if entry['name'] != '--':
-                    extra_info[mac][ExtraNetworkInfoType.DHCP_NAME] = entry['name']
-
-            for mac, device in devices.items():
-                db_interface.add_network_info(device, extra_info=extra_info[mac])
-
-            pet_info = db_interface.get_pet_info()
-            pet_device_map = db_interface.get_network_info_for_pets(pet_info)
-
-            if self.settings.collect_traffic_data:
-                for traffic_entry in traffic:
-                    for name, interface in pet_device_map.items():
-                        if interface.ip == traffic_entry['addr']:
-                            db_interface.add_traffic_for_pet(
-                                name, traffic_entry['rx_bytes'], traffic_entry['tx_bytes'], timestamp)
-
-            _logger.debug(
-                f'Scrape Succeeded: reservations={len(reservations)}, clients={len(clients)}, traffic={len(traffic)}')
-            return True
+        await asyncio.to_thread(self._write_results, results)
+        _logger.debug(f'Scrape Succeeded: endpoints={due}, reservations={len(self.reservations)}, '
+                      f'clients={len(self.clients)}, traffic={len(results.get("traffic", []))}')
 
 
 def main():
@@ -85,7 +132,7 @@ def main():
 
     DBInterface.set_hard_coded_pet_interfaces(settings.hard_coded_pet_interfaces)
     tplink = TPLinkScraper(settings.tplink_settings)
-    ServiceBase.run_services([tplink])
+    AsyncServiceRunner([tplink]).run_services()
 
 
 if __name__ == '__main__':
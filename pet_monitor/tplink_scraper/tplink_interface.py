@@ -1,5 +1,8 @@
 import logging
+import threading
+import time
 import urllib.parse
+from typing import NamedTuple
 
 import requests
 from Crypto.PublicKey import RSA
@@ -9,12 +12,31 @@ from pet_monitor.tplink_scraper.custom_rsa import new
 _logger = logging.getLogger(__name__)
 
 
+class EndpointTiming(NamedTuple):
+    '''
+    Request timing for an API endpoint.
+    '''
+    num_requests: int = 0
+    num_errors: int = 0
+    total_sec: float = 0.0
+    last_sec: float = 0.0
+    max_sec: float = 0.0
+
+    def get_mean_sec(self) -> float:
+        return self.total_sec / max(1, self.num_requests)
+
+
 class TPLinkInterface:
+    '''
+    Client for the router's web API. The session and auth token are kept for the life of the object, and are only
+    refreshed when the router rejects a query. Queries can be made from multiple threads.
+    '''
     COMMON_HEADERS = {
         "accept": "application/json, text/javascript, */*; q=0.01",
         "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
         "x-requested-with": "XMLHttpRequest",
     }
+    REQUEST_TIMEOUT_SEC = 30.0
 
     def __init__(self, address: str, username: str, password: str) -> None:
         self.address = address
@@ -22,12 +44,28 @@ class TPLinkInterface:
         self.password = password
         self.session = requests.Session()
         self.stok = None
+        self.auth_lock = threading.Lock()
+        self.num_auths = 0
+        self.timing_lock = threading.Lock()
+        self.endpoint_timing: dict[str, EndpointTiming] = {}
 
     def _send_post_request(self, path, data, referer='webpages/index.html') -> requests.Response:
         payload = f'data={urllib.parse.quote(data)}'
         headers = dict(TPLinkInterface.COMMON_HEADERS)
         headers["Referer"] = f"http://{self.address}/{referer}"
-        return self.session.post(f'http://{self.address}/{path}', data=payload, headers=headers)
+        return self.session.post(f'http://{self.address}/{path}', data=payload, headers=headers,
+                                 timeout=self.REQUEST_TIMEOUT_SEC)
+
+    def _record_timing(self, endpoint: str, elapsed: float, is_error: bool):
+        with self.timing_lock:
+            timing = self.endpoint_timing.get(endpoint, EndpointTiming())
+            self.endpoint_timing[endpoint] = EndpointTiming(
+                num_requests=timing.num_requests + 1,
+                num_errors=timing.num_errors + int(is_error),
+                total_sec=timing.total_sec + elapsed,
+                last_sec=elapsed,
+                max_sec=max(timing.max_sec, elapsed),
+            )
 
     def _get_auth(self):
         # Get RSA public key for encrypting password to send.
@@ -57,16 +95,47 @@ class TPLinkInterface:
             raise RuntimeError(f'Authentication failed: "{resp}"')
         _logger.debug('Authentication suceeded')
         self.stok = resp['result']['stok']
-
-    def _api_query(self, admin_path, data='{"method":"get","params":{}}'):
-        if self.stok is None:
-            self._get_auth()
-        resp = self._send_post_request(
-            f'cgi-bin/luci/;stok={self.stok}/admin/{admin_path}', data).json()
+        self.num_auths += 1
+
+    def _get_stok(self, rejected_stok=None) -> str:
+        '''
+        Get the current auth token, logging in if there isn't one or if it matches `rejected_stok`.
+        '''
+        with self.auth_lock:
+            # Another thread may have already replaced the rejected token.
+            if self.stok is None or self.stok == rejected_stok:
+                self.stok = None
+                self._get_auth()
+            assert self.stok is not None
+            return self.stok
+
+    def _query_with_stok(self, stok: str, admin_path: str, data: str):
+        try:
+            resp = self._send_post_request(f'cgi-bin/luci/;stok={stok}/admin/{admin_path}', data).json()
+        except requests.exceptions.JSONDecodeError:
+            # The router responds with the login page when the token has expired.
+            return None
         if 'error_code' not in resp or resp['error_code'] != "0":
-            raise RuntimeError(f'Authentication failed: "{resp}"')
+            _logger.debug(f'Query of {admin_path} rejected: "{resp}"')
+            return None
         return resp['result']
 
+    def _api_query(self, admin_path, data='{"method":"get","params":{}}'):
+        start = time.perf_counter()
+        is_error = True
+        try:
+            stok = self._get_stok()
+            result = self._query_with_stok(stok, admin_path, data)
+            if result is None:
+                # Log in again once in case the token expired.
+                result = self._query_with_stok(self._get_stok(rejected_stok=stok), admin_path, data)
+                if result is None:
+                    raise RuntimeError(f'Query of {admin_path} failed after authenticating.')
+            is_error = False
+            return result
+        finally:
+            self._record_timing(admin_path, time.perf_counter() - start, is_error)
+
     def get_dhcp_clients(self):
         return self._api_query('dhcps?form=client')
         # { "id":1, "result":[ { "leasetime":"1:40:9", "name":"A-PC",
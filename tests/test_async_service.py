@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+import threading
+
+from pet_monitor.async_service import (AsyncServiceBase, AsyncServiceRunner,
+                                       ThreadedService)
+from pet_monitor.service_base import ServiceBase
+from pet_monitor.settings import SchedulerSettings
+
+
+class NoJitterSettings(SchedulerSettings):
+    startup_spacing_sec = 0.05
+    jitter_sec = 0.0
+
+
+class SleepingService(AsyncServiceBase):
+    def __init__(self, update_period_sec: float, update_sec: float, timeout_sec=None) -> None:
+        super().__init__(update_period_sec, timeout_sec)
+        self.update_sec = update_sec
+        self.num_started = 0
+        self.num_stopped = 0
+
+    async def start(self) -> None:
+        self.num_started += 1
+
+    async def update(self) -> None:
+        await asyncio.sleep(self.update_sec)
+
+    async def stop(self) -> None:
+        self.num_stopped += 1
+
+
+class ThreadService(ServiceBase):
+    def __init__(self) -> None:
+        super().__init__(0.05)
+        self.update_threads: list[threading.Thread] = []
+        self.callback_threads: list[threading.Thread] = []
+
+    def _update(self) -> None:
+        self.update_threads.append(threading.current_thread())
+        if len(self.update_threads) == 1:
+            # Posted from another thread, like the NMAP runner does.
+            threading.Thread(target=self.post, args=(self._callback,)).start()
+
+    def _callback(self):
+        self.callback_threads.append(threading.current_thread())
+
+
+def _run_for(runner: AsyncServiceRunner, run_sec: float):
+    async def main():
+        task = asyncio.create_task(runner.run())
+        await asyncio.sleep(run_sec)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    asyncio.run(main())
+
+
+def test_runner():
+    fast = SleepingService(0.05, 0.0)
+    slow = SleepingService(0.05, 0.12)
+    _run_for(AsyncServiceRunner([fast, slow], NoJitterSettings()), 0.33)
+
+    assert 6 <= fast.num_updates <= 7
+    assert fast.num_overruns == 0 and fast.num_coalesced == 0
+    # The second service starts a phase offset later, and its third update is still running when the runner stops.
+    assert slow.num_updates == 2
+    assert slow.num_overruns == 2
+    assert slow.num_coalesced > 0
+    assert fast.num_started == fast.num_stopped == slow.num_started == slow.num_stopped == 1
+
+
+def test_timeout():
+    service = SleepingService(0.1, 10.0, timeout_sec=0.05)
+    _run_for(AsyncServiceRunner([service], NoJitterSettings()), 0.28)
+    assert service.num_timeouts == service.num_updates == 3
+    assert service.num_overruns == 0
+
+
+def test_threaded_service():
+    service = ThreadService()
+    _run_for(AsyncServiceRunner([service], NoJitterSettings()), 0.12)
+
+    assert len(service.update_threads) >= 2
+    assert threading.main_thread() not in service.update_threads
+    assert len(service.callback_threads) == 1
+    assert threading.main_thread() not in service.callback_threads
+
+
+def test_threaded_service_wraps():
+    service = ThreadService()
+    runner = AsyncServiceRunner([service])
+    assert isinstance(runner.services[0], ThreadedService)
+    assert runner.services[0].get_name() == 'ThreadService'
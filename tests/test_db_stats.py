@@ -0,0 +1,41 @@
+import pytest
+
+from pet_monitor import db_stats
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+
+NOW = 1_700_000_000
+DAY_SEC = 60 * 60 * 24
+
+
+@pytest.fixture
+def db_interface(tmp_path):
+    with DBInterface(tmp_path / 'test.sqlite3') as db_interface:
+        db_interface.conn.execute('PRAGMA journal_mode=WAL')
+        for name in ('pet1', 'pet2'):
+            db_interface.add_pet_info(PetInfo(name, IdentifierType.IP, name, DeviceType.PC))
+        for i in range(10):
+            db_interface.add_pet_availability('pet1', True, timestamp=NOW - i * DAY_SEC)
+        db_interface.add_pet_availability('pet2', True, timestamp=NOW)
+        db_interface.add_traffic_for_pet('pet2', 1, 2, timestamp=NOW)
+        yield db_interface
+
+
+def test_storage_report(db_interface):
+    report = db_interface.get_storage_report()
+    tables = {t.name: t for t in report.tables}
+    assert tables['pet_info'].num_rows == 2
+    availability = tables['device_availability']
+    assert availability.num_rows == 11
+    assert availability.oldest_timestamp == NOW - 9 * DAY_SEC
+    assert availability.num_bytes is None or availability.num_bytes >= report.page_size
+    assert tables['cpu_stats'].oldest_timestamp is None
+    assert report.rows_per_pet == {'pet1': {'device_availability': 10},
+                                   'pet2': {'device_availability': 1, 'traffic_stats': 1}}
+    assert report.journal_mode == 'wal'
+    assert report.wal_bytes > 0
+
+    rows = {r[0]: r for r in db_stats.get_table_rows(report, {'device_availability': 7 * DAY_SEC}, now=NOW)}
+    assert rows['device_availability'][4:] == ('9.00 days', '7.00 days', '2.00 days behind')
+    assert rows['traffic_stats'][4:] == ('0.00 days', '', '')
+    assert db_stats.get_pet_rows(report)[0] == ('pet1', '10', '0', '0')
@@ -0,0 +1,124 @@
+from threading import Thread
+
+import pytest
+
+from pet_monitor import ingest
+from pet_monitor.common import (DeviceType, IdentifierType, Mood,
+                                NetworkInterfaceInfo, PetInfo)
+from pet_monitor.ingest import (AvailabilityObservation, IngestQueue,
+                                NetworkTouchObservation, get_writer)
+from pet_monitor.network_db import DBInterface
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+from pet_monitor.settings import IngestSettings
+
+
+class SmallBatchSettings(IngestSettings):
+    max_batch_size = 100
+    max_batch_delay_sec = 0.05
+    put_timeout_sec = 0.05
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    db_path = tmp_path / 'test.sqlite3'
+    monkeypatch.setattr(DBInterface, '_default_db_path', db_path)
+    with DBInterface() as db_interface:
+        db_interface.add_pet_info(PetInfo('pet', IdentifierType.IP, 'ip0', DeviceType.PC))
+    return db_path
+
+
+@pytest.fixture
+def ingest_queue(db_path, monkeypatch):
+    ingest_queue = IngestQueue(SmallBatchSettings())
+    ingest_queue.start()
+    monkeypatch.setattr(ingest, '_default_queue', ingest_queue)
+    yield ingest_queue
+    ingest_queue.stop()
+
+
+def test_batches(ingest_queue):
+    with DBInterface() as db_interface:
+        writer = get_writer(db_interface)
+        assert writer is ingest_queue
+        for i in range(250):
+            writer.add_pet_availability('pet', i % 2 == 0, timestamp=i + 1)
+        writer.update_pet_mood('pet', Mood.SHY)
+        ingest_queue.flush()
+
+        assert len(db_interface.load_availability(['pet'])) == 250
+        assert db_interface.get_specific_pet('pet').mood == Mood.SHY
+    assert 3 <= ingest_queue.num_batches <= 6
+    assert ingest_queue.stats.num_items == 251
+    assert ingest_queue.stats.gauges['max_queue_depth'] > 0
+
+
+def test_stop_writes_queued(db_path):
+    ingest_queue = IngestQueue(SmallBatchSettings())
+    ingest_queue.start()
+    for i in range(50):
+        ingest_queue.add_traffic_for_pet('pet', i, i, timestamp=i + 1)
+    ingest_queue.stop()
+    with DBInterface() as db_interface:
+        assert len(db_interface._load_traffic_df(['pet'], 0)) == 50
+
+
+def test_backpressure(db_path):
+    class TinySettings(SmallBatchSettings):
+        max_queue_size = 2
+
+    # Not started, so nothing drains the queue.
+    ingest_queue = IngestQueue(TinySettings())
+    for i in range(3):
+        ingest_queue.add_pet_availability('pet', True, timestamp=i)
+    assert ingest_queue.get_depth() == 2
+    assert ingest_queue.num_dropped == 1
+    # There's no writer thread to wait for.
+    ingest_queue.flush()
+
+
+def test_retry_calls_on_missing_once(db_path):
+    ingest_queue = IngestQueue(SmallBatchSettings())
+    missing_calls = []
+    touch = NetworkTouchObservation([NetworkInterfaceInfo(timestamp=1, ip='ip1')], missing_calls.append)
+    # The bad observation rolls back the batch, so the touch is written again on its own.
+    batch = [touch, object(), AvailabilityObservation('pet', True, 1)]
+    with DBInterface() as db_interface:
+        ingest_queue._write_batch(db_interface, batch)
+        assert len(db_interface.load_availability(['pet'])) == 1
+    assert missing_calls == [[NetworkInterfaceInfo(timestamp=1, ip='ip1')]]
+    assert ingest_queue.stats.num_errors == 1
+    assert ingest_queue.num_batches == 1
+
+
+def test_differ_touches(ingest_queue):
+    differ = NetworkInfoDiffer()
+    assert differ.write(ingest_queue, NetworkInterfaceInfo(timestamp=1, ip='ip0', mac='mac0'))
+    assert not differ.write(ingest_queue, NetworkInterfaceInfo(timestamp=2, ip='ip0', mac='mac0'))
+    # Pretend an interface that isn't in the DB was already written.
+    differ.last_written[NetworkInterfaceInfo(ip='ip1', mac='mac1')] = {}
+    assert not differ.write(ingest_queue, NetworkInterfaceInfo(timestamp=2, ip='ip1', mac='mac1'))
+    assert differ.flush_touches(ingest_queue, force=True) == 2
+    ingest_queue.flush()
+
+    with DBInterface() as db_interface:
+        assert db_interface.get_network_info() == {NetworkInterfaceInfo(timestamp=2, ip='ip0', mac='mac0')}
+    # The interface that wasn't in the DB is written in full next time.
+    assert differ.write(ingest_queue, NetworkInterfaceInfo(timestamp=3, ip='ip1', mac='mac1'))
+
+
+def test_failed_callback_keeps_writing(ingest_queue):
+    def on_missing(interfaces):
+        raise RuntimeError('callback failed')
+
+    ingest_queue.put(NetworkTouchObservation([NetworkInterfaceInfo(timestamp=1, ip='ip1')], on_missing))
+    flush_thread = Thread(target=ingest_queue.flush, daemon=True)
+    flush_thread.start()
+    flush_thread.join(timeout=5.0)
+    assert not flush_thread.is_alive()
+    assert ingest_queue.stats.num_errors == 1
+
+    ingest_queue.add_pet_availability('pet', True, timestamp=1)
+    ingest_queue.flush()
+    assert ingest_queue.thread is not None and ingest_queue.thread.is_alive()
+    with DBInterface() as db_interface:
+        assert len(db_interface.load_availability(['pet'])) == 1
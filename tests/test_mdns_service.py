@@ -0,0 +1,134 @@
+import asyncio
+import ipaddress
+from types import SimpleNamespace
+
+from pet_monitor import mdns_service
+from pet_monitor.mdns_service import MDNSScraper, MyListener
+from pet_monitor.network_db import DBInterface
+from pet_monitor.settings import MDNSSettings
+
+SERVICE_TYPE = '_http._tcp.local.'
+SERVICE_NAME = f'printer.{SERVICE_TYPE}'
+
+
+class FakeServiceInfo:
+    '''
+    Stands in for `AsyncServiceInfo`, answering once `respond` is set.
+    '''
+    instances: list['FakeServiceInfo'] = []
+    respond: asyncio.Event
+    # Result of the request, or an exception to raise.
+    result: object = True
+
+    def __init__(self, type_: str, name: str) -> None:
+        self.type_ = type_
+        self.name = name
+        self.timeout_ms = None
+        self.server = 'printer.local.'
+        self.properties = {b'mac': b'aa:bb:cc:dd:ee:ff'}
+        FakeServiceInfo.instances.append(self)
+
+    async def async_request(self, zc, timeout_ms: int) -> bool:
+        self.timeout_ms = timeout_ms
+        await FakeServiceInfo.respond.wait()
+        if isinstance(FakeServiceInfo.result, Exception):
+            raise FakeServiceInfo.result
+        return bool(FakeServiceInfo.result)
+
+    def ip_addresses_by_version(self, version):
+        return [ipaddress.ip_address('192.168.1.5')]
+
+    def get_name(self) -> str:
+        return 'printer'
+
+
+def _setup_fake_info(monkeypatch, result=True):
+    monkeypatch.setattr(mdns_service, 'AsyncServiceInfo', FakeServiceInfo)
+    monkeypatch.setattr(FakeServiceInfo, 'instances', [])
+    monkeypatch.setattr(FakeServiceInfo, 'result', result)
+    FakeServiceInfo.respond = asyncio.Event()
+
+
+def test_concurrent_resolves_deduplicated(monkeypatch):
+    async def run():
+        _setup_fake_info(monkeypatch)
+        listener = MyListener(resolve_timeout_sec=2.0)
+        zc = SimpleNamespace(loop=asyncio.get_running_loop())
+        listener.add_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        listener.update_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        listener.update_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        assert len(listener.pending) == 1
+        task = listener.pending[SERVICE_NAME]
+
+        FakeServiceInfo.respond.set()
+        await task
+        assert len(FakeServiceInfo.instances) == 1
+        assert FakeServiceInfo.instances[0].timeout_ms == 2000
+        assert len(listener.pending) == 0
+        entry = listener.entries['printer.local.']
+        assert entry.ip == '192.168.1.5' and entry.services == {'http'} and entry.mac is not None
+
+        # Once the resolution finished, the next update resolves the service again.
+        listener.update_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        await listener.pending[SERVICE_NAME]
+        assert len(FakeServiceInfo.instances) == 2
+
+    asyncio.run(run())
+
+
+def test_resolve_timeout_and_error(monkeypatch, caplog):
+    async def run():
+        # async_request returns False when the device doesn't respond within the timeout.
+        _setup_fake_info(monkeypatch, result=False)
+        FakeServiceInfo.respond.set()
+        listener = MyListener(resolve_timeout_sec=0.5)
+        zc = SimpleNamespace(loop=asyncio.get_running_loop())
+        listener.add_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        await listener.pending[SERVICE_NAME]
+        assert listener.entries == {}
+        assert len(listener.pending) == 0
+
+        FakeServiceInfo.result = OSError('network down')
+        listener.add_service(zc, SERVICE_TYPE, SERVICE_NAME)
+        task = listener.pending[SERVICE_NAME]
+        await asyncio.wait([task])
+        # Let the done callback run.
+        await asyncio.sleep(0)
+        assert len(listener.pending) == 0
+        assert listener.entries == {}
+
+    asyncio.run(run())
+    assert f'Failed to resolve {SERVICE_NAME}: network down' in caplog.text
+
+
+def test_service_type_refresh(monkeypatch, tmp_path):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    found_types = [(SERVICE_TYPE,)]
+    browsers = []
+
+    class FakeServiceTypes:
+        @staticmethod
+        async def async_find(aiozc):
+            return found_types[-1]
+
+    monkeypatch.setattr(mdns_service, 'AsyncZeroconfServiceTypes', FakeServiceTypes)
+    monkeypatch.setattr(mdns_service, 'AsyncServiceBrowser',
+                        lambda zeroconf, service_type, listener: browsers.append(service_type))
+
+    class TestSettings(MDNSSettings):
+        time_between_updates = 10.0
+        service_type_refresh_sec = 30.0
+
+    async def run():
+        scraper = MDNSScraper(TestSettings())
+        scraper.aiozc = SimpleNamespace(zeroconf=None)
+        for last_update, types in ((0.0, (SERVICE_TYPE,)), (10.0, ()), (25.0, (SERVICE_TYPE, '_ipp._tcp.local.'))):
+            found_types.append(types)
+            scraper.last_update = last_update
+            await scraper.update()
+            if scraper.refresh_task is not None:
+                await scraper.refresh_task
+
+    asyncio.run(run())
+    # The refresh at 10s isn't due, and types that are already browsed aren't browsed again.
+    assert browsers == [SERVICE_TYPE, '_ipp._tcp.local.']
@@ -0,0 +1,52 @@
+import tracemalloc
+
+from pet_monitor.async_service import AsyncServiceBase
+from pet_monitor.memory_tracker import MemoryTracker
+from pet_monitor.settings import MemoryTrackerSettings
+
+
+class LeakingService(AsyncServiceBase):
+    def __init__(self) -> None:
+        super().__init__(1.0)
+        self.cache: list[bytes] = []
+
+    def leak(self):
+        self.cache.append(bytes(100_000))
+
+
+def test_growth_by_service(tmp_path, caplog):
+    class TestSettings(MemoryTrackerSettings):
+        control_file = tmp_path / 'trace_memory'
+        update_period_sec = 1.0
+        report_period_sec = 2.0
+
+    caplog.set_level('INFO', logger='pet_monitor')
+    leaking = LeakingService()
+    tracker = MemoryTracker(TestSettings(), [leaking])
+    tracker.last_update = 0.0
+    tracker._update()
+    assert not tracemalloc.is_tracing()
+
+    TestSettings.control_file.touch()
+    tracker._update()
+    try:
+        assert tracemalloc.is_tracing()
+        for _ in range(5):
+            leaking.leak()
+
+        growth = tracker.get_growth(tracemalloc.take_snapshot())['LeakingService']
+        assert growth[0].traceback[0].filename == __file__
+        assert growth[0].size_diff >= 500_000 and growth[0].count_diff >= 5
+
+        # Not due yet.
+        tracker.last_update = 1.0
+        tracker._update()
+        assert 'LeakingService allocations grew' not in caplog.text
+        tracker.last_update = 2.0
+        tracker._update()
+        assert 'LeakingService allocations grew' in caplog.text
+    finally:
+        TestSettings.control_file.unlink()
+        tracker._update()
+    assert not tracemalloc.is_tracing()
+    assert tracker.baseline is None
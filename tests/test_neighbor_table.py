@@ -0,0 +1,77 @@
+import time
+
+from pet_monitor import neighbor_table
+from pet_monitor.neighbor_table import (NeighborTable,
+                                        parse_neighbor_command,
+                                        parse_proc_net_arp)
+
+PROC_NET_ARP = '''\
+IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.1      0x1         0x2         a4:77:33:75:bc:c0     *        eth0
+192.168.1.110    0x1         0x2         7c:83:34:be:62:5c     *        eth0
+192.168.1.120    0x1         0x0         00:00:00:00:00:00     *        eth0
+'''
+
+IP_NEIGH = '''\
+192.168.1.1 dev eth0 lladdr a4:77:33:75:bc:c0 REACHABLE
+192.168.1.120 dev eth0 FAILED
+fe80::1 dev eth0 lladdr a4:77:33:75:bc:c0 router STALE
+'''
+
+ARP = '''\
+? (192.168.1.1) at a4:77:33:75:bc:c0 on en0 ifscope [ethernet]
+? (192.168.1.110) at 7c:83:34:be:62:5 on en0 ifscope [ethernet]
+? (192.168.1.120) at (incomplete) on en0 ifscope [ethernet]
+'''
+
+
+def test_parse_neighbor_tables():
+    assert parse_proc_net_arp(PROC_NET_ARP) == {
+        '192.168.1.1': 'A4-77-33-75-BC-C0',
+        '192.168.1.110': '7C-83-34-BE-62-5C',
+    }
+    assert parse_neighbor_command(IP_NEIGH) == {'192.168.1.1': 'A4-77-33-75-BC-C0'}
+    assert parse_neighbor_command(ARP) == {
+        '192.168.1.1': 'A4-77-33-75-BC-C0',
+        '192.168.1.110': '7C-83-34-BE-62-05',
+    }
+
+
+def test_neighbor_table(monkeypatch):
+    # Don't read the host's table.
+    monkeypatch.setattr(neighbor_table, 'read_neighbor_table', lambda: {})
+    table = NeighborTable(entry_ttl_sec=10.0)
+
+    assert table.get_mac('192.168.1.1') is None
+    table.add_entries([('192.168.1.1', 'a4:77:33:75:bc:c0'), ('192.168.1.2', '00-00-00-00-00-00')])
+    assert table.get_mac('192.168.1.1') == 'A4-77-33-75-BC-C0'
+    assert table.get_entries() == {'192.168.1.1': 'A4-77-33-75-BC-C0'}
+
+    # Stale entries are dropped on refresh.
+    table.entries['192.168.1.1'] = ('A4-77-33-75-BC-C0', time.monotonic() - 20.0)
+    table.refresh(force=True)
+    assert '192.168.1.1' not in table.entries or table.entries['192.168.1.1'][1] > time.monotonic() - 10.0
+
+
+def test_refresh_on_miss(monkeypatch):
+    host_table = {}
+    num_reads = []
+
+    def read_neighbor_table():
+        num_reads.append(1)
+        return dict(host_table)
+
+    monkeypatch.setattr(neighbor_table, 'read_neighbor_table', read_neighbor_table)
+    table = NeighborTable(miss_refresh_interval_sec=10.0)
+    assert table.get_mac('192.168.1.1') is None
+    assert len(num_reads) == 2
+
+    # The device's entry was added after the last read.
+    host_table['192.168.1.1'] = 'A4-77-33-75-BC-C0'
+    table.last_miss_refresh = time.monotonic() - 10.0
+    assert table.get_mac('192.168.1.1') == 'A4-77-33-75-BC-C0'
+    assert len(num_reads) == 3
+
+    # Misses within the interval don't reread the table.
+    assert table.get_mac('192.168.1.2') is None
+    assert len(num_reads) == 3
@@ -2,7 +2,8 @@ import json
 
 from pet_monitor.common import (DeviceType, ExtraNetworkInfoType,
                                 IdentifierType, Mood, NetworkInterfaceInfo,
-                                PetInfo, Relationship, TrafficStats)
+                                NMAPScanProgress, PetInfo, Relationship,
+                                SNMPCapabilities, TrafficStats)
 from pet_monitor.network_db import DBInterface
 
 
@@ -293,3 +294,50 @@ def test_relationships():
         (NAMES[0], NAMES[2], Relationship.FRIENDS),
     }
     assert relationships == relationship_map.relationships
+
+
+def test_snmp_capabilities():
+    conn = DBInterface(":memory:")
+
+    assert conn.get_snmp_capabilities() == {}
+
+    TEST_CAPABILITIES = {
+        SNMPCapabilities('ip0', True, 'HOST-RESOURCES-MIB', 10),
+        SNMPCapabilities('ip1', False, consecutive_failures=1, next_attempt=20),
+    }
+    conn.set_snmp_capabilities(TEST_CAPABILITIES)
+    assert set(conn.get_snmp_capabilities().values()) == TEST_CAPABILITIES
+
+    updated = SNMPCapabilities('ip1', False, consecutive_failures=2, next_attempt=40)
+    conn.set_snmp_capabilities([updated])
+    assert conn.get_snmp_capabilities(['ip1', 'ip2']) == {'ip1': updated}
+
+
+def test_nmap_scan_progress():
+    conn = DBInterface(":memory:")
+
+    assert conn.get_nmap_scan_progress('192.168.1.1-255') is None
+
+    progress = NMAPScanProgress('192.168.1.1-255', next_slice=3, num_slices=10, pass_start=100)
+    conn.set_nmap_scan_progress(progress)
+    assert conn.get_nmap_scan_progress('192.168.1.1-255') == progress
+
+    progress = progress._replace(next_slice=4, last_slice_timestamp=200, last_slice_hosts=5)
+    conn.set_nmap_scan_progress(progress)
+    assert conn.get_nmap_scan_progress('192.168.1.1-255') == progress
+    assert conn.get_nmap_scan_progress('10.0.0.0/16') is None
+
+
+def test_get_extra_network_info_of_type():
+    conn = DBInterface(":memory:")
+
+    assert conn.get_extra_network_info_of_type(ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP) == {}
+
+    device1 = NetworkInterfaceInfo(timestamp=1, ip='ip1', mac='mac1')
+    device2 = NetworkInterfaceInfo(timestamp=2, ip='ip2')
+    conn.add_network_info(device1, {ExtraNetworkInfoType.NMAP_SERVICES: '22(ssh)',
+                                    ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP: '1'})
+    conn.add_network_info(device2, {ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP: '2'})
+    assert conn.get_extra_network_info_of_type(ExtraNetworkInfoType.NMAP_SCAN_TIMESTAMP) == {device1: '1',
+                                                                                             device2: '2'}
+    assert conn.get_extra_network_info_of_type(ExtraNetworkInfoType.NMAP_SERVICES) == {device1: '22(ssh)'}
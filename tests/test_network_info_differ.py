@@ -0,0 +1,70 @@
+from pet_monitor import network_info_differ
+from pet_monitor.common import ExtraNetworkInfoType, NetworkInterfaceInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.network_info_differ import NetworkInfoDiffer
+
+
+def _get_snapshot(timestamp: int) -> list[tuple[NetworkInterfaceInfo, dict[ExtraNetworkInfoType, str]]]:
+    return [(NetworkInterfaceInfo(timestamp=timestamp, ip=f'ip{i}', mac=f'mac{i}'),
+             {ExtraNetworkInfoType.DHCP_NAME: f'name{i}'}) for i in range(20)]
+
+
+def test_network_info_differ():
+    conn = DBInterface(":memory:")
+    differ = NetworkInfoDiffer(touch_interval_sec=1000.0)
+
+    for interface, extra_info in _get_snapshot(1):
+        assert differ.write(conn, interface, extra_info)
+    assert conn.get_network_info() == {interface for interface, _ in _get_snapshot(1)}
+
+    # Unchanged devices are only touched once the interval passes.
+    for interface, extra_info in _get_snapshot(2):
+        assert not differ.write(conn, interface, extra_info)
+    assert not differ.write(conn, NetworkInterfaceInfo(timestamp=2, ip='ip0', mac='mac0'))
+    assert differ.flush_touches(conn) == 0
+    assert conn.get_network_info() == {interface for interface, _ in _get_snapshot(1)}
+    assert differ.flush_touches(conn, force=True) == 20
+    assert conn.get_network_info() == {interface for interface, _ in _get_snapshot(2)}
+    assert differ.num_writes == 20
+
+    # Changes to identity or extra info are written immediately.
+    assert differ.write(conn, NetworkInterfaceInfo(timestamp=3, ip='ip0', mac='mac0'),
+                        {ExtraNetworkInfoType.DHCP_NAME: 'renamed'})
+    assert differ.write(conn, NetworkInterfaceInfo(timestamp=3, ip='ip100', mac='mac1'))
+    assert conn.get_extra_network_info(NetworkInterfaceInfo(ip='ip0')) == {ExtraNetworkInfoType.DHCP_NAME: 'renamed'}
+    assert NetworkInterfaceInfo(timestamp=3, ip='ip100', mac='mac1') in conn.get_network_info()
+
+
+def test_network_info_differ_missing():
+    conn = DBInterface(":memory:")
+    differ = NetworkInfoDiffer()
+
+    interface = NetworkInterfaceInfo(timestamp=1, ip='ip0')
+    assert differ.write(conn, interface)
+    conn.conn.execute('DELETE FROM network_info;')
+
+    # Devices removed by another writer are written in full on the next scrape.
+    assert not differ.write(conn, interface._replace(timestamp=2))
+    assert differ.flush_touches(conn, force=True) == 1
+    assert differ.write(conn, interface._replace(timestamp=3))
+    assert conn.get_network_info() == {interface._replace(timestamp=3)}
+
+
+def test_network_info_differ_forget(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(network_info_differ.time, 'monotonic', lambda: now[0])
+    conn = DBInterface(":memory:")
+    differ = NetworkInfoDiffer(forget_after_sec=100.0)
+
+    for i in range(3):
+        assert differ.write(conn, NetworkInterfaceInfo(timestamp=1, ip=f'ip{i}'))
+    now[0] = 60.0
+    assert not differ.write(conn, NetworkInterfaceInfo(timestamp=2, ip='ip0'))
+    # Only the devices that weren't seen again are forgotten.
+    now[0] = 120.0
+    assert differ.write(conn, NetworkInterfaceInfo(timestamp=3, ip='ip1'))
+    assert set(differ.last_written) == {NetworkInterfaceInfo(ip='ip0'), NetworkInterfaceInfo(ip='ip1')}
+    assert list(differ.last_seen) == [NetworkInterfaceInfo(ip='ip0'), NetworkInterfaceInfo(ip='ip1')]
+    now[0] = 300.0
+    assert differ.write(conn, NetworkInterfaceInfo(timestamp=4, ip='ip2'))
+    assert set(differ.last_written) == {NetworkInterfaceInfo(ip='ip2')}
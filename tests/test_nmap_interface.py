@@ -0,0 +1,109 @@
+import io
+import os
+from threading import Thread
+
+from pet_monitor.nmap.nmap_interface import (NMAPHost, NMAPRunner,
+                                             iter_nmap_xml, split_ip_ranges)
+from pet_monitor.nmap.nmap_scraper import get_rolling_slice
+from pet_monitor.settings import NMAPSettings
+
+TEST_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nmaprun>
+<nmaprun scanner="nmap" args="nmap -oX - --open -T4 192.168.1.100-255" start="1736316315" version="7.94">
+<scaninfo type="connect" protocol="tcp" numservices="1000" services="1-1000"/>
+<host starttime="1736316315" endtime="1736316319"><status state="up" reason="arp-response" reason_ttl="0"/>
+<address addr="192.168.1.100" addrtype="ipv4"/>
+<address addr="A4:77:33:75:BC:C0" addrtype="mac" vendor="Google"/>
+<hostnames>
+</hostnames>
+<ports><extraports state="closed" count="998"/>
+<port protocol="tcp" portid="8008"><state state="open" reason="syn-ack"/><service name="http" method="table"/></port>
+<port protocol="tcp" portid="8009"><state state="open" reason="syn-ack"/><service name="ajp13" method="table"/></port>
+<port protocol="tcp" portid="8443"><state state="filtered" reason="no-response"/></port>
+</ports>
+</host>
+<host starttime="1736316315" endtime="1736316319"><status state="up" reason="arp-response" reason_ttl="0"/>
+<address addr="192.168.1.110" addrtype="ipv4"/>
+<address addr="7C:83:34:BE:62:5C" addrtype="mac"/>
+<hostnames>
+<hostname name="bee.internal" type="PTR"/>
+</hostnames>
+</host>
+<host><status state="down" reason="no-response" reason_ttl="0"/>
+<address addr="192.168.1.111" addrtype="ipv4"/>
+</host>
+<runstats><finished time="1736316319" timestr="Wed Jan  8 06:05:19 2025" elapsed="4.41" exit="success"/>
+<hosts up="2" down="154" total="156"/>
+</runstats>
+</nmaprun>
+'''
+
+
+def test_iter_nmap_xml():
+    summary = {}
+    hosts = list(iter_nmap_xml(io.BytesIO(TEST_XML), summary))
+    assert hosts == [
+        NMAPHost('192.168.1.100', 'A4:77:33:75:BC:C0', (), ((8008, 'http'), (8009, 'ajp13'))),
+        NMAPHost('192.168.1.110', '7C:83:34:BE:62:5C', ('bee.internal',), ()),
+    ]
+    assert summary['command_line'] == 'nmap -oX - --open -T4 192.168.1.100-255'
+    assert summary['scanstats']['elapsed'] == '4.41'
+    assert summary['hosts']['up'] == '2'
+
+
+def test_iter_nmap_xml_incremental():
+    # Hosts should be reported before the rest of the document has been read.
+    class ChunkedStream(io.RawIOBase):
+        def __init__(self, data: bytes):
+            self.data = data
+            self.pos = 0
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            n = min(len(b), 64)
+            chunk = self.data[self.pos:self.pos + n]
+            b[:len(chunk)] = chunk
+            self.pos += len(chunk)
+            return len(chunk)
+
+    stream = ChunkedStream(TEST_XML)
+    hosts = iter_nmap_xml(stream)
+    assert next(hosts).ip == '192.168.1.100'
+    assert stream.pos < TEST_XML.index(b'192.168.1.110')
+
+
+def test_split_ip_ranges():
+    assert split_ip_ranges('192.168.1.1-255', 24) == ['192.168.1.1-255']
+    assert split_ip_ranges('192.168.1.1-255', 25) == ['192.168.1.1-127', '192.168.1.128-255']
+    assert split_ip_ranges('192.168.1.100-130 192.168.1.5', 26) == [
+        '192.168.1.100-127', '192.168.1.128-130', '192.168.1.5']
+    assert split_ip_ranges('10.0.0.0/22', 24) == ['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24', '10.0.3.0/24']
+    assert split_ip_ranges('10.0.0.0/25 router.lan', 24) == ['10.0.0.0/25', 'router.lan']
+    assert len(split_ip_ranges('10.0.0.0/16', 24)) == 256
+
+
+def test_get_rolling_slice():
+    ip_ranges = '10.0.0.0/24 10.0.1.0/28 router.lan'
+    slices = [get_rolling_slice(ip_ranges, 5, i) for i in range(5)]
+    assert [len(s) for s in slices] == [3, 4, 3, 4, 4]
+    assert sum(slices, []) == split_ip_ranges(ip_ranges, 28)
+    assert slices[-1][-1] == 'router.lan'
+
+
+def test_run_shard_large_stderr(tmp_path, monkeypatch):
+    # More stderr than a pipe buffer holds, written before any results.
+    fake_nmap = tmp_path / 'nmap'
+    fake_nmap.write_text('#!/bin/sh\nhead -c 1000000 /dev/zero >&2\ncat "$(dirname "$0")/scan.xml"\n')
+    fake_nmap.chmod(0o755)
+    (tmp_path / 'scan.xml').write_bytes(TEST_XML)
+    monkeypatch.setenv('PATH', f'{tmp_path}{os.pathsep}{os.environ["PATH"]}')
+
+    runner = NMAPRunner(NMAPSettings())
+    results = []
+    thread = Thread(target=lambda: results.append(runner._run_shard('192.168.1.100-255', '')))
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert results[0].num_hosts == 2
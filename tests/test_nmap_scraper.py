@@ -0,0 +1,47 @@
+import pytest
+
+from pet_monitor.network_db import DBInterface
+from pet_monitor.nmap.nmap_interface import ShardResult
+from pet_monitor.nmap.nmap_scraper import NMAPScraper
+from pet_monitor.settings import NMAPSettings
+
+
+class RollingSettings(NMAPSettings):
+    ip_ranges = '10.0.0.0/24'
+    rolling_scan = True
+    time_between_scans = 60.0
+    rolling_pass_sec = 60.0 * 4
+
+
+@pytest.fixture
+def scraper(monkeypatch, tmp_path):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    scraper = NMAPScraper(RollingSettings())
+    scans = []
+    monkeypatch.setattr(scraper.nmap_interface, 'scan_shards', lambda shards, arguments: scans.append(shards))
+    scraper.scans = scans
+    return scraper
+
+
+def test_rolling_progress_gauges(scraper):
+    scraper._update()
+    assert scraper.stats.gauges['rolling_pass_percent'] == 0.0
+    scraper._finish_rolling_slice([ShardResult('10.0.0.0/26', 1.0, 3, {})])
+    assert scraper.stats.gauges['rolling_pass_percent'] == 25.0
+    assert scraper.stats.gauges['rolling_last_slice_hosts'] == 3
+    assert scraper.stats.gauges['rolling_last_slice_timestamp'] > 0
+
+
+def test_no_scan_before_results_handled(scraper):
+    scraper._update()
+    assert len(scraper.scans) == 1
+    # The scan thread finished, but the posted `_handle_results` hasn't run yet.
+    scraper.nmap_interface.shard_results = [ShardResult('10.0.0.0/26', 1.0, 3, {})]
+    scraper.nmap_interface.in_progress = False
+    scraper._update()
+    assert len(scraper.scans) == 1
+
+    scraper._handle_results()
+    assert scraper.progress.next_slice == 1
+    scraper._update()
+    assert len(scraper.scans) == 2
@@ -0,0 +1,90 @@
+import os
+
+from pet_monitor.common import ExtraNetworkInfoType, NetworkInterfaceInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.passive_discovery import (DHCPLease, PassiveDiscovery,
+                                           parse_dnsmasq_leases,
+                                           parse_isc_leases, read_lease_file)
+from pet_monitor.settings import PassiveDiscoverySettings
+
+DNSMASQ_LEASES = '''\
+1736316315 a4:77:33:75:bc:c0 192.168.1.100 chromecast 01:a4:77:33:75:bc:c0
+0 7c:83:34:be:62:5c 192.168.1.110 * *
+100 00:11:22:33:44:55 192.168.1.120 expired *
+duid 00:01:00:01:2c:5e:1a:2b:a4:77:33:75:bc:c0
+1736316315 1234567 fd00::100 chromecast 00:01:00:01:2c:5e:1a:2b:a4:77:33:75:bc:c0
+17363a a4:77:33:75:bc:c1 192.168.1.130 truncated *
+'''
+
+ISC_LEASES = '''\
+# The format of this file is documented in the dhcpd.leases(5) manual page.
+lease 192.168.1.100 {
+  starts 3 2025/01/08 06:05:19;
+  ends 3 2025/01/08 18:05:19;
+  binding state active;
+  next binding state free;
+  hardware ethernet a4:77:33:75:bc:c0;
+  client-hostname "chromecast";
+}
+lease 192.168.1.110 {
+  binding state active;
+  hardware ethernet 7c:83:34:be:62:5c;
+}
+lease 192.168.1.110 {
+  binding state free;
+  hardware ethernet 7c:83:34:be:62:5c;
+}
+lease 192.168.1.120 {
+  binding state active;
+  hardware ethernet 00:11:22:33:44:55;
+  client-hostname "printer";
+}
+'''
+
+
+class LeaseFileOnlySettings(PassiveDiscoverySettings):
+    read_neighbor_table = False
+
+
+def test_parse_leases():
+    assert parse_dnsmasq_leases(DNSMASQ_LEASES, now=1000) == [
+        DHCPLease('192.168.1.100', 'A4-77-33-75-BC-C0', 'chromecast'),
+        DHCPLease('192.168.1.110', '7C-83-34-BE-62-5C'),
+    ]
+    assert parse_isc_leases(ISC_LEASES) == [
+        DHCPLease('192.168.1.100', 'A4-77-33-75-BC-C0', 'chromecast'),
+        DHCPLease('192.168.1.120', '00-11-22-33-44-55', 'printer'),
+    ]
+
+
+def test_passive_discovery(tmp_path, monkeypatch):
+    lease_file = tmp_path / 'dhcpd.leases'
+    lease_file.write_text(ISC_LEASES)
+    assert read_lease_file(str(lease_file)) == parse_isc_leases(ISC_LEASES)
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+
+    service = PassiveDiscovery(LeaseFileOnlySettings(lease_file=str(lease_file)))
+    service._update()
+    with DBInterface() as db_interface:
+        assert {(d.ip, d.mac) for d in db_interface.get_network_info()} == {
+            ('192.168.1.100', 'A4-77-33-75-BC-C0'), ('192.168.1.120', '00-11-22-33-44-55')}
+        assert db_interface.get_extra_network_info(NetworkInterfaceInfo(ip='192.168.1.120')) == {
+            ExtraNetworkInfoType.DHCP_NAME: 'printer'}
+
+    # The file is only read again once it changes.
+    assert not service._update_leases()
+    lease_file.write_text(DNSMASQ_LEASES.replace('1736316315', '0'))
+    os.utime(lease_file, ns=(0, service.lease_file_mtime + 1))
+    service._update()
+    with DBInterface() as db_interface:
+        assert ('192.168.1.110', '7C-83-34-BE-62-5C') in {(d.ip, d.mac) for d in db_interface.get_network_info()}
+
+
+def test_unreadable_lease_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    lease_file = tmp_path / 'dnsmasq.leases'
+    # Not valid UTF-8.
+    lease_file.write_bytes(b'\xff\xfe 0 7c:83:34:be:62:5c 192.168.1.110 * *\n')
+    service = PassiveDiscovery(LeaseFileOnlySettings(lease_file=str(lease_file)))
+    assert not service._update_leases()
+    service._update()
@@ -0,0 +1,50 @@
+import asyncio
+
+from pet_monitor.profiling import PROFILE_ENV_VAR, Profiler, summarize_profiles
+from pet_monitor.settings import ProfilingSettings
+
+
+class SampleSettings(ProfilingSettings):
+    sample_every = 2
+    max_files_per_target = 3
+
+
+def busy_function(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+def test_sampling_and_rotation(monkeypatch, tmp_path):
+    monkeypatch.setattr(Profiler, '_profile_dir', tmp_path)
+    monkeypatch.setattr(Profiler, '_settings', SampleSettings(targets=('busy',)))
+
+    disabled = Profiler('idle')
+    assert disabled.call(busy_function, 10) == 285
+    assert disabled.num_calls == 0
+
+    profiler = Profiler('busy')
+    for _ in range(10):
+        assert profiler.call(busy_function, 1000) == 332833500
+    assert profiler.num_calls == 10
+    assert profiler.num_profiles == 5
+    # Only the newest profiles are kept.
+    assert len(list(tmp_path.glob('busy-*.pstats'))) == 3
+
+    summary = summarize_profiles(tmp_path, 'busy')
+    assert summary.startswith('3 profiles of busy')
+    assert 'busy_function' in summary
+
+
+def test_env_var_and_async(monkeypatch, tmp_path):
+    monkeypatch.setattr(Profiler, '_profile_dir', tmp_path)
+    monkeypatch.setattr(Profiler, '_settings', SampleSettings())
+    monkeypatch.setenv(PROFILE_ENV_VAR, 'other, busy_async')
+
+    async def busy_async():
+        await asyncio.sleep(0)
+        return busy_function(100)
+
+    profiler = Profiler('busy_async')
+    for _ in range(2):
+        asyncio.run(profiler.call_async(busy_async))
+    assert profiler.num_profiles == 1
+    assert 'busy_function' in summarize_profiles(tmp_path)
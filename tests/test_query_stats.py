@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.query_stats import (QueryStats, format_prometheus,
+                                     get_process_name, load_query_stats,
+                                     normalize_sql,
+                                     remove_exited_process_stats)
+from pet_monitor.settings import QueryStatsSettings
+
+
+class AllSlowSettings(QueryStatsSettings):
+    slow_query_sec = 0.0
+
+
+@pytest.fixture
+def query_stats(monkeypatch, tmp_path):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    query_stats = QueryStats('test', AllSlowSettings(), tmp_path / 'queries')
+    monkeypatch.setattr(DBInterface, '_query_stats', query_stats)
+    return query_stats
+
+
+def test_normalize_sql():
+    assert normalize_sql("""
+        SELECT * FROM pet_info -- Comment
+        WHERE name IN ("a","b") AND row_id > 10 AND description = 'it''s';""") == \
+        'SELECT * FROM pet_info WHERE name IN (?, ...) AND row_id > ? AND description = ?'
+    assert normalize_sql('SELECT name1_id FROM t WHERE x IN (?,?,?)') == 'SELECT name1_id FROM t WHERE x IN (?, ...)'
+
+
+def test_timing(query_stats, caplog):
+    with DBInterface() as db_interface:
+        assert isinstance(db_interface.conn.cursor(), sqlite3.Cursor)
+        db_interface.add_pet_info(PetInfo('pet', IdentifierType.IP, 'ip0', DeviceType.PC))
+        for i in range(3):
+            db_interface.add_pet_availability('pet', True, timestamp=i + 1)
+        assert len(db_interface.load_availability(['pet'])) == 3
+        assert len(db_interface.get_pet_info()) == 1
+
+    assert query_stats.methods['add_pet_availability'].count == 3
+    assert query_stats.methods['load_availability'].get_percentile(95.0) > 0.0
+    select = next(s for s in query_stats.statements if s.startswith('SELECT n.name, r.is_availabile'))
+    assert 'IN (?, ...)' in select
+    assert query_stats.statements[select].num_slow == 1
+    # The plan is logged the first time a statement is slow.
+    assert 'SCAN pet_info' in caplog.text
+    assert caplog.text.count('SEARCH pet_info USING COVERING INDEX') == 1
+
+    query_stats.save()
+    text = format_prometheus(load_query_stats(query_stats.path.parent))
+    assert 'lan_pets_db_method_calls_total{process="test",method="add_pet_availability"} 3' in text
+    assert 'lan_pets_db_statement_slow_total{process="test",sql="SELECT name,identifier_type' in text
+
+
+def test_disabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    with DBInterface() as db_interface:
+        assert type(db_interface.conn) is sqlite3.Connection
+        db_interface.get_pet_info()
+
+
+def test_per_process_stats(tmp_path):
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    QueryStats(f'web_{exited.stdout.strip()}', AllSlowSettings(), tmp_path).save()
+    current = QueryStats(get_process_name('web'), AllSlowSettings(), tmp_path)
+    current.save()
+    QueryStats('monitor', AllSlowSettings(), tmp_path).save()
+    assert current.name == f'web_{os.getpid()}'
+    assert len(load_query_stats(tmp_path)) == 3
+
+    remove_exited_process_stats('web', tmp_path)
+    assert sorted(s['name'] for s in load_query_stats(tmp_path)) == ['monitor', current.name]
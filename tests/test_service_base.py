@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from pet_monitor.service_base import Scheduler, ServiceBase, get_next_deadline
+
+
+class CountingService(ServiceBase):
+    def __init__(self, update_period_sec: float, update_sec=0.0) -> None:
+        super().__init__(update_period_sec)
+        self.update_sec = update_sec
+        self.update_times: list[float] = []
+        self.deadlines: list[float] = []
+
+    def _update(self) -> None:
+        self.update_times.append(time.monotonic())
+        self.deadlines.append(self.last_update)
+        time.sleep(self.update_sec)
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    scheduler = Scheduler()
+    monkeypatch.setattr(ServiceBase, 'scheduler', scheduler)
+    return scheduler
+
+
+def test_periodic_updates(scheduler):
+    service = CountingService(0.05)
+    service.run(phase_offset_sec=0.1)
+    start = time.monotonic()
+    time.sleep(0.33)
+    service.stop()
+    assert 4 <= service.num_updates <= 5
+    # The first update is delayed by the phase offset.
+    assert service.update_times[0] - start >= 0.09
+    assert service.num_overruns == 0
+    assert service.num_coalesced == 0
+    assert len(scheduler.heap) == 0
+
+
+def test_overrun_coalesced(scheduler):
+    service = CountingService(0.05, update_sec=0.12)
+    service.run()
+    time.sleep(0.3)
+    service.stop()
+    assert service.num_overruns == service.num_updates
+    assert service.num_coalesced > 0
+    # Every deadline between the first and last update either ran or was coalesced.
+    num_deadlines = round((service.deadlines[-1] - service.deadlines[0]) / 0.05) + 1
+    assert service.num_coalesced == service.stats.num_coalesced == num_deadlines - service.num_updates
+    # Missed deadlines are merged, so updates run back to back instead of queueing up.
+    assert service.num_updates <= 3
+
+
+def test_coalesced_count():
+    service = CountingService(1.0)
+    service._run_update(0.0)
+    # The service is busy for two deadlines, and then the scheduler falls behind and skips the one at 3.
+    service._request_update(1.0)
+    service._request_update(2.0)
+    next_deadline, num_skipped = service._skip_missed_deadlines(2.0, now=4.5)
+    assert (next_deadline, num_skipped) == (4.0, 1)
+    service._request_update(next_deadline)
+    assert service._pending_deadline == 4.0
+    service._run_update(service._pending_deadline)
+    assert service.num_coalesced == service.stats.num_coalesced == 3
+
+
+def test_post(scheduler):
+    service = CountingService(60.0)
+    service.run(phase_offset_sec=60.0)
+    called = threading.Event()
+    callback_threads = []
+
+    def callback():
+        callback_threads.append(threading.current_thread())
+        called.set()
+
+    service.post(callback)
+    assert called.wait(1.0)
+    service.stop()
+    assert callback_threads == [service.thread]
+    assert service.num_updates == 0
+
+
+def test_get_next_deadline():
+    assert get_next_deadline(10.0, 5.0, 12.0) == (15.0, 0)
+    # The deadlines at 15 and 20 passed during the update, so it runs once for the one at 20.
+    assert get_next_deadline(10.0, 5.0, 22.0) == (20.0, 1)
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from pet_monitor.async_service import AsyncServiceBase, AsyncServiceRunner
+from pet_monitor.service_metrics import (ServiceStats, clear_stats,
+                                         format_prometheus, load_stats)
+from pet_monitor.settings import SchedulerSettings
+
+
+class NoJitterSettings(SchedulerSettings):
+    startup_spacing_sec = 0.0
+    jitter_sec = 0.0
+
+
+class WritingService(AsyncServiceBase):
+    def __init__(self, fail_after: int) -> None:
+        super().__init__(0.05)
+        self.fail_after = fail_after
+
+    async def update(self) -> None:
+        if self.num_updates == self.fail_after:
+            raise ValueError('bad data')
+        self.stats.add_items(3)
+
+
+def test_prometheus_format():
+    stats = ServiceStats('Pinger', 60.0)
+    stats.record_update(0.02, False)
+    stats.record_update(120.0, True, num_coalesced=1)
+    stats.add_items(5)
+    text = format_prometheus([stats])
+
+    assert 'lan_pets_service_update_duration_seconds_bucket{service="Pinger",le="0.01"} 0' in text
+    assert 'lan_pets_service_update_duration_seconds_bucket{service="Pinger",le="0.05"} 1' in text
+    assert 'lan_pets_service_update_duration_seconds_bucket{service="Pinger",le="+Inf"} 2' in text
+    assert 'lan_pets_service_update_duration_seconds_count{service="Pinger"} 2' in text
+    assert 'lan_pets_service_overruns_total{service="Pinger"} 1' in text
+    assert 'lan_pets_service_coalesced_total{service="Pinger"} 1' in text
+    assert 'lan_pets_service_items_total{service="Pinger"} 5' in text
+    # No errors yet.
+    assert 'lan_pets_service_last_error_timestamp_seconds{' not in text
+
+
+def test_runner_saves_stats(tmp_path):
+    service = WritingService(fail_after=3)
+    runner = AsyncServiceRunner([service], NoJitterSettings(), tmp_path)
+    with pytest.raises(ExceptionGroup):
+        asyncio.run(runner.run())
+
+    (stats,) = load_stats(tmp_path)
+    assert stats.name == 'WritingService'
+    assert stats.num_updates == 3
+    assert stats.num_items == 9
+    assert sum(stats.bucket_counts) == 3
+    assert stats.num_errors == 1
+    assert 'bad data' in stats.last_error
+    assert stats.last_success_time is not None and stats.last_error_time >= stats.last_success_time
+
+
+def test_clear_stats(tmp_path):
+    stale = ServiceStats('RemovedService', 60.0)
+    stale.path = tmp_path / 'RemovedService.json'
+    stale.record_update(0.1, False)
+    (tmp_path / 'queries').mkdir()
+    assert [s.name for s in load_stats(tmp_path)] == ['RemovedService']
+    clear_stats(tmp_path)
+    assert load_stats(tmp_path) == []
+    assert (tmp_path / 'queries').exists()
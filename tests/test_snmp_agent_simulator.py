@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from pet_monitor.settings import SNMPSettings
+from pet_monitor.snmp.agent_simulator import (SimulatorSettings,
+                                              SNMPAgentSimulator)
+from pet_monitor.snmp.get_device_stats import (discover_query_plan,
+                                               get_attached_ips,
+                                               get_max_if_in_out_bytes,
+                                               get_ram_used_percent,
+                                               get_total_cpu_usage, is_v1_only,
+                                               query_device_stats,
+                                               set_agent_port)
+from pet_monitor.snmp.snmp_scraper import SNMPScraper
+
+TEST_SETTINGS = SimulatorSettings(num_hosts=40, base_ip='127.1.1.1', port=16101, num_cpus=2, num_interfaces=3)
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    set_agent_port(TEST_SETTINGS.port)
+    with SNMPAgentSimulator(TEST_SETTINGS) as simulator:
+        yield simulator
+    set_agent_port(161)
+
+
+@pytest.mark.parametrize('version', ['1', '2c'])
+def test_get_attached_ips(simulator, version):
+    # Small max_repetitions to exercise walks that span multiple responses.
+    results = get_attached_ips(simulator.router_ip, 'public', version, max_repetitions=7)
+    assert results == [(h.ip, h.mac) for h in simulator.hosts[1:]]
+
+
+@pytest.mark.parametrize('version', ['1', '2c'])
+def test_get_device_stats(simulator, version):
+    host = simulator.hosts[1].ip
+    cpu_usage = get_total_cpu_usage(host, 'public', version)
+    assert cpu_usage is not None and 0 <= cpu_usage <= 100
+    mem_usage = get_ram_used_percent(host, 'public', version)
+    assert mem_usage is not None and 0 <= mem_usage <= 100
+    assert get_max_if_in_out_bytes(host, 'public', version) is not None
+
+
+def test_query_plan(simulator):
+    host = simulator.hosts[2].ip
+    plan = discover_query_plan(host, 'public', True, '2c')
+    assert len(plan.cpu_indexes) == TEST_SETTINGS.num_cpus
+    assert plan.ram_index == 2
+    assert plan.if_indexes == (1, 2, 3)
+    assert plan.get_supported_mibs() == ['HOST-RESOURCES-MIB', 'IF-MIB']
+
+    num_requests = simulator.num_requests
+    stats = query_device_stats(host, 'public', plan, '2c')
+    assert simulator.num_requests == num_requests + 1
+    assert stats is not None
+    assert stats.cpu_used_percent is not None
+    assert stats.mem_used_percent is not None
+    assert stats.if_in_out_bytes is not None
+
+    # Plans with rows that no longer exist need to be rediscovered.
+    assert query_device_stats(host, 'public', plan._replace(ram_index=5), '2c') is None
+
+
+def test_v1_fallback():
+    settings = TEST_SETTINGS._replace(num_hosts=1, base_ip='127.1.2.1', v1_only_fraction=1.0)
+    set_agent_port(settings.port)
+    with SNMPAgentSimulator(settings) as simulator:
+        host = simulator.hosts[1].ip
+        assert get_total_cpu_usage(host, 'public', '2c') is not None
+        assert is_v1_only(host)
+    set_agent_port(161)
+
+
+def test_unresponsive_host_not_v1_only():
+    set_agent_port(TEST_SETTINGS.port)
+    # Nothing is listening on this address.
+    host = '127.1.3.1'
+    assert get_total_cpu_usage(host, 'public', '2c') is None
+    assert not is_v1_only(host)
+    set_agent_port(161)
+
+
+def test_concurrent_queries_of_host(simulator):
+    class ExpiredPlanSettings(SNMPSettings):
+        agent_port = TEST_SETTINGS.port
+        # Every query drops the cached plan and rediscovers it.
+        query_plan_ttl_sec = 0.0
+
+    scraper = SNMPScraper(ExpiredPlanSettings())
+    host = simulator.hosts[3].ip
+
+    async def run():
+        semaphore = asyncio.Semaphore(8)
+        return await asyncio.gather(*(scraper._query_host(host, None, semaphore) for _ in range(8)))
+
+    for _ in range(3):
+        for capabilities, stats in asyncio.run(run()):
+            assert stats is not None
+            assert capabilities.responded and capabilities.supported_mibs == 'HOST-RESOURCES-MIB'
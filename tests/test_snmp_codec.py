@@ -0,0 +1,70 @@
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+from pet_monitor.snmp.codec import (PDUType, _decode_response_fast,
+                                    _decode_response_pyasn1,
+                                    get_request_template)
+
+TEST_OIDS = ('1.3.6.1.2.1.25.3.3.1.2.196608', '1.3.6.1.2.1.2.2.1.10.1')
+
+
+def _build_response(version: str, request_id: int, varbinds) -> bytes:
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C if version == '2c' else api.SNMP_VERSION_1]
+    pdu = pMod.GetResponsePDU()
+    pMod.apiPDU.set_defaults(pdu)
+    pMod.apiPDU.set_request_id(pdu, request_id)
+    pMod.apiPDU.set_varbinds(pdu, varbinds)
+    msg = pMod.Message()
+    pMod.apiMessage.set_defaults(msg)
+    pMod.apiMessage.set_community(msg, 'public')
+    pMod.apiMessage.set_pdu(msg, pdu)
+    return encoder.encode(msg)
+
+
+def test_request_template():
+    for version in ('1', '2c'):
+        pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C if version == '2c' else api.SNMP_VERSION_1]
+        template = get_request_template(version, 'public', PDUType.GET, TEST_OIDS)
+        for request_id in (0x00800000, 0x12345678, 0x7FFFFFFE):
+            msg, _ = decoder.decode(template.encode(request_id), asn1Spec=pMod.Message())
+            pdu = pMod.apiMessage.get_pdu(msg)
+            assert int(pMod.apiPDU.get_request_id(pdu)) == request_id
+            assert tuple(str(o) for o, _ in pMod.apiPDU.get_varbinds(pdu)) == TEST_OIDS
+            assert str(pMod.apiMessage.get_community(msg)) == 'public'
+
+
+def test_bulk_request_template():
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    template = get_request_template('2c', 'public', PDUType.GET_BULK, TEST_OIDS[:1], 50)
+    msg, _ = decoder.decode(template.encode(0x01020304), asn1Spec=pMod.Message())
+    pdu = pMod.apiMessage.get_pdu(msg)
+    assert int(pMod.apiBulkPDU.get_request_id(pdu)) == 0x01020304
+    assert int(pMod.apiBulkPDU.get_max_repetitions(pdu)) == 50
+
+
+def test_fast_decode_matches_pyasn1():
+    pMod = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+    varbinds = (
+        ('1.3.6.1.2.1.25.3.3.1.2.196608', pMod.Integer(-5)),
+        ('1.3.6.1.2.1.2.2.1.10.1', pMod.Counter32(4294967295)),
+        ('1.3.6.1.2.1.31.1.1.1.6.1', pMod.Counter64(2**64 - 1)),
+        ('1.3.6.1.2.1.4.22.1.2.1.192.168.1.2', pMod.OctetString(b'\x00\x80\xff\x01\x02\x03')),
+        ('1.3.6.1.2.1.25.2.3.1.2.1', pMod.ObjectIdentifier('1.3.6.1.2.1.25.2.1.2')),
+        ('1.3.6.1.2.1.1.3.0', pMod.TimeTicks(123456)),
+        ('1.3.6.1.2.1.4.20.1.1.192.168.1.1', pMod.IpAddress('192.168.1.1')),
+        ('1.3.6.1.2.1.2.2.1.10.2', api.v2c.EndOfMibView()),
+    )
+    data = _build_response('2c', 0x12345678, varbinds)
+
+    fast = _decode_response_fast(data)
+    slow = _decode_response_pyasn1(data, '2c')
+    assert fast.request_id == slow.request_id == 0x12345678
+    assert fast.error_status == slow.error_status == 0
+    assert [oid for oid, _ in fast.varbinds] == [oid for oid, _ in slow.varbinds]
+    for (_, fast_val), (_, slow_val) in zip(fast.varbinds[:3], slow.varbinds[:3]):
+        assert fast_val == int(slow_val)
+    assert fast.varbinds[3][1] == bytes(slow.varbinds[3][1])
+    assert fast.varbinds[4][1] == str(slow.varbinds[4][1])
+    assert fast.varbinds[5][1] == int(slow.varbinds[5][1])
+    assert fast.varbinds[6][1] == bytes(slow.varbinds[6][1])
+    assert isinstance(fast.varbinds[7][1], api.v2c.EndOfMibView)
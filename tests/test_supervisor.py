@@ -0,0 +1,51 @@
+import logging
+import time
+
+from pet_monitor.async_service import AsyncServiceBase
+from pet_monitor.network_db import DBInterface
+from pet_monitor.settings import SchedulerSettings, SupervisorSettings
+from pet_monitor.supervisor import ServiceSupervisor
+
+
+class FastRestartSettings(SupervisorSettings):
+    restart_backoff_sec = 0.2
+    stop_timeout_sec = 2.0
+
+
+class NoSpacingSettings(SchedulerSettings):
+    startup_spacing_sec = 0.0
+    jitter_sec = 0.0
+
+
+class CrashingService(AsyncServiceBase):
+    def __init__(self, update_period_sec: float) -> None:
+        super().__init__(update_period_sec)
+
+    async def update(self) -> None:
+        logging.getLogger('pet_monitor.test_supervisor').warning('Crashing')
+        raise RuntimeError('crash')
+
+
+class IdleService(AsyncServiceBase):
+    def __init__(self, update_period_sec: float) -> None:
+        super().__init__(update_period_sec)
+
+
+def test_restart_with_backoff(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    caplog.set_level(logging.INFO, logger='pet_monitor')
+    with ServiceSupervisor(FastRestartSettings(), NoSpacingSettings()) as supervisor:
+        supervisor.add(CrashingService, 1.0)
+        supervisor.add(IdleService, 1.0)
+        time.sleep(4.0)
+        crashing, idle = supervisor.workers
+        # Spawning a worker takes a fraction of a second, then it waits 0.2, 0.4, 0.8... seconds before each restart.
+        assert 1 <= crashing.num_restarts <= 4
+        assert crashing.consecutive_failures >= crashing.num_restarts
+        assert idle.num_restarts == 0 and idle.process is not None and idle.process.is_alive()
+
+    assert all(w.process is None for w in supervisor.workers)
+    # Records from the workers are handled by the loggers in this process.
+    messages = [r.getMessage() for r in caplog.records]
+    assert 'Crashing' in messages
+    assert any(m.startswith('CrashingService worker failed') for m in messages)
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from pet_monitor.common import DeviceType, IdentifierType, PetInfo
+from pet_monitor.network_db import DBInterface
+from pet_monitor.settings import TPLinkSettings
+from pet_monitor.tplink_scraper.router_emulator import (EmulatorSettings,
+                                                        TPLinkRouterEmulator)
+from pet_monitor.tplink_scraper.scraper import TPLinkScraper
+from pet_monitor.tplink_scraper.tplink_interface import TPLinkInterface
+
+TEST_SETTINGS = EmulatorSettings(num_clients=300, reservation_fraction=0.2, port=18081, password='hunter2')
+
+
+@pytest.fixture(scope='module')
+def emulator():
+    with TPLinkRouterEmulator(TEST_SETTINGS) as emulator:
+        yield emulator
+
+
+def test_endpoints(emulator):
+    tplink = TPLinkInterface(emulator.address, TEST_SETTINGS.username, TEST_SETTINGS.password)
+    clients = tplink.get_dhcp_clients()
+    assert [c['macaddr'] for c in clients] == [c.mac for c in emulator.clients]
+    reservations = tplink.get_dhcp_static_reservations()
+    assert len(reservations) == sum(c.is_reserved for c in emulator.clients)
+    assert len(tplink.get_traffic_stats()) == TEST_SETTINGS.num_clients
+    assert 'cpu_usage' in tplink.get_cpu_usage()
+    assert tplink.get_interface_status()['normal'][0]['t_name'] == 'LAN1'
+    assert tplink.num_auths == 1
+
+
+def test_bad_password(emulator):
+    tplink = TPLinkInterface(emulator.address, TEST_SETTINGS.username, 'wrong')
+    with pytest.raises(RuntimeError):
+        tplink.get_dhcp_clients()
+
+
+def test_reauth(emulator):
+    tplink = TPLinkInterface(emulator.address, TEST_SETTINGS.username, TEST_SETTINGS.password)
+    tplink.get_dhcp_clients()
+    emulator.invalidate_sessions()
+    tplink.get_dhcp_clients()
+    assert tplink.num_auths == 2
+    assert tplink.endpoint_timing['dhcps?form=client'].num_errors == 0
+
+
+def test_scraper_update(emulator, tmp_path, monkeypatch):
+    monkeypatch.setattr(DBInterface, '_default_db_path', tmp_path / 'test.sqlite3')
+    pet_client = emulator.clients[5]
+    with DBInterface() as db_interface:
+        db_interface.add_pet_info(PetInfo('pet', IdentifierType.MAC, pet_client.mac, DeviceType.PC))
+
+    scraper = TPLinkScraper(TPLinkSettings(emulator.address, TEST_SETTINGS.username, TEST_SETTINGS.password))
+    scraper.last_update = time.monotonic()
+    asyncio.run(scraper.update())
+    assert scraper.stats.num_errors == 0
+
+    with DBInterface() as db_interface:
+        macs = {interface.mac for interface in db_interface.get_network_info()}
+        assert {c.mac for c in emulator.clients} <= macs
+        assert len(db_interface._load_traffic_df(['pet'], 0)) == 1